@@ -2,10 +2,11 @@
 
 import os
 import numpy as np
-from scipy.io.wavfile import write
 from pathlib import Path
 import struct
-from parser_utilities import parse_timestamps
+import warnings
+from parser_utilities import parse_timestamps, process_files_in_parallel
+from functools import partial
 from tqdm import tqdm
 
 PDM_CRYSTAL_CLK = 32e6 # Frequency that feeds the PDM clock generator
@@ -23,12 +24,219 @@ HIGH_SAMPLE_RATE = int((PDM_CRYSTAL_CLK / PDM_CLK_DIV) / PDM_TO_PCM_DIV)
 DECIMATION = 16
 LOW_SAMPLE_RATE = int(HIGH_SAMPLE_RATE/DECIMATION)
 
-def decode_audio_file(path_raw_input, input_dir=None, output_dir=None):
+# Samples are 16-bit little-endian PCM, which is also the sample format of the WAV files
+SAMPLE_WIDTH = 2
+SAMPLE_DTYPE = np.dtype('<i2')
+# RIFF chunk and 16 byte fmt chunk of a PCM WAV file, followed by the header of the data chunk
+WAV_FORMAT_HEADER = struct.Struct('<4sI4s4sIHHIIHH')
+WAV_CHUNK_HEADER = struct.Struct('<4sI')
+WAV_HEADER_SIZE = WAV_FORMAT_HEADER.size + WAV_CHUNK_HEADER.size
+# Size of the header of reference WAV files. The data chunk then starts at a file system block,
+#   so its blocks can be shared with the raw file instead of copied
+REFERENCE_WAV_HEADER_SIZE = 4096
+# Bytes per read and write when the data cannot be copied by the OS
+COPY_BLOCK_SIZE = 1 << 20
+
+def wav_header(num_channels, sample_rate, data_size, header_size=WAV_HEADER_SIZE):
+    """
+    Build the header of a 16-bit PCM WAV file.
+
+    Args:
+        num_channels: Number of channels
+        sample_rate: Samples per second of every channel
+        data_size: Size of the PCM data that follows the header, in bytes
+        header_size: Size of the header. Headers larger than WAV_HEADER_SIZE are padded with a
+            JUNK chunk, which WAV readers skip.
+
+    Returns:
+        The header as bytes
+    """
+    junk_size = header_size - WAV_HEADER_SIZE - WAV_CHUNK_HEADER.size
+    if header_size != WAV_HEADER_SIZE and (junk_size < 0 or junk_size % 2):
+        raise ValueError("Cannot pad a WAV header to {} bytes".format(header_size))
+    if header_size - 8 + data_size > 0xFFFFFFFF:
+        raise ValueError("{} bytes of audio data do not fit in a WAV file".format(data_size))
+    block_align = num_channels * SAMPLE_WIDTH
+    header = WAV_FORMAT_HEADER.pack(b'RIFF', header_size - 8 + data_size, b'WAVE',
+                                    b'fmt ', 16, 1, num_channels, sample_rate, sample_rate * block_align,
+                                    block_align, 8 * SAMPLE_WIDTH)
+    if header_size != WAV_HEADER_SIZE:
+        header += WAV_CHUNK_HEADER.pack(b'JUNK', junk_size) + bytes(junk_size)
+    return header + WAV_CHUNK_HEADER.pack(b'data', data_size)
+
+def copy_file_data(src, dst, count, offset=0):
+    """
+    Copy bytes from one file to the end of another without passing them through Python where
+    the OS allows it: with copy_file_range, else with sendfile, else block by block.
+
+    Args:
+        src: File object opened for reading in binary mode
+        dst: File object opened for writing in binary mode, written at its current position
+        count: Number of bytes to copy
+        offset: Position in src to copy from
+    """
+    dst.flush()
+    dst_offset = dst.tell()
+    in_fd, out_fd = src.fileno(), dst.fileno()
+    copied = 0
+    for name in ('copy_file_range', 'sendfile'):
+        if copied >= count or not hasattr(os, name):
+            continue
+        try:
+            while copied < count:
+                if name == 'copy_file_range':
+                    n = os.copy_file_range(in_fd, out_fd, count - copied, offset + copied, dst_offset + copied)
+                else:
+                    os.lseek(out_fd, dst_offset + copied, os.SEEK_SET)
+                    n = os.sendfile(out_fd, in_fd, offset + copied, count - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            # Not supported for these files, e.g. across file systems or by this OS
+            pass
+
+    src.seek(offset + copied)
+    dst.seek(dst_offset + copied)
+    while copied < count:
+        block = src.read(min(COPY_BLOCK_SIZE, count - copied))
+        if not block:
+            raise IOError("{} ended after {} of {} bytes".format(src.name, offset + copied, offset + count))
+        dst.write(block)
+        copied += len(block)
+    # Also moves the position of dst past the bytes the OS wrote
+    dst.seek(dst_offset + count)
+
+def audio_format(path):
+    """
+    Derive the format of a raw audio file from its name, e.g. 0MICHI3: the first character is 0
+    for stereo and 1 for mono, and HI or LO after MIC selects the sample rate.
+
+    Args:
+        path: Path of the raw audio file
+
+    Returns:
+        Tuple of the sample rate and the number of channels
+    """
+    stem = Path(path).stem
+    if stem[4:6] == "LO":
+        sample_rate = LOW_SAMPLE_RATE  # Low frequency sampling
+    elif stem[4:6] == "HI":
+        sample_rate = HIGH_SAMPLE_RATE  # High frequency sampling
+    else:
+        raise RuntimeError("Unknown sample rate")
+
+    if stem[0] == "0":
+        num_channels = 2  # Stereo
+    elif stem[0] == "1":
+        num_channels = 1  # Mono
+    else:
+        raise RuntimeError("Unknown number of channels")
+    return sample_rate, num_channels
+
+class RawAudioFile(object):
+    """
+    A raw audio file of a midge as a read-only audio source, see open_audio_file.
+
+    Attributes:
+        path: Path of the raw file
+        sample_rate: Samples per second of every channel
+        num_channels: Number of channels
+        samples: Samples backed by a read-only np.memmap of the file, with shape (frames, 2) for
+            stereo and (frames,) for mono, like scipy.io.wavfile.read returns them. A partial frame
+            at the end of the file is left out.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.sample_rate, self.num_channels = audio_format(self.path)
+        num_frames = self.path.stat().st_size // self.frame_size
+        shape = (num_frames, self.num_channels) if self.num_channels > 1 else (num_frames,)
+        if num_frames == 0:
+            # An empty file cannot be mapped
+            self.samples = np.zeros(shape, dtype=SAMPLE_DTYPE)
+        else:
+            self.samples = np.memmap(self.path, dtype=SAMPLE_DTYPE, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def frame_size(self):
+        """Bytes per frame, one sample of every channel."""
+        return self.num_channels * SAMPLE_WIDTH
+
+    @property
+    def duration(self):
+        """Length of the recording in seconds."""
+        return len(self) / self.sample_rate
+
+    def read(self, start=0, stop=None):
+        """
+        Read a range of frames from the file.
+
+        Args:
+            start: Index of the first frame
+            stop: Index after the last frame, or None to read to the end
+
+        Returns:
+            Array of the samples, in memory
+        """
+        return np.array(self.samples[start:stop])
+
+    def read_seconds(self, start=0.0, end=None):
+        """
+        Read the frames between two moments of the recording.
+
+        Args:
+            start: Seconds from the start of the recording
+            end: Seconds from the start of the recording to stop at, or None to read to the end
+
+        Returns:
+            Array of the samples, in memory
+        """
+        return self.read(int(round(start * self.sample_rate)),
+                         None if end is None else int(round(end * self.sample_rate)))
+
+    def save_wav(self, out_file, header_size=WAV_HEADER_SIZE):
+        """
+        Write the audio to a WAV file. The samples are copied as they are by copy_file_data,
+        without loading them.
+
+        Args:
+            out_file: Path of the WAV file
+            header_size: Size of the WAV header, REFERENCE_WAV_HEADER_SIZE to write a reference WAV
+                whose data can share its blocks with the raw file on file systems that support
+                it (e.g. btrfs and XFS)
+        """
+        data_size = len(self) * self.frame_size
+        with self.path.open("rb") as src, Path(out_file).open("wb") as dst:
+            dst.write(wav_header(self.num_channels, self.sample_rate, data_size, header_size))
+            copy_file_data(src, dst, data_size)
+
+def open_audio_file(path):
+    """
+    Open a raw MICHI or MICLO file as audio without converting it, e.g. to read the ten
+    seconds after the first minute:
+
+        audio = open_audio_file('midge_1/0MICHI3')
+        samples = audio.read_seconds(60, 70)
+
+    Args:
+        path: Path of the raw audio file
+
+    Returns:
+        RawAudioFile of the file
     """
-    Decode a single audio file and save as WAV.
+    return RawAudioFile(path)
+
+def decode_audio_file(path_raw_input, input_dir=None, output_dir=None, reference=False):
+    """
+    Decode a single audio file and save as WAV. The raw samples are copied into the WAV file
+    as they are, without loading the file into memory.
     
     Args:
         path_raw_input: Path to the raw audio file
+        reference: Write a reference WAV (see RawAudioFile.save_wav) instead of a plain one
     """
     if not (path_raw_input.is_file() and path_raw_input.suffix == "" and
             ("MICLO" in path_raw_input.stem or "MICHI" in path_raw_input.stem)):
@@ -42,46 +250,61 @@ def decode_audio_file(path_raw_input, input_dir=None, output_dir=None):
     else:
         out_file = path_raw_input.parent / (path_raw_input.stem + ".wav")
 
-    buffer_dtype = np.int16 # 16-bit PCM
-    if path_raw_input.stem[4:6] == "LO":
-        sample_rate = LOW_SAMPLE_RATE  # Low frequency sampling
-    elif path_raw_input.stem[4:6] == "HI":
-        sample_rate = HIGH_SAMPLE_RATE  # High frequency sampling
-    else:
-        raise RuntimeError("Unknown number of channels")
+    RawAudioFile(path_raw_input).save_wav(out_file, REFERENCE_WAV_HEADER_SIZE if reference else WAV_HEADER_SIZE)
 
-    if path_raw_input.stem[0] == "0":
-        num_channels = 2  # Stereo
-    elif path_raw_input.stem[0] == "1":
-        num_channels = 1  # Mono
-    else:
-        raise RuntimeError("Unknown number of channels")
+# Formats the timestamps of the audio can be saved in: .npy holds the raw int64 ms since the
+#   epoch, compact and exact, and .csv the times as text
+TIMESTAMP_FORMATS = ['npy', 'csv']
+DEFAULT_TIMESTAMP_FORMATS = ['npy']
 
-    with path_raw_input.open("rb") as f:
-        raw_data = f.read()
-    
-    audio_data = np.frombuffer(raw_data, dtype=buffer_dtype)
+def read_int64_little_endian(file_path):
+    """
+    Read a file of little-endian int64 values, like the .D timestamp files. A partial value at
+    the end of the file is left out.
 
-    if num_channels == 2:
-        audio_data = audio_data.reshape(-1, 2)
+    Args:
+        file_path: Path of the file
 
-    # Save the data in a WAV file
-    write(filename=str(out_file), rate=sample_rate, data=audio_data)
+    Returns:
+        int64 array of the values
+    """
+    size = os.path.getsize(file_path)
+    return np.fromfile(file_path, dtype='<i8', count=size // 8)
 
-def read_int64_little_endian(file_path):
-    results = []
-    with open(file_path, 'rb') as f:
-        while True:
-            chunk = f.read(8)
-            if len(chunk) < 8:
-                break  # End of file
-            value = struct.unpack('<q', chunk)[0]  # '<q' = little-endian signed int64
-            results.append(value)
-    return results
+def write_times_csv(times, out_file):
+    """
+    Write times to a CSV file with index and time columns, in one write.
 
-def decode_timestamp_file(path_input, input_dir=None, output_dir=None):
+    Args:
+        times: Array of the times as strings
+        out_file: Path of the CSV file
     """
-    Decode a single timestamp file (.D file) and save results as -ts.csv files with datetime format.
+    rows = np.char.add(np.char.add(np.arange(len(times)).astype(str), ","), times)
+    with open(out_file, "w") as f:
+        f.write(",time\n")
+        f.write("".join(np.char.add(rows, "\n").tolist()))
+
+def read_times_csv(path):
+    """
+    Read the time column of a CSV file written by write_times_csv.
+
+    Args:
+        path: Path of the CSV file
+
+    Returns:
+        Array of the times as strings
+    """
+    with warnings.catch_warnings():
+        # A file with only the header is read as no times
+        warnings.simplefilter("ignore", UserWarning)
+        return np.loadtxt(path, dtype=str, delimiter=",", skiprows=1, usecols=1, ndmin=1)
+
+def decode_timestamp_file(path_input, input_dir=None, output_dir=None, local_time=True,
+                          formats=DEFAULT_TIMESTAMP_FORMATS):
+    """
+    Decode a single timestamp file (.D file) and save the results as -ts.npy and/or -ts.csv files.
+    The .npy file holds the raw int64 ms since the epoch. The CSV file has the times in ISO 8601
+    format, in local time unless local_time is False.
     """
     if not (path_input.is_file() and path_input.suffix == ".D"):
         return
@@ -89,44 +312,61 @@ def decode_timestamp_file(path_input, input_dir=None, output_dir=None):
     print("Timestamp input file " + str(path_input))
     if input_dir and output_dir:
         rel_path = path_input.relative_to(input_dir)
-        out_file = output_dir / rel_path.parent / (path_input.stem + "-ts.csv")
-        out_file.parent.mkdir(parents=True, exist_ok=True)
+        out_base = output_dir / rel_path.parent / (path_input.stem + "-ts")
+        out_base.parent.mkdir(parents=True, exist_ok=True)
     else:
-        out_file = path_input.parent / (path_input.stem + "-ts.csv")
+        out_base = path_input.parent / (path_input.stem + "-ts")
     try:
         timestamp_data = read_int64_little_endian(path_input)
-        # Convert timestamps to datetime format
-        datetime_data = parse_timestamps(timestamp_data, str(path_input))
+        out_files = []
+        if 'npy' in formats:
+            out_files.append(str(out_base) + ".npy")
+            np.save(out_files[-1], timestamp_data)
+        if 'csv' in formats:
+            # Convert timestamps to datetime format
+            datetime_data = parse_timestamps(timestamp_data, str(path_input), local_time)
+            out_files.append(str(out_base) + ".csv")
+            write_times_csv(np.datetime_as_string(datetime_data), out_files[-1])
         
-        # Save the datetime data as a CSV file with index and time columns
-        with out_file.open("w") as f:
-            f.write(",time\n")
-            for i, datetime_val in enumerate(datetime_data):
-                f.write("{},{}\n".format(i, datetime_val))
-        
-        print("Successfully decoded {} timestamps to {}".format(len(datetime_data), out_file))
+        print("Successfully decoded {} timestamps to {}".format(len(timestamp_data), ", ".join(out_files)))
     except Exception as e:
         print("Error processing {}: {}".format(path_input, e))
 
-def process_input_file(input_path, input_dir=None, output_dir=None):
+def process_input_file(input_path, input_dir=None, output_dir=None, local_time=True, reference=False,
+                       timestamp_formats=DEFAULT_TIMESTAMP_FORMATS):
     # Process audio files
     if input_path.is_file() and input_path.suffix == "" and ("MICLO" in input_path.stem or "MICHI" in input_path.stem):
-        decode_audio_file(input_path, input_dir, output_dir)
+        decode_audio_file(input_path, input_dir, output_dir, reference)
     # Process timestamp files
     elif input_path.is_file() and input_path.suffix == ".D":
-        decode_timestamp_file(input_path, input_dir, output_dir)
+        decode_timestamp_file(input_path, input_dir, output_dir, local_time, timestamp_formats)
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description='Parser for the audio data and timestamps obtained from Mingle Midges')
     parser.add_argument('--fn', required=True, help='Please enter the path to the folder')
     parser.add_argument('--output_dir', required=False, help='Optional output directory (will mirror input structure)')
+    parser.add_argument('--utc', action='store_true', help='Write the timestamps in UTC instead of local time')
+    parser.add_argument('--ts_format', nargs='+', default=DEFAULT_TIMESTAMP_FORMATS, choices=TIMESTAMP_FORMATS,
+                        help='Formats to save the timestamps in: npy for the raw int64 ms since the epoch, csv for text')
+    parser.add_argument('--reference', action='store_true',
+                        help='Write reference WAVs, which share their data with the raw files on file systems that support it')
+    parser.add_argument('--jobs', default=1, type=int, help='Number of files to decode in parallel processes, 0 for one per CPU')
     args = parser.parse_args()
 
     input_dir = Path(args.fn)
     output_dir = Path(args.output_dir) if args.output_dir else None
-    for root_str, _, files in tqdm(list(os.walk(input_dir)), desc="Files"):
-        root = Path(root_str)
-        for filename in files:
-            input_path = root / filename
-            process_input_file(input_path, input_dir=input_dir if output_dir else None, output_dir=output_dir)
+    if args.jobs != 1:
+        input_paths = [Path(root_str) / filename for root_str, _, files in os.walk(input_dir) for filename in files]
+        process_files_in_parallel(partial(process_input_file, input_dir=input_dir if output_dir else None,
+                                          output_dir=output_dir, local_time=not args.utc,
+                                          reference=args.reference, timestamp_formats=args.ts_format),
+                                  input_paths, args.jobs)
+    else:
+        for root_str, _, files in tqdm(list(os.walk(input_dir)), desc="Files"):
+            root = Path(root_str)
+            for filename in files:
+                input_path = root / filename
+                process_input_file(input_path, input_dir=input_dir if output_dir else None, output_dir=output_dir,
+                                   local_time=not args.utc, reference=args.reference,
+                                   timestamp_formats=args.ts_format)
@@ -3,7 +3,7 @@ import time
 import logging
 import sys
 import struct
-import Queue
+import collections
 
 # Scan every 1 seconds, where each scan lasts for 0.25 seconds
 DEFAULT_SCAN_WINDOW = 250
@@ -15,7 +15,21 @@ DEFAULT_IMU_DATARATE = 50
 
 DEFAULT_MICROPHONE_MODE = 0	#Valid options: 0=Stereo, 1=Mono
 
+# Number of chunk requests kept in flight while downloading a file
+DEFAULT_DOWNLOAD_WINDOW = 4
+# Seconds to wait for a chunk before requesting it again, and how often to try
+DEFAULT_CHUNK_TIMEOUT = 2.0
+DEFAULT_CHUNK_ATTEMPTS = 5
+# How often download_all_files tries each file; later attempts resume where the last one stopped
+DEFAULT_DOWNLOAD_ATTEMPTS = 3
+# Number of files list_files asks for per request. The badge sends 64 bytes of every response,
+#   counted from the start of Response, which only holds the header and 2 complete files; the
+#   timestamp of a 3rd file would be cut off.
+LIST_FILES_PAGE_SIZE = 2
+
 from badge_protocol import *
+from response_dispatcher import ResponseDispatcher
+from download_utilities import ChunkFileWriter, DownloadManifest, crc32_file, resume_from_prefix
 
 logger = logging.getLogger(__name__)
 
@@ -47,18 +61,10 @@ def timestamps_to_time(timestamp_seconds, timestamp_miliseconds):
 class OpenBadge(object):
     def __init__(self, connection):
         self.connection = connection
-        self.status_response_queue = Queue.Queue()
-        self.start_microphone_response_queue = Queue.Queue()
-        self.start_scan_response_queue = Queue.Queue()
-        self.start_imu_response_queue = Queue.Queue()
-        self.free_sdc_space_response_queue = Queue.Queue()
-        self.sdc_errase_all_response_queue = Queue.Queue()
-        self.get_imu_data_response_queue = Queue.Queue()
-        self.get_fw_version_response_queue = Queue.Queue()
-        self.list_files_response_queue = Queue.Queue()
-        self.start_download_response_queue = Queue.Queue()
-        self.download_chunk_response_queue = Queue.Queue()
-        self.get_file_checksum_response_queue = Queue.Queue()
+        self.dispatcher = ResponseDispatcher(connection)
+        # Download chunks are matched up by their chunk_index instead of in request order
+        self.chunk_responses = collections.deque()
+        self.dispatcher.set_handler(Response_download_chunk_response_tag, self.chunk_responses.append)
         
 
     # Helper function to send a BadgeMessage `command_message` to a device, expecting a response
@@ -84,11 +90,16 @@ class OpenBadge(object):
             logger.info("No response expected, transmission successful.")
             return True
 
-    def send_request(self, request_message):
-        # Clear the queue of any stale data before sending a new command
-        if not self.connection.rx_queue.empty():
-            with self.connection.rx_queue.mutex:
-                self.connection.rx_queue.queue.clear()
+    # Sends `request_message` to the badge without waiting for its response.
+    #   If response_tag is given, returns a ResponseFuture() for the response with that tag, so
+    #   several requests can be sent before waiting for the first response.
+    #   Set clear_buffer to False when other responses are still on their way, e.g. while
+    #   several requests are in flight, so their bytes are not thrown away.
+    def send_request(self, request_message, clear_buffer=True, response_tag=None):
+        # Clear the buffer of any stale data before sending a new command
+        if clear_buffer:
+            self.connection.rx_buffer.clear()
+            self.dispatcher.cancel_all("Response was discarded by a later request")
 
         serialized_request = request_message.encode()
 
@@ -96,52 +107,28 @@ class OpenBadge(object):
         serialized_request_len = struct.pack("<H", len(serialized_request))
         serialized_request = serialized_request_len + serialized_request
 
-        logger.debug(
-            "Sending: {}, Raw: {}".format(
-                request_message, serialized_request.encode("hex")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Sending: {}, Raw: {}".format(
+                    request_message, serialized_request.encode("hex")
+                )
             )
-        )
 
-        self.connection.send(serialized_request, response_len=0)
-
-    def receive_response(self):
-        response_len = struct.unpack("<H", self.connection.await_data(2))[0]
-        logger.debug("Wait response len: " + str(response_len))
-        serialized_response = self.connection.await_data(response_len)
-
-        response_message = Response.decode(serialized_response)
-
-        queue_options = {
-            Response_status_response_tag: self.status_response_queue,
-            Response_start_microphone_response_tag: self.start_microphone_response_queue,
-            Response_start_scan_response_tag: self.start_scan_response_queue,
-            Response_start_imu_response_tag: self.start_imu_response_queue,
-            Response_free_sdc_space_response_tag: self.free_sdc_space_response_queue,
-            Response_sdc_errase_all_response_tag: self.sdc_errase_all_response_queue,
-            Response_get_imu_data_response_tag: self.get_imu_data_response_queue,
-            Response_get_fw_version_response_tag: self.get_fw_version_response_queue,
-            Response_list_files_response_tag: self.list_files_response_queue,
-            Response_start_download_response_tag: self.start_download_response_queue,
-            Response_download_chunk_response_tag: self.download_chunk_response_queue,
-            Response_get_file_checksum_response_tag: self.get_file_checksum_response_queue
-        }
-        response_options = {
-            Response_status_response_tag: response_message.type.status_response,
-            Response_start_microphone_response_tag: response_message.type.start_microphone_response,
-            Response_start_scan_response_tag: response_message.type.start_scan_response,
-            Response_start_imu_response_tag: response_message.type.start_imu_response,
-            Response_free_sdc_space_response_tag: response_message.type.free_sdc_space_response,
-            Response_sdc_errase_all_response_tag: response_message.type.sdc_errase_all_response,
-            Response_get_imu_data_response_tag: response_message.type.get_imu_data_response,
-            Response_get_fw_version_response_tag: response_message.type.get_fw_version_response,
-            Response_list_files_response_tag: response_message.type.list_files_response,
-            Response_start_download_response_tag: response_message.type.start_download_response,
-            Response_download_chunk_response_tag: response_message.type.download_chunk_response,
-            Response_get_file_checksum_response_tag: response_message.type.get_file_checksum_response
-        }
-        queue_options[response_message.type.which].put(
-            response_options[response_message.type.which]
-        )
+        future = None
+        if response_tag is not None:
+            future = self.dispatcher.expect(response_tag)
+        try:
+            self.connection.send(serialized_request, response_len=0)
+        except Exception:
+            if future is not None:
+                self.dispatcher.forget(future)
+            raise
+        return future
+
+    # Waits for the next response from the badge and hands it to the request waiting for it.
+    # Returns False if no response arrived within `timeout` seconds (None waits forever).
+    def receive_response(self, timeout=None):
+        return self.dispatcher.receive(timeout)
 
     # Sends a status request to this Badge.
     #   Optional fields new_id and new_group number will set the badge's id
@@ -165,16 +152,7 @@ class OpenBadge(object):
             request.type.status_request.badge_assignement.group = new_group_number
             request.type.status_request.has_badge_assignement = True
 
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.status_response_queue.mutex:
-            self.status_response_queue.queue.clear()
-
-        while self.status_response_queue.empty():
-            self.receive_response()
-
-        return self.status_response_queue.get()
+        return self.send_request(request, response_tag=Response_status_response_tag).result()
 
     # Sends a request to the badge to start recording microphone data.
     # Returns a StartRecordResponse() representing the badges response.
@@ -192,15 +170,7 @@ class OpenBadge(object):
         request.type.start_microphone_request.timestamp.ms = timestamp_ms
         request.type.start_microphone_request.mode = mode
 
-        self.send_request(request)
-
-        with self.start_microphone_response_queue.mutex:
-            self.start_microphone_response_queue.queue.clear()
-
-        while self.start_microphone_response_queue.empty():
-            self.receive_response()
-
-        return self.start_microphone_response_queue.get()
+        return self.send_request(request, response_tag=Response_start_microphone_response_tag).result()
 
     # Sends a request to the badge to stop recording.
     # Returns True if request was successfuly sent.
@@ -233,16 +203,7 @@ class OpenBadge(object):
         request.type.start_scan_request.window = window_ms
         request.type.start_scan_request.interval = interval_ms
 
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.start_scan_response_queue.mutex:
-            self.start_scan_response_queue.queue.clear()
-
-        while self.start_scan_response_queue.empty():
-            self.receive_response()
-
-        return self.start_scan_response_queue.get()
+        return self.send_request(request, response_tag=Response_start_scan_response_tag).result()
 
     # Sends a request to the badge to stop scanning.
     # Returns True if request was successfuly sent.
@@ -276,16 +237,7 @@ class OpenBadge(object):
         request.type.start_imu_request.gyr_fsr = gyr_fsr
         request.type.start_imu_request.datarate = datarate
 
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.start_imu_response_queue.mutex:
-            self.start_imu_response_queue.queue.clear()
-
-        while self.start_imu_response_queue.empty():
-            self.receive_response()
-
-        return self.start_imu_response_queue.get()
+        return self.send_request(request, response_tag=Response_start_imu_response_tag).result()
 
     def stop_imu(self):
 
@@ -325,16 +277,7 @@ class OpenBadge(object):
         request.type.which = Request_free_sdc_space_request_tag
         request.type.free_sdc_space_request = FreeSDCSpaceRequest()
 
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.free_sdc_space_response_queue.mutex:
-            self.free_sdc_space_response_queue.queue.clear()
-
-        while self.free_sdc_space_response_queue.empty():
-            self.receive_response()
-
-        return self.free_sdc_space_response_queue.get()
+        return self.send_request(request, response_tag=Response_free_sdc_space_response_tag).result()
 
 
     def sdc_errase_all(self):
@@ -343,16 +286,7 @@ class OpenBadge(object):
         request.type.which = Request_sdc_errase_all_request_tag
         request.type.sdc_errase_all_request = ErraseAllRequest()
 
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.sdc_errase_all_response_queue.mutex:
-            self.sdc_errase_all_response_queue.queue.clear()
-
-        while self.sdc_errase_all_response_queue.empty():
-            self.receive_response()
-
-        return self.sdc_errase_all_response_queue.get()
+        return self.send_request(request, response_tag=Response_sdc_errase_all_response_tag).result()
 
     def get_imu_data(self):
 
@@ -361,16 +295,7 @@ class OpenBadge(object):
         request.type.get_imu_data_request = GetIMUDataRequest()
         request.type.get_imu_data_request.timestamp = Timestamp()
 
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.get_imu_data_response_queue.mutex:
-            self.get_imu_data_response_queue.queue.clear()
-
-        while self.get_imu_data_response_queue.empty():
-            self.receive_response()
-
-        return self.get_imu_data_response_queue.get()
+        return self.send_request(request, response_tag=Response_get_imu_data_response_tag).result()
     
     def get_fw_version(self):
 
@@ -378,40 +303,17 @@ class OpenBadge(object):
         request.type.which = Request_get_fw_version_request_tag
         request.type.get_fw_version_request = GetFWVersionRequest()
 
-        self.send_request(request)
-
-        # Clear the queue before receiving
-        with self.get_fw_version_response_queue.mutex:
-            self.get_fw_version_response_queue.queue.clear()
-
-        while self.get_fw_version_response_queue.empty():
-            self.receive_response()
-
-        version_response = self.get_fw_version_response_queue.get()
+        version_response = self.send_request(request, response_tag=Response_get_fw_version_response_tag).result()
         version_response.version = version_response.version.replace("\x00", "")
         return version_response
-        return self.get_fw_version_response_queue.get()
     
+    # Returns the files on the sdcard from start_index on, as dicts with their filename, size and timestamp.
     def list_files(self, start_index=0):
         files = []
         current_start = start_index
 
         while True:
-            request = Request()
-            request.type.which = Request_list_files_request_tag
-            request.type.list_files_request = ListFilesRequest()
-            request.type.list_files_request.max_files = 3
-            request.type.list_files_request.start_index = current_start
-
-            self.send_request(request)
-
-            with self.list_files_response_queue.mutex:
-                self.list_files_response_queue.queue.clear()
-
-            while self.list_files_response_queue.empty():
-                self.receive_response()
-
-            response = self.list_files_response_queue.get()
+            response = self._request_file_list_page(current_start)
 
             for i in range(len(response.files)):
                 clean_filename = response.files[i].filename.replace('\x00', '').strip()
@@ -421,15 +323,38 @@ class OpenBadge(object):
                         'size': response.files[i].file_size,
                         'timestamp': response.files[i].timestamp
                     })
-            
-            if (current_start + response.header.file_count) >= response.header.total_files:
+
+            # Page by the files that were decoded, which can be fewer than were asked for
+            if not response.files or (current_start + len(response.files)) >= response.header.total_files:
                 break
 
-            current_start += response.header.file_count
+            current_start += len(response.files)
 
         return files
+
+    def _request_file_list_page(self, start_index):
+        request = Request()
+        request.type.which = Request_list_files_request_tag
+        request.type.list_files_request = ListFilesRequest()
+        request.type.list_files_request.max_files = LIST_FILES_PAGE_SIZE
+        request.type.list_files_request.start_index = start_index
+
+        return self.send_request(request, response_tag=Response_list_files_response_tag).result()
     
-    def download_file(self, filename, local_path=None, verify_checksum=True, show_progress=True):
+    # Downloads `filename` from the badge to `local_path`.
+    #   Up to window_size chunk requests are kept in flight at once, so the BLE round trip is
+    #   not paid for every chunk. Chunks that are not answered within chunk_timeout seconds
+    #   are requested again.
+    def download_file(self, filename, local_path=None, verify_checksum=True, show_progress=True,
+                      window_size=DEFAULT_DOWNLOAD_WINDOW, chunk_timeout=DEFAULT_CHUNK_TIMEOUT):
+        checksum = self._download_file(filename, local_path, verify_checksum, show_progress,
+                                       window_size, chunk_timeout)
+        return checksum is not None
+
+    # Implements download_file(), returning the CRC32 of the downloaded file, or None if it
+    #   did not match the checksum reported by the badge.
+    def _download_file(self, filename, local_path=None, verify_checksum=True, show_progress=True,
+                       window_size=DEFAULT_DOWNLOAD_WINDOW, chunk_timeout=DEFAULT_CHUNK_TIMEOUT):
         import os
         if local_path is None:
             local_path = filename
@@ -438,159 +363,200 @@ class OpenBadge(object):
         if os.path.exists(local_path) and verify_checksum:
             if show_progress:
                 print("File {} already exists. Verifying checksum...".format(local_path))
-            if self._verify_file_checksum(filename, local_path):
+            expected_checksum = self._get_file_checksum(filename)
+            if expected_checksum is not None and crc32_file(local_path) == expected_checksum:
                 if show_progress:
                     print("File already downloaded and checksum verified.")
-                return True
+                return expected_checksum
             else:
                 if show_progress:
                     print("Checksum mismatch. Re-downloading file.")
 
-        request = Request()
-        request.type.which = Request_start_download_request_tag
-        request.type.start_download_request = StartDownloadRequest()
-        request.type.start_download_request.filename = filename
-        self.send_request(request)
-        
-        with self.start_download_response_queue.mutex:
-            self.start_download_response_queue.queue.clear()
-        
-        while self.start_download_response_queue.empty():
-            self.receive_response()
-        start_response = self.start_download_response_queue.get()
-        
-        if not start_response.success:
-            raise Exception("Failed to start download: {}".format(start_response.success))
-        
+        start_response = self._start_download(filename)
+
         file_size = start_response.file_size
         total_chunks = start_response.total_chunks
         if show_progress:
             print("Downloading {} ({} chunks) to {}".format(filename, total_chunks, local_path))
-        downloaded_data = bytearray()
-        running_total = 0
-        
+        writer = ChunkFileWriter(local_path, file_size, total_chunks, DOWNLOAD_CHUNK_SIZE)
+        if writer.resumed and show_progress:
+            print("Resuming download, {} of {} chunks already downloaded".format(writer.received_chunks(), total_chunks))
+
         progress_bar = None
         if show_progress:
             try:
                 from tqdm import tqdm
-                progress_bar = tqdm(total=total_chunks, desc="Downloading {}".format(filename), unit="chunk")
+                progress_bar = tqdm(total=total_chunks, initial=writer.received_chunks(),
+                                    desc="Downloading {}".format(filename), unit="chunk")
             except ImportError:
                 print("tqdm not available, showing basic progress.")
-        
-        try:
-            for chunk_index in range(total_chunks):
-                chunk_request = Request()
-                chunk_request.type.which = Request_download_chunk_request_tag
-                chunk_request.type.download_chunk_request = DownloadChunkRequest()
-                chunk_request.type.download_chunk_request.chunk_index = chunk_index
-                self.send_request(chunk_request)
-                
-                # Clear queue and wait for response
-                with self.download_chunk_response_queue.mutex:
-                    self.download_chunk_response_queue.queue.clear()
-                
-                while self.download_chunk_response_queue.empty():
-                    self.receive_response()
-                
-                chunk_response = self.download_chunk_response_queue.get()
-                
-                if chunk_response.chunk_size == 0:
-                    raise Exception("Received empty chunk for index {}".format(chunk_index))
-                
-                # Convert list of integers to bytearray (Python 2 compatible)
-                data_slice = chunk_response.data[:chunk_response.chunk_size]
-                chunk_data = bytearray(data_slice)
-                
-                # Debug output
-                running_total += len(chunk_data)
-                print("DEBUG: Chunk {}: adding {} bytes, total: {}".format(
-                    chunk_index, len(chunk_data), running_total))
-                
-                downloaded_data.extend(chunk_data)
 
-                if progress_bar:
-                    progress_bar.update(1)
-                
-                if chunk_response.is_last_chunk:
-                    print("DEBUG: Last chunk received at index {}".format(chunk_index))
-                    break
-                    
+        try:
+            self._download_chunks(filename, total_chunks, writer.write_chunk, window_size, chunk_timeout,
+                                  progress_bar, received=writer.received)
         finally:
+            writer.close()
             if progress_bar:
                 progress_bar.close()
-        
-        print("DEBUG: Final downloaded size: {}, expected: {}".format(len(downloaded_data), file_size))
-        
-        if len(downloaded_data) != file_size:
-            raise Exception("Downloaded data size {} does not match expected size {}".format(len(downloaded_data), file_size))
-        
-        with open(local_path, 'wb') as f:
-            f.write(downloaded_data)
-        
+
+        logger.debug("Final downloaded size: {}, expected: {}".format(writer.bytes_written(), file_size))
+
+        if writer.bytes_written() != file_size:
+            raise Exception("Downloaded data size {} does not match expected size {}".format(writer.bytes_written(), file_size))
+
+        # The checksum was computed while downloading, so the file does not need to be read again
         if verify_checksum:
             if show_progress:
                 print("Verifying checksum...")
-            if self._verify_file_checksum(filename, local_path):
+            expected_checksum = self._get_file_checksum(filename)
+            logger.debug("Expected checksum: {}, Actual checksum: {}".format(expected_checksum, writer.crc32()))
+            if expected_checksum == writer.crc32():
                 if show_progress:
                     print("Checksum verified")
             else:
                 if show_progress:
                     print("Checksum verification failed")
-                return False
-        
+                writer.discard()
+                return None
+
+        writer.commit()
+
         if show_progress:
             print("Successfully downloaded {} to {}".format(filename, local_path))
-        return True
+        return writer.crc32()
 
-    def _verify_file_checksum(self, filename, local_path):
+    # Opens `filename` for download on the badge and returns its StartDownloadResponse().
+    def _start_download(self, filename, clear_buffer=True):
         request = Request()
-        request.type.which = Request_get_file_checksum_request_tag
-        request.type.get_file_checksum_request = GetFileChecksumRequest()
-        request.type.get_file_checksum_request.filename = filename
+        request.type.which = Request_start_download_request_tag
+        request.type.start_download_request = StartDownloadRequest()
+        request.type.start_download_request.filename = filename
+        start_response = self.send_request(request, clear_buffer=clear_buffer,
+                                           response_tag=Response_start_download_response_tag).result()
 
-        self.send_request(request)
+        if not start_response.success:
+            raise Exception("Failed to start download: {}".format(start_response.success))
+        return start_response
+
+    def _request_chunk(self, chunk_index):
+        chunk_request = Request()
+        chunk_request.type.which = Request_download_chunk_request_tag
+        chunk_request.type.download_chunk_request = DownloadChunkRequest()
+        chunk_request.type.download_chunk_request.chunk_index = chunk_index
+        self.send_request(chunk_request, clear_buffer=False)
+
+    # Fetches the chunks of the file opened with _start_download(), calling
+    #   handle_chunk(chunk_index, chunk_data) exactly once per chunk in the order they arrive.
+    #   chunk_data is a memoryview of the received response, valid until handle_chunk returns.
+    # `received` holds one flag per chunk; chunks already flagged are not requested, and it
+    #   is updated as chunks arrive.
+    # The badge answers requests in the order it recieves them, which is used to match up
+    #   empty chunks (sent when the badge has no file open) with the request they answer.
+    def _download_chunks(self, filename, total_chunks, handle_chunk, window_size=DEFAULT_DOWNLOAD_WINDOW,
+                         chunk_timeout=DEFAULT_CHUNK_TIMEOUT, progress_bar=None, received=None):
+        window_size = max(1, window_size)
+        if received is None:
+            received = bytearray(total_chunks)
+        remaining_chunks = received.count(b"\x00")
+        next_chunk = received.find(b"\x00")
+        if next_chunk == -1:
+            next_chunk = total_chunks
+        retry_chunks = collections.deque()
+        in_flight = collections.OrderedDict()  # chunk_index -> time it was last requested
+        attempts = collections.defaultdict(int)
+        session_closed = False
+
+        self.chunk_responses.clear()
+
+        while remaining_chunks > 0:
+            # The badge closes the file after sending its last chunk. Once every request sent
+            #   before that was noticed has been answered, open it again to fetch the rest.
+            if session_closed and not in_flight:
+                self._start_download(filename, clear_buffer=False)
+                session_closed = False
+
+            while not session_closed and len(in_flight) < window_size and (retry_chunks or next_chunk < total_chunks):
+                if retry_chunks:
+                    chunk_index = retry_chunks.popleft()
+                else:
+                    chunk_index = next_chunk
+                    next_chunk = received.find(b"\x00", next_chunk + 1)
+                    if next_chunk == -1:
+                        next_chunk = total_chunks
 
-        with self.get_file_checksum_response_queue.mutex:
-            self.get_file_checksum_response_queue.queue.clear()
+                attempts[chunk_index] += 1
+                if attempts[chunk_index] > DEFAULT_CHUNK_ATTEMPTS:
+                    raise Exception("Chunk {} of {} not recieved after {} attempts".format(
+                        chunk_index, filename, DEFAULT_CHUNK_ATTEMPTS))
 
-        while self.get_file_checksum_response_queue.empty():
-            self.receive_response()
+                self._request_chunk(chunk_index)
+                in_flight[chunk_index] = time.time()
 
-        response = self.get_file_checksum_response_queue.get()
+            oldest_request = next(iter(in_flight.values()))
+            self.receive_response(timeout=max(0.0, oldest_request + chunk_timeout - time.time()))
 
-        if not response.success:
-            print("Failed to get checksum for {}: {}".format(filename, response.error_message))
-            return False
+            while self.chunk_responses:
+                chunk_response = self.chunk_responses.popleft()
 
-        expected_checksum = response.checksum
+                if chunk_response.chunk_size == 0:
+                    if in_flight:
+                        chunk_index, _ = in_flight.popitem(last=False)
+                        retry_chunks.append(chunk_index)
+                    session_closed = True
+                    continue
 
-        def calculate_crc32(data):
-            crc = 0xFFFFFFFF
-    
-            for byte in bytearray(data):
-                crc ^= byte
-                for _ in range(8):
-                    if crc & 1:
-                        crc = (crc >> 1) ^ 0xEDB88320
-                    else:
-                        crc >>= 1
-    
-            return (~crc) & 0xFFFFFFFF  # Ensure unsigned 32-bit result
-        
-        with open(local_path, 'rb') as f:
-            file_data = f.read()
+                chunk_index = chunk_response.chunk_index
+                in_flight.pop(chunk_index, None)
+                if chunk_index >= total_chunks or received[chunk_index]:
+                    continue
 
-        print("DEBUG: Expected checksum: {}, Actual checksum: {}".format(expected_checksum, calculate_crc32(file_data)))
-        return calculate_crc32(file_data) == expected_checksum
-    
-    def download_all_files(self, output_dir="downloaded_data"):
+                logger.debug("Chunk {}: {} bytes".format(chunk_index, chunk_response.chunk_size))
+                handle_chunk(chunk_index, chunk_response.data)
+
+                received[chunk_index] = 1
+                remaining_chunks -= 1
+                attempts.pop(chunk_index, None)
+
+                if progress_bar:
+                    progress_bar.update(1)
+
+            now = time.time()
+            for chunk_index, requested_at in list(in_flight.items()):
+                if now - requested_at >= chunk_timeout:
+                    logger.debug("Chunk {} timed out, requesting it again".format(chunk_index))
+                    del in_flight[chunk_index]
+                    retry_chunks.append(chunk_index)
+
+    # Returns the CRC32 the badge calculates for `filename`, or None if it could not.
+    def _get_file_checksum(self, filename):
+        request = Request()
+        request.type.which = Request_get_file_checksum_request_tag
+        request.type.get_file_checksum_request = GetFileChecksumRequest()
+        request.type.get_file_checksum_request.filename = filename
+
+        response = self.send_request(request, response_tag=Response_get_file_checksum_response_tag).result()
+
+        if not response.success:
+            print("Failed to get checksum for {}".format(filename))
+            return None
+
+        return response.checksum
+
+    # Downloads every file on the badge into output_dir.
+    #   A manifest in output_dir remembers the size, timestamp and checksum of every file
+    #   downloaded before. Files whose size and timestamp have not changed since are skipped
+    #   without contacting the badge, and files that have grown only fetch the new chunks.
+    def download_all_files(self, output_dir="downloaded_data", window_size=DEFAULT_DOWNLOAD_WINDOW,
+                           download_attempts=DEFAULT_DOWNLOAD_ATTEMPTS, show_progress=True):
         files = self.list_files()
 
         if not files:
-            print("No files to download.")
+            if show_progress:
+                print("No files to download.")
             return {
                 'success': 0,
                 'failed': 0,
+                'skipped': 0,
                 'total': 0
             }
 
@@ -606,14 +572,18 @@ class OpenBadge(object):
                     return {
                         'success': 0,
                         'failed': len(files),
+                        'skipped': 0,
                         'total': len(files)
                     }
         
         total_size = sum(f['size'] for f in files)
-        print("Found {} files, total size: {:.1f} KB".format(len(files), total_size / 1024.0))
+        if show_progress:
+            print("Found {} files, total size: {:.1f} KB".format(len(files), total_size / 1024.0))
 
+        manifest = DownloadManifest(output_dir)
         success_count = 0
         failed_count = 0
+        skipped_count = 0
         
         for file_info in files:
             filename = file_info['filename']
@@ -627,20 +597,41 @@ class OpenBadge(object):
                 
             local_path = os.path.join(output_dir, safe_filename)
 
-            try:
-                if self.download_file(safe_filename, local_path, show_progress=True):
-                    success_count += 1
-                else:
-                    failed_count += 1
-            except Exception as e:
-                print("Failed to download {}: {}".format(safe_filename, e))
+            if manifest.is_unchanged(safe_filename, file_info['size'], file_info['timestamp'], local_path):
+                skipped_count += 1
+                success_count += 1
+                continue
+
+            if manifest.has_grown(safe_filename, file_info['size'], local_path):
+                if show_progress:
+                    print("{} has grown, downloading the new data only".format(safe_filename))
+                resume_from_prefix(local_path, file_info['size'], DOWNLOAD_CHUNK_SIZE)
+
+            checksum = None
+            for attempt in range(download_attempts):
+                try:
+                    checksum = self._download_file(safe_filename, local_path, show_progress=show_progress, window_size=window_size)
+                    if checksum is not None:
+                        break
+                except Exception as e:
+                    print("Failed to download {} (attempt {}/{}): {}".format(
+                        safe_filename, attempt + 1, download_attempts, e))
+
+            if checksum is not None:
+                manifest.record(safe_filename, file_info['size'], file_info['timestamp'], checksum)
+                success_count += 1
+            else:
                 failed_count += 1
 
         result = {
             'success': success_count,
             'failed': failed_count,
+            'skipped': skipped_count,
             'total': len(files)
         }
         
-        print("Downloaded {}/{} files successfully.".format(success_count, len(files)))
+        if show_progress:
+            if skipped_count > 0:
+                print("{} files were already up to date.".format(skipped_count))
+            print("Downloaded {}/{} files successfully.".format(success_count, len(files)))
         return result
@@ -1,4 +1,7 @@
 from __future__ import division, absolute_import, print_function
+import threading
+import time
+
 # This BadgeConnection interface represents a connection to an OpenBadge.
 #   This connection is used by the Badge object to communicate with a physical badge.
 #      This acts to bridge our abstraction of a badge to our implementation of 
@@ -37,8 +40,55 @@ class BadgeConnection(object):
     # Await data_len bytes to be recieved from the badge over this connection
     #  and return them after they have been recieved.
     # Returns None immediately if data_len == 0.
-    # This method blocks until data_len bytes have been recieved.
+    # This method blocks until data_len bytes have been recieved, or until `timeout`
+    #  seconds have passed if a timeout is given, in which case it returns None and
+    #  leaves any partially recieved data in place.
     # This method should throw a RuntimeError if this BadgeConnection is not currently
     # connected.
-    def await_data(self, data_len):
+    def await_data(self, data_len, timeout=None):
         raise NotImplementedError
+
+
+# ReceiveBuffer holds the bytes recieved from a badge until an entire message has arrived.
+#   Transports append whole notifications with put() (possibly from another thread) and
+#   await_data() implementations take complete messages back out with take(), so no
+#   per-byte work is done on the receive path.
+class ReceiveBuffer(object):
+    def __init__(self):
+        self.buffer = bytearray()
+        self.condition = threading.Condition(threading.Lock())
+
+    def __len__(self):
+        with self.condition:
+            return len(self.buffer)
+
+    # Append `data` to the end of the buffer and wake up any thread waiting in take().
+    def put(self, data):
+        with self.condition:
+            self.buffer.extend(data)
+            self.condition.notify_all()
+
+    # Remove and return the first data_len bytes of the buffer.
+    # If fewer bytes are available, waits up to `timeout` seconds for them (0 does not wait,
+    #   None waits forever) and returns None if they did not arrive in time.
+    def take(self, data_len, timeout=0):
+        with self.condition:
+            if len(self.buffer) < data_len and timeout != 0:
+                deadline = None if timeout is None else time.time() + timeout
+                while len(self.buffer) < data_len:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+            if len(self.buffer) < data_len:
+                return None
+
+            data = bytes(self.buffer[:data_len])
+            del self.buffer[:data_len]
+            return data
+
+    # Discard everything recieved so far.
+    def clear(self):
+        with self.condition:
+            del self.buffer[:]
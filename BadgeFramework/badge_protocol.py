@@ -32,24 +32,61 @@ Response_download_chunk_response_tag = 43
 Response_get_file_checksum_response_tag = 44
 
 MAX_FILENAME_LENGTH = 12
+DOWNLOAD_CHUNK_SIZE = 48
 
-class _Ostream:
+# Tag at the start of every request and response
+_WHICH = struct.Struct('<B')
+
+# Collects the encoded parts of a message and joins them once, when buf is read.
+class _Ostream(object):
 	def __init__(self):
-		self.buf = b''
+		self.parts = []
 	def write(self, data):
-		self.buf += data
-
-class _Istream:
+		self.parts.append(data)
+	@property
+	def buf(self):
+		return b''.join(self.parts)
+
+# Cursor over a received message. Fields are unpacked straight out of a memoryview of the
+#   message, so reading does not copy the rest of the message every time.
+class _Istream(object):
 	def __init__(self, buf):
-		self.buf = buf
-	def read(self, l):
-		if(l > len(self.buf)):
+		self.view = memoryview(buf)
+		self.pos = 0
+	# The bytes that have not been read yet
+	@property
+	def buf(self):
+		return self.view[self.pos:].tobytes()
+	def _check(self, end):
+		if end > len(self.view):
 			raise Exception("Not enough bytes in Istream to read")
-		ret = self.buf[0:l]
-		self.buf = self.buf[l:]
-		#for i in ret:
-		#	print("_Istream:",i)
+	def read(self, l):
+		self._check(self.pos + l)
+		ret = self.view[self.pos:self.pos + l].tobytes()
+		self.pos += l
 		return ret
+	# Unpacks the struct.Struct `codec` at the read position and moves past it.
+	def unpack(self, codec):
+		values = self.unpack_at(codec, 0)
+		self.pos += codec.size
+		return values
+	# Unpacks `codec` at `offset` bytes after the read position, without moving it.
+	def unpack_at(self, codec, offset):
+		try:
+			return codec.unpack_from(self.view, self.pos + offset)
+		except struct.error:
+			raise Exception("Not enough bytes in Istream to read")
+	# Returns a copy of `length` bytes at `offset` bytes after the read position, without moving it.
+	def bytes_at(self, offset, length):
+		return self.view_at(offset, length).tobytes()
+	# Like bytes_at(), but returns a memoryview of the message instead of a copy.
+	def view_at(self, offset, length):
+		start = self.pos + offset
+		self._check(start + length)
+		return self.view[start:start + length]
+
+# seconds, ms
+_TIMESTAMP = struct.Struct('<IH')
 
 class Timestamp:
 
@@ -70,15 +107,7 @@ class Timestamp:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_seconds(ostream)
-		self.encode_ms(ostream)
-		pass
-
-	def encode_seconds(self, ostream):
-		ostream.write(struct.pack('<I', self.seconds))
-
-	def encode_ms(self, ostream):
-		ostream.write(struct.pack('<H', self.ms))
+		ostream.write(_TIMESTAMP.pack(self.seconds, self.ms))
 
 
 	@classmethod
@@ -89,16 +118,18 @@ class Timestamp:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_seconds(istream)
-		self.decode_ms(istream)
-		pass
+		self.seconds, self.ms = istream.unpack(_TIMESTAMP)
 
-	def decode_seconds(self, istream):
-		self.seconds= struct.unpack('<I', istream.read(4))[0]
 
-	def decode_ms(self, istream):
-		self.ms= struct.unpack('<H', istream.read(2))[0]
+# Returns a Timestamp() with the given fields, for messages that unpack them together with other fields.
+def _timestamp(seconds, ms):
+	timestamp = Timestamp()
+	timestamp.seconds = seconds
+	timestamp.ms = ms
+	return timestamp
 
+# ID, group
+_BADGE_ASSIGNEMENT = struct.Struct('<HB')
 
 class BadgeAssignement:
 
@@ -119,15 +150,7 @@ class BadgeAssignement:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_ID(ostream)
-		self.encode_group(ostream)
-		pass
-
-	def encode_ID(self, ostream):
-		ostream.write(struct.pack('<H', self.ID))
-
-	def encode_group(self, ostream):
-		ostream.write(struct.pack('<B', self.group))
+		ostream.write(_BADGE_ASSIGNEMENT.pack(self.ID, self.group))
 
 
 	@classmethod
@@ -138,16 +161,11 @@ class BadgeAssignement:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_ID(istream)
-		self.decode_group(istream)
-		pass
-
-	def decode_ID(self, istream):
-		self.ID= struct.unpack('<H', istream.read(2))[0]
+		self.ID, self.group = istream.unpack(_BADGE_ASSIGNEMENT)
 
-	def decode_group(self, istream):
-		self.group= struct.unpack('<B', istream.read(1))[0]
 
+# ID, rssi
+_SCAN_DEVICE = struct.Struct('<Hb')
 
 class ScanDevice:
 
@@ -168,15 +186,7 @@ class ScanDevice:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_ID(ostream)
-		self.encode_rssi(ostream)
-		pass
-
-	def encode_ID(self, ostream):
-		ostream.write(struct.pack('<H', self.ID))
-
-	def encode_rssi(self, ostream):
-		ostream.write(struct.pack('<b', self.rssi))
+		ostream.write(_SCAN_DEVICE.pack(self.ID, self.rssi))
 
 
 	@classmethod
@@ -187,17 +197,13 @@ class ScanDevice:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_ID(istream)
-		self.decode_rssi(istream)
-		pass
+		self.ID, self.rssi = istream.unpack(_SCAN_DEVICE)
 
-	def decode_ID(self, istream):
-		self.ID= struct.unpack('<H', istream.read(2))[0]
-
-	def decode_rssi(self, istream):
-		self.rssi= struct.unpack('<b', istream.read(1))[0]
 
 
+# timestamp, has_badge_assignement, and the badge_assignement if it has one
+_STATUS_REQUEST = struct.Struct('<IHB')
+_STATUS_REQUEST_WITH_ASSIGNEMENT = struct.Struct('<IHBHB')
 
 class StatusRequest:
 
@@ -219,17 +225,12 @@ class StatusRequest:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		self.encode_badge_assignement(ostream)
-		pass
-
-	def encode_timestamp(self, ostream):
-		self.timestamp.encode_internal(ostream)
-
-	def encode_badge_assignement(self, ostream):
-		ostream.write(struct.pack('<B', self.has_badge_assignement))
 		if self.has_badge_assignement:
-			self.badge_assignement.encode_internal(ostream)
+			ostream.write(_STATUS_REQUEST_WITH_ASSIGNEMENT.pack(
+				self.timestamp.seconds, self.timestamp.ms, self.has_badge_assignement,
+				self.badge_assignement.ID, self.badge_assignement.group))
+		else:
+			ostream.write(_STATUS_REQUEST.pack(self.timestamp.seconds, self.timestamp.ms, self.has_badge_assignement))
 
 
 	@classmethod
@@ -240,21 +241,16 @@ class StatusRequest:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_badge_assignement(istream)
-		pass
-
-	def decode_timestamp(self, istream):
-		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)
-
-	def decode_badge_assignement(self, istream):
-		self.has_badge_assignement= struct.unpack('<B', istream.read(1))[0]
+		seconds, ms, self.has_badge_assignement = istream.unpack(_STATUS_REQUEST)
+		self.timestamp = _timestamp(seconds, ms)
 		if self.has_badge_assignement:
 			self.badge_assignement = BadgeAssignement()
 			self.badge_assignement.decode_internal(istream)
 
 
+# timestamp, mode
+_START_MICROPHONE_REQUEST = struct.Struct('<IHB')
+
 class StartMicrophoneRequest:
 
 	def __init__(self):
@@ -274,15 +270,7 @@ class StartMicrophoneRequest:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		self.encode_mode(ostream)
-		pass
-
-	def encode_timestamp(self, ostream):
-		self.timestamp.encode_internal(ostream)
-
-	def encode_mode(self, ostream):
-		ostream.write(struct.pack('<B', self.mode))
+		ostream.write(_START_MICROPHONE_REQUEST.pack(self.timestamp.seconds, self.timestamp.ms, self.mode))
 
 	@classmethod
 	def decode(cls, buf):
@@ -292,16 +280,8 @@ class StartMicrophoneRequest:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_mode(istream)
-		pass
-
-	def decode_timestamp(self, istream):
-		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)
-
-	def decode_mode(self, istream):
-		self.mode= struct.unpack('<B', istream.read(1))[0]
+		seconds, ms, self.mode = istream.unpack(_START_MICROPHONE_REQUEST)
+		self.timestamp = _timestamp(seconds, ms)
 
 class StopMicrophoneRequest:
 
@@ -334,6 +314,9 @@ class StopMicrophoneRequest:
 		pass
 
 
+# timestamp, window, interval
+_START_SCAN_REQUEST = struct.Struct('<IHHH')
+
 class StartScanRequest:
 
 	def __init__(self):
@@ -354,19 +337,7 @@ class StartScanRequest:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		self.encode_window(ostream)
-		self.encode_interval(ostream)
-		pass
-
-	def encode_timestamp(self, ostream):
-		self.timestamp.encode_internal(ostream)
-
-	def encode_window(self, ostream):
-		ostream.write(struct.pack('<H', self.window))
-
-	def encode_interval(self, ostream):
-		ostream.write(struct.pack('<H', self.interval))
+		ostream.write(_START_SCAN_REQUEST.pack(self.timestamp.seconds, self.timestamp.ms, self.window, self.interval))
 
 	@classmethod
 	def decode(cls, buf):
@@ -376,20 +347,8 @@ class StartScanRequest:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_window(istream)
-		self.decode_interval(istream)
-		pass
-
-	def decode_timestamp(self, istream):
-		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)
-
-	def decode_window(self, istream):
-		self.window= struct.unpack('<H', istream.read(2))[0]
-
-	def decode_interval(self, istream):
-		self.interval= struct.unpack('<H', istream.read(2))[0]
+		seconds, ms, self.window, self.interval = istream.unpack(_START_SCAN_REQUEST)
+		self.timestamp = _timestamp(seconds, ms)
 
 
 
@@ -424,6 +383,9 @@ class StopScanRequest:
 		pass
 
 
+# timestamp, acc_fsr, gyr_fsr, datarate
+_START_IMU_REQUEST = struct.Struct('<IHHHH')
+
 class StartImuRequest:
 
 	def __init__(self):
@@ -445,23 +407,8 @@ class StartImuRequest:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		self.encode_acc_fsr(ostream)
-		self.encode_gyr_fsr(ostream)
-		self.encode_datarate(ostream)
-		pass
-
-	def encode_timestamp(self, ostream):
-		self.timestamp.encode_internal(ostream)
-
-	def encode_acc_fsr(self, ostream):
-		ostream.write(struct.pack('<H', self.acc_fsr))
-
-	def encode_gyr_fsr(self, ostream):
-		ostream.write(struct.pack('<H', self.gyr_fsr))
-
-	def encode_datarate(self, ostream):
-		ostream.write(struct.pack('<H', self.datarate))
+		ostream.write(_START_IMU_REQUEST.pack(
+			self.timestamp.seconds, self.timestamp.ms, self.acc_fsr, self.gyr_fsr, self.datarate))
 
 
 	@classmethod
@@ -472,24 +419,8 @@ class StartImuRequest:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_acc_fsr(istream)
-		self.decode_gyr_fsr(istream)
-		self.decode_datarate(istream)
-		pass
-
-	def decode_timestamp(self, istream):
-		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)
-
-	def decode_acc_fsr(self, istream):
-		self.acc_fsr = struct.unpack('<H', istream.read(2))[0]
-
-	def decode_gyr_fsr(self, istream):
-		self.gyr_fsr = struct.unpack('<H', istream.read(2))[0]
-
-	def decode_datarate(self, istream):
-		self.datarate= struct.unpack('<H', istream.read(2))[0]
+		seconds, ms, self.acc_fsr, self.gyr_fsr, self.datarate = istream.unpack(_START_IMU_REQUEST)
+		self.timestamp = _timestamp(seconds, ms)
 
 
 class StopImuRequest:
@@ -524,6 +455,9 @@ class StopImuRequest:
 
 
 
+# timeout
+_IDENTIFY_REQUEST = struct.Struct('<H')
+
 class IdentifyRequest:
 
 	def __init__(self):
@@ -542,11 +476,7 @@ class IdentifyRequest:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_timeout(ostream)
-		pass
-
-	def encode_timeout(self, ostream):
-		ostream.write(struct.pack('<H', self.timeout))
+		ostream.write(_IDENTIFY_REQUEST.pack(self.timeout))
 
 
 	@classmethod
@@ -557,11 +487,7 @@ class IdentifyRequest:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_timeout(istream)
-		pass
-
-	def decode_timeout(self, istream):
-		self.timeout= struct.unpack('<H', istream.read(2))[0]
+		self.timeout, = istream.unpack(_IDENTIFY_REQUEST)
 
 
 
@@ -716,6 +642,9 @@ class GetFWVersionRequest:
 		self.reset()
 		pass	
 
+# start_index, max_files
+_LIST_FILES_REQUEST = struct.Struct('<BB')
+
 class ListFilesRequest:
 	def __init__(self):
 		self.reset()
@@ -733,14 +662,7 @@ class ListFilesRequest:
 		return ostream.buf
 	
 	def encode_internal(self, ostream):
-		self.encode_start_index(ostream)
-		self.encode_max_files(ostream)
-
-	def encode_start_index(self, ostream):
-		ostream.write(struct.pack('<B', self.start_index))
-	
-	def encode_max_files(self, ostream):
-		ostream.write(struct.pack('<B', self.max_files))
+		ostream.write(_LIST_FILES_REQUEST.pack(self.start_index, self.max_files))
 	
 	@classmethod
 	def decode(cls, buf):
@@ -750,14 +672,10 @@ class ListFilesRequest:
 	
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_start_index(istream)
-		self.decode_max_files(istream)
+		self.start_index, self.max_files = istream.unpack(_LIST_FILES_REQUEST)
 
-	def decode_start_index(self, istream):
-		self.start_index = struct.unpack('<B', istream.read(1))[0]
-
-	def decode_max_files(self, istream):
-		self.max_files = struct.unpack('<B', istream.read(1))[0]
+# A filename, padded with zeros to MAX_FILENAME_LENGTH bytes
+_FILENAME = struct.Struct('<%ds' % MAX_FILENAME_LENGTH)
 
 class StartDownloadRequest:
 	def __init__(self):
@@ -778,9 +696,7 @@ class StartDownloadRequest:
 		self.encode_filename(ostream)
 
 	def encode_filename(self, ostream):
-		filename_bytes = self.filename.encode('utf-8')[:MAX_FILENAME_LENGTH-1]
-		filename_bytes += b'\x00' * (MAX_FILENAME_LENGTH - len(filename_bytes))
-		ostream.write(filename_bytes)
+		ostream.write(_FILENAME.pack(self.filename.encode('utf-8')[:MAX_FILENAME_LENGTH-1]))
 
 	@classmethod
 	def decode(cls, buf):
@@ -793,9 +709,12 @@ class StartDownloadRequest:
 		self.decode_filename(istream)
 
 	def decode_filename(self, istream):
-		filename_bytes = istream.read(MAX_FILENAME_LENGTH)
+		filename_bytes, = istream.unpack(_FILENAME)
 		self.filename = filename_bytes.rstrip(b'\x00').decode('utf-8')
 
+# chunk_index
+_DOWNLOAD_CHUNK_REQUEST = struct.Struct('<I')
+
 class DownloadChunkRequest:
 	def __init__(self):
 		self.reset()
@@ -815,7 +734,7 @@ class DownloadChunkRequest:
 		self.encode_chunk_index(ostream)
 
 	def encode_chunk_index(self, ostream):
-		ostream.write(struct.pack('<I', self.chunk_index))
+		ostream.write(_DOWNLOAD_CHUNK_REQUEST.pack(self.chunk_index))
 
 	@classmethod
 	def decode(cls, buf):
@@ -828,7 +747,7 @@ class DownloadChunkRequest:
 		self.decode_chunk_index(istream)
 
 	def decode_chunk_index(self, istream):
-		self.chunk_index = struct.unpack('<I', istream.read(4))[0]
+		self.chunk_index, = istream.unpack(_DOWNLOAD_CHUNK_REQUEST)
 
 class GetFileChecksumRequest:
 	def __init__(self):
@@ -849,9 +768,7 @@ class GetFileChecksumRequest:
 		self.encode_filename(ostream)
 
 	def encode_filename(self, ostream):
-		filename_bytes = self.filename.encode('utf-8')[:MAX_FILENAME_LENGTH-1]
-		filename_bytes += b'\x00' * (MAX_FILENAME_LENGTH - len(filename_bytes))
-		ostream.write(filename_bytes)
+		ostream.write(_FILENAME.pack(self.filename.encode('utf-8')[:MAX_FILENAME_LENGTH-1]))
 
 	@classmethod
 	def decode(cls, buf):
@@ -864,8 +781,8 @@ class GetFileChecksumRequest:
 		self.decode_filename(istream)
 
 	def decode_filename(self, istream):
-		filename_bytes = istream.read(MAX_FILENAME_LENGTH)
-		self.filename = filename_bytes.rstrip(b'\x00').decode('utf-8')		
+		filename_bytes, = istream.unpack(_FILENAME)
+		self.filename = filename_bytes.rstrip(b'\x00').decode('utf-8')
 
 class Request:
 
@@ -930,28 +847,8 @@ class Request:
 			pass
 
 		def encode_internal(self, ostream):
-			ostream.write(struct.pack('<B', self.which))
-			options = {
-				1: self.encode_status_request,
-				2: self.encode_start_microphone_request,
-				3: self.encode_stop_microphone_request,
-				4: self.encode_start_scan_request,
-				5: self.encode_stop_scan_request,
-				6: self.encode_start_imu_request,
-				7: self.encode_stop_imu_request,
-				27: self.encode_identify_request,
-				29: self.encode_restart_request,
-				30: self.encode_free_sdc_space_request,
-				31: self.encode_sdc_errase_all_request,
-				33: self.encode_get_imu_data_request,
-				35: self.encode_get_fw_version_request,
-				37: self.encode_list_files_request,
-				39: self.encode_start_download_request,
-				40: self.encode_download_chunk_request,
-				41: self.encode_get_file_checksum_request,
-			}
-			options[self.which](ostream)
-			pass
+			ostream.write(_WHICH.pack(self.which))
+			self._encoders[self.which](self, ostream)
 
 		def encode_status_request(self, ostream):
 			self.status_request.encode_internal(ostream)
@@ -1006,28 +903,8 @@ class Request:
 
 		def decode_internal(self, istream):
 			self.reset()
-			self.which= struct.unpack('<B', istream.read(1))[0]
-			options = {
-				1: self.decode_status_request,
-				2: self.decode_start_microphone_request,
-				3: self.decode_stop_microphone_request,
-				4: self.decode_start_scan_request,
-				5: self.decode_stop_scan_request,
-				6: self.decode_start_imu_request,
-				7: self.decode_stop_imu_request,
-				27: self.decode_identify_request,
-				29: self.decode_restart_request,
-				30: self.decode_free_sdc_space_request,
-				31: self.decode_sdc_errase_all_request,
-				33: self.decode_get_imu_data_request,
-				35: self.decode_get_fw_version_request,
-				37: self.decode_list_files_request,
-				39: self.decode_start_download_request,
-				40: self.decode_download_chunk_request,
-				41: self.decode_get_file_checksum_request,
-			}
-			options[self.which](istream)
-			pass
+			self.which, = istream.unpack(_WHICH)
+			self._decoders[self.which](self, istream)
 
 		def decode_status_request(self, istream):
 			self.status_request = StatusRequest()
@@ -1085,6 +962,67 @@ class Request:
 			self.list_files_request = ListFilesRequest()
 			self.list_files_request.decode_internal(istream)
 
+		def decode_start_download_request(self, istream):
+			self.start_download_request = StartDownloadRequest()
+			self.start_download_request.decode_internal(istream)
+
+		def decode_download_chunk_request(self, istream):
+			self.download_chunk_request = DownloadChunkRequest()
+			self.download_chunk_request.decode_internal(istream)
+
+		def decode_get_file_checksum_request(self, istream):
+			self.get_file_checksum_request = GetFileChecksumRequest()
+			self.get_file_checksum_request.decode_internal(istream)
+
+		# Encoder and decoder of every request type, by tag
+		_encoders = {
+			1: encode_status_request,
+			2: encode_start_microphone_request,
+			3: encode_stop_microphone_request,
+			4: encode_start_scan_request,
+			5: encode_stop_scan_request,
+			6: encode_start_imu_request,
+			7: encode_stop_imu_request,
+			27: encode_identify_request,
+			29: encode_restart_request,
+			30: encode_free_sdc_space_request,
+			31: encode_sdc_errase_all_request,
+			33: encode_get_imu_data_request,
+			35: encode_get_fw_version_request,
+			37: encode_list_files_request,
+			39: encode_start_download_request,
+			40: encode_download_chunk_request,
+			41: encode_get_file_checksum_request,
+		}
+		_decoders = {
+			1: decode_status_request,
+			2: decode_start_microphone_request,
+			3: decode_stop_microphone_request,
+			4: decode_start_scan_request,
+			5: decode_stop_scan_request,
+			6: decode_start_imu_request,
+			7: decode_stop_imu_request,
+			27: decode_identify_request,
+			29: decode_restart_request,
+			30: decode_free_sdc_space_request,
+			31: decode_sdc_errase_all_request,
+			33: decode_get_imu_data_request,
+			35: decode_get_fw_version_request,
+			37: decode_list_files_request,
+			39: decode_start_download_request,
+			40: decode_download_chunk_request,
+			41: decode_get_file_checksum_request,
+		}
+
+
+# clock_status, microphone_status, scan_status, imu_status, timestamp, battery_level, pdm_data,
+#   scan_data, time_delta
+_STATUS_RESPONSE = struct.Struct('<BBBBIHBhbi')
+# The fields are decoded from other offsets than they are encoded at:
+#   clock_status, microphone_status, scan_status, imu_status, battery_level and the 3 bytes of pdm_data
+_STATUS_RESPONSE_FIELDS = struct.Struct('<3xBBBBB3xBBb')
+#   time_delta, timestamp and scan_data, which is read relative to the end of the timestamp
+_STATUS_RESPONSE_TIME = struct.Struct('<iIH9xh')
 
 class StatusResponse:
 
@@ -1112,43 +1050,10 @@ class StatusResponse:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_clock_status(ostream)
-		self.encode_microphone_status(ostream)
-		self.encode_scan_status(ostream)
-		self.encode_imu_status(ostream)
-		self.encode_timestamp(ostream)
-		self.encode_battery_level(ostream)
-		self.encode_pdm_data(ostream)
-		self.encode_scan_data(ostream)
-		self.encode_time_delta(ostream)
-		pass
-
-	def encode_clock_status(self, ostream):
-		ostream.write(struct.pack('<B', self.clock_status))
-
-	def encode_microphone_status(self, ostream):
-		ostream.write(struct.pack('<B', self.microphone_status))
-
-	def encode_scan_status(self, ostream):
-		ostream.write(struct.pack('<B', self.scan_status))
-
-	def encode_imu_status(self, ostream):
-		ostream.write(struct.pack('<B', self.imu_status))
-
-	def encode_battery_level(self, ostream):
-		ostream.write(struct.pack('<B', self.battery_level))
-
-	def encode_pdm_data(self, ostream):
-		ostream.write(struct.pack('<h', self.pdm_data))
-
-	def encode_scan_data(self, ostream):
-		ostream.write(struct.pack('<b', self.scan_data))
-
-	def encode_time_delta(self, ostream):
-		ostream.write(struct.pack('<i', self.time_delta))
-
-	def encode_timestamp(self, ostream):
-		self.timestamp.encode_internal(ostream)
+		ostream.write(_STATUS_RESPONSE.pack(
+			self.clock_status, self.microphone_status, self.scan_status, self.imu_status,
+			self.timestamp.seconds, self.timestamp.ms,
+			self.battery_level, self.pdm_data, self.scan_data, self.time_delta))
 
 
 
@@ -1160,52 +1065,20 @@ class StatusResponse:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_clock_status(istream)
-		self.decode_microphone_status(istream)
-		self.decode_scan_status(istream)
-		self.decode_imu_status(istream)
-		self.decode_battery_level(istream)
-		self.decode_pdm_data(istream)
-		self.decode_time_delta(istream)
-		self.decode_timestamp(istream)
-		self.decode_scan_data(istream)
-		pass
-
-	def decode_clock_status(self, istream):
-		#print("decode_clock_status:", istream.buf)
-		#print("decode_clock_status:", istream.read(1))
-		self.clock_status= struct.unpack('<B', istream.buf[3])[0]
-
-	def decode_microphone_status(self, istream):
-		#print("decode_microphone_status: ", i)
-		self.microphone_status= struct.unpack('<B', istream.buf[4])[0]
+		(self.clock_status, self.microphone_status, self.scan_status, self.imu_status, self.battery_level,
+			pdm_low, pdm_mid, pdm_high) = istream.unpack_at(_STATUS_RESPONSE_FIELDS, 0)
+		self.pdm_data = (pdm_high << 16) + (pdm_mid << 8) + pdm_low
+		self.time_delta, seconds, ms, self.scan_data = istream.unpack_at(_STATUS_RESPONSE_TIME, 0)
+		self.timestamp = _timestamp(seconds, ms)
+		# Move past time_delta and the timestamp
+		istream.pos += 4 + _TIMESTAMP.size
 
-	def decode_scan_status(self, istream):
-		#print("decode_scan_status: ", i)
-		self.scan_status= struct.unpack('<B', istream.buf[5])[0]
-
-	def decode_imu_status(self, istream):
-		#print("decode_imu_status: ", i)
-		self.imu_status= struct.unpack('<B', istream.buf[6])[0]
-
-	def decode_battery_level(self, istream):
-		#print("decode_battery_level: ", i)
-		self.battery_level= struct.unpack('<B', istream.buf[7])[0]
-
-	def decode_pdm_data(self, istream):
-		self.pdm_data= (struct.unpack('<b', istream.buf[13])[0] << 16) + (struct.unpack('<B', (istream.buf[12]))[0]<< 8)+ struct.unpack('<B', (istream.buf[11]))[0]
-
-	def decode_scan_data(self, istream):
-		self.scan_data= (struct.unpack('<b', istream.buf[10])[0] << 8) + struct.unpack('<B', (istream.buf[9]))[0]
-
-	def decode_time_delta(self, istream):
-		self.time_delta= struct.unpack('<i', istream.read(4))[0]
-
-	def decode_timestamp(self, istream):
-		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)
 
 
+# mode, switch_pos, gain_l, gain_r, pdm_freq; encoded after the timestamp
+_START_MICROPHONE_RESPONSE_SETTINGS = struct.Struct('<bbbbB')
+# timestamp, mode, gain_l, gain_r, switch_pos, pdm_freq as they are decoded
+_START_MICROPHONE_RESPONSE = struct.Struct('<IH3xbbbbH')
 
 class StartMicrophoneResponse:
 
@@ -1230,31 +1103,9 @@ class StartMicrophoneResponse:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_timestamp(ostream)
-		self.encode_mode(ostream)
-		self.encode_switch_pos(ostream)
-		self.encode_gain_l(ostream)
-		self.encode_gain_r(ostream)
-		self.encode_pdm_freq(ostream)
-		pass
-
-	def encode_timestamp(self, ostream):
 		self.timestamp.encode_internal(ostream)
-
-	def encode_mode(self, ostream):
-		ostream.write(struct.pack('<b', self.mode))
-
-	def encode_switch_pos(self, ostream):
-		ostream.write(struct.pack('<b', self.switch_pos))
-
-	def encode_gain_l(self, ostream):
-		ostream.write(struct.pack('<b', self.gain_l))
-
-	def encode_gain_r(self, ostream):
-		ostream.write(struct.pack('<b', self.gain_r))	
-
-	def encode_pdm_freq(self, ostream):
-		ostream.write(struct.pack('<B', self.pdm_freq))				
+		ostream.write(_START_MICROPHONE_RESPONSE_SETTINGS.pack(
+			self.mode, self.switch_pos, self.gain_l, self.gain_r, self.pdm_freq))
 
 
 	@classmethod
@@ -1265,33 +1116,14 @@ class StartMicrophoneResponse:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_mode(istream)
-		self.decode_switch_pos(istream)
-		self.decode_gain_l(istream)
-		self.decode_gain_r(istream)
-		self.decode_pdm_freq(istream)
-		pass
-
-	def decode_timestamp(self, istream):
-		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)
+		(seconds, ms, self.mode, self.gain_l, self.gain_r, self.switch_pos,
+			self.pdm_freq) = istream.unpack_at(_START_MICROPHONE_RESPONSE, 0)
+		istream.pos += _TIMESTAMP.size
+		self.timestamp = _timestamp(seconds, ms)
 
-	def decode_mode(self, istream):
-		self.mode= struct.unpack('<b', istream.buf[3])[0]
-
-	def decode_gain_l(self, istream):
-		self.gain_l= struct.unpack('<b', istream.buf[4])[0]
-
-	def decode_gain_r(self, istream):
-		self.gain_r= struct.unpack('<b', istream.buf[5])[0]
-
-	def decode_switch_pos(self, istream):
-		self.switch_pos= struct.unpack('<b', istream.buf[6])[0]
-
-	def decode_pdm_freq(self, istream):
-		self.pdm_freq= struct.unpack('<H', istream.buf[7:9])[0]
 
+# timestamp, window, interval
+_START_SCAN_RESPONSE = struct.Struct('<IH3xHH')
 
 class StartScanResponse:
 
@@ -1336,21 +1168,13 @@ class StartScanResponse:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_window(istream)
-		self.decode_interval(istream)		
-		pass
-
-	def decode_timestamp(self, istream):
-		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)
+		seconds, ms, self.window, self.interval = istream.unpack_at(_START_SCAN_RESPONSE, 0)
+		istream.pos += _TIMESTAMP.size
+		self.timestamp = _timestamp(seconds, ms)
 
-	def decode_window(self, istream):
-		self.window= (struct.unpack('<B', istream.buf[4])[0] << 8) + struct.unpack('<B', (istream.buf[3]))[0]
-		
-	def decode_interval(self, istream):
-		self.interval= (struct.unpack('<B', istream.buf[6])[0] << 8) + struct.unpack('<B', (istream.buf[5]))[0]
 
+# timestamp, self_test_done, the 4 bytes of gyr_fsr and of acc_fsr, datarate
+_START_IMU_RESPONSE = struct.Struct('<IH3xBx4B4BB')
 
 class StartImuResponse:
 
@@ -1402,30 +1226,19 @@ class StartImuResponse:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_timestamp(istream)
-		self.decode_self_test_done(istream)
-		self.decode_acc_fsr(istream)
-		self.decode_gyr_fsr(istream)
-		self.decode_datarate(istream)
-		pass
-
-	def decode_timestamp(self, istream):
-		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)
-
-	def decode_self_test_done(self, istream):
-		self.self_test_done= struct.unpack('<B', istream.buf[3])[0]
+		(seconds, ms, self.self_test_done, gyr_0, gyr_1, gyr_2, gyr_3, acc_0, acc_1, acc_2, acc_3,
+			self.datarate) = istream.unpack_at(_START_IMU_RESPONSE, 0)
+		istream.pos += _TIMESTAMP.size
+		self.timestamp = _timestamp(seconds, ms)
+		self.gyr_fsr = (gyr_3 << 32) + (gyr_2 << 16) + (gyr_1 << 8) + gyr_0
+		self.acc_fsr = (acc_3 << 32) + (acc_2 << 16) + (acc_1 << 8) + acc_0
 
-	def decode_acc_fsr(self, istream):
-		self.gyr_fsr = (struct.unpack('<B', istream.buf[8])[0] << 32) + (struct.unpack('<B', istream.buf[7])[0] << 16) + (struct.unpack('<B', istream.buf[6])[0] << 8) + (struct.unpack('<B', (istream.buf[5]))[0])
-
-	def decode_gyr_fsr(self, istream):
-		self.acc_fsr = (struct.unpack('<B', istream.buf[12])[0] << 32) + (struct.unpack('<B', istream.buf[11])[0] << 16) + (struct.unpack('<B', istream.buf[10])[0] << 8) + (struct.unpack('<B', (istream.buf[9]))[0])
-
-	def decode_datarate(self, istream):
-		#print("datarate:", istream.buf)
-		self.datarate = struct.unpack('<B', istream.buf[13])[0]
 
+# total_space, free_space, timestamp
+_FREE_SDC_SPACE_RESPONSE = struct.Struct('<IIIH')
+# The 4 bytes of total_space and of free_space as they are decoded; the timestamp is decoded
+#   from the start of the response
+_FREE_SDC_SPACE_RESPONSE_SPACE = struct.Struct('<3x4b4b')
 
 class FreeSDCSpaceResponse:
 
@@ -1447,19 +1260,8 @@ class FreeSDCSpaceResponse:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_total_space(ostream)
-		self.encode_free_space(ostream)
-		self.encode_timestamp(ostream)
-		pass
-
-	def encode_total_space(self, ostream):
-		ostream.write(struct.pack('<I', self.total_space))
-
-	def encode_free_space(self, ostream):
-		ostream.write(struct.pack('<I', self.free_space))
-
-	def encode_timestamp(self, ostream):
-		self.timestamp.encode_internal(ostream)
+		ostream.write(_FREE_SDC_SPACE_RESPONSE.pack(
+			self.total_space, self.free_space, self.timestamp.seconds, self.timestamp.ms))
 
 
 	@classmethod
@@ -1470,22 +1272,18 @@ class FreeSDCSpaceResponse:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_total_space(istream)
-		self.decode_free_space(istream)
-		self.decode_timestamp(istream)
-		pass
-
-	def decode_total_space(self, istream):
-		print(" total space",istream.buf)
-		self.total_space= (struct.unpack('<b', istream.buf[6])[0] << 32) + (struct.unpack('<b', istream.buf[5])[0] << 16) + (struct.unpack('<b', istream.buf[4])[0] << 8) + (struct.unpack('<b', (istream.buf[3]))[0])
-
-	def decode_free_space(self, istream):
-		self.free_space= (struct.unpack('<b', istream.buf[10])[0] << 32) + (struct.unpack('<b', istream.buf[9])[0] << 16) + (struct.unpack('<b', istream.buf[8])[0] << 8) + (struct.unpack('<b', (istream.buf[7]))[0])
-
-	def decode_timestamp(self, istream):
+		(total_0, total_1, total_2, total_3,
+			free_0, free_1, free_2, free_3) = istream.unpack_at(_FREE_SDC_SPACE_RESPONSE_SPACE, 0)
+		self.total_space = (total_3 << 32) + (total_2 << 16) + (total_1 << 8) + total_0
+		self.free_space = (free_3 << 32) + (free_2 << 16) + (free_1 << 8) + free_0
 		self.timestamp = Timestamp()
 		self.timestamp.decode_internal(istream)
 
+# done_errase, timestamp
+_ERRASE_ALL_RESPONSE = struct.Struct('<BIH')
+# done_errase as it is decoded; the timestamp is decoded from the start of the response
+_ERRASE_ALL_RESPONSE_DONE = struct.Struct('<B')
+
 class ErraseAllResponse:
 
 	def __init__(self):
@@ -1505,15 +1303,7 @@ class ErraseAllResponse:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_done_errase(ostream)
-		self.encode_timestamp(ostream)
-		pass
-
-	def encode_done_errase(self, ostream):
-		ostream.write(struct.pack('<B', self.done_errase))
-
-	def encode_timestamp(self, ostream):
-		self.timestamp.encode_internal(ostream)
+		ostream.write(_ERRASE_ALL_RESPONSE.pack(self.done_errase, self.timestamp.seconds, self.timestamp.ms))
 
 
 	@classmethod
@@ -1524,18 +1314,17 @@ class ErraseAllResponse:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_done_errase(istream)
-		self.decode_timestamp(istream)
-		pass
-
-	def decode_done_errase(self, istream):
-		self.done_errase= struct.unpack('<B', istream.buf[3])[0]
-
-	def decode_timestamp(self, istream):
+		self.done_errase, = istream.unpack_at(_ERRASE_ALL_RESPONSE_DONE, 3)
 		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)		
+		self.timestamp.decode_internal(istream)
 
 #
+# gyr, mag, acc and rot x, y, z, timestamp
+_GET_IMU_DATA_RESPONSE = struct.Struct('<12BIH')
+# gyr, mag, acc and rot x, y, z as they are decoded, in 1/10000 units; the timestamp is decoded
+#   from the start of the response
+_GET_IMU_DATA_RESPONSE_VALUES = struct.Struct('<3x12h')
+
 class GetIMUDataResponse:
 
 	def __init__(self):
@@ -1569,59 +1358,10 @@ class GetIMUDataResponse:
 		return ostream.buf
 
 	def encode_internal(self, ostream):
-		self.encode_gyr_x(ostream)
-		self.encode_gyr_y(ostream)
-		self.encode_gyr_z(ostream)
-		self.encode_mag_x(ostream)
-		self.encode_mag_y(ostream)
-		self.encode_mag_z(ostream)
-		self.encode_acc_x(ostream)
-		self.encode_acc_y(ostream)
-		self.encode_acc_z(ostream)
-		self.encode_rot_x(ostream)
-		self.encode_rot_y(ostream)
-		self.encode_rot_z(ostream)
-		self.encode_timestamp(ostream)
-		pass
-
-	def encode_gyr_x(self, ostream):
-		ostream.write(struct.pack('<B', self.gyr_x))
-
-	def encode_gyr_y(self, ostream):
-		ostream.write(struct.pack('<B', self.gyr_y))
-
-	def encode_gyr_z(self, ostream):
-		ostream.write(struct.pack('<B', self.gyr_z))
-
-	def encode_mag_x(self, ostream):
-		ostream.write(struct.pack('<B', self.mag_x))
-
-	def encode_mag_y(self, ostream):
-		ostream.write(struct.pack('<B', self.mag_y))
-
-	def encode_mag_z(self, ostream):
-		ostream.write(struct.pack('<B', self.mag_z))
-
-	def encode_acc_x(self, ostream):
-		ostream.write(struct.pack('<B', self.acc_x))
-
-	def encode_acc_y(self, ostream):
-		ostream.write(struct.pack('<B', self.acc_y))
-
-	def encode_acc_z(self, ostream):
-		ostream.write(struct.pack('<B', self.acc_z))
-
-	def encode_rot_x(self, ostream):
-		ostream.write(struct.pack('<B', self.rot_x))
-
-	def encode_rot_y(self, ostream):
-		ostream.write(struct.pack('<B', self.rot_y))
-
-	def encode_rot_z(self, ostream):
-		ostream.write(struct.pack('<B', self.rot_z))
-
-	def encode_timestamp(self, ostream):
-		self.timestamp.encode_internal(ostream)
+		ostream.write(_GET_IMU_DATA_RESPONSE.pack(
+			self.gyr_x, self.gyr_y, self.gyr_z, self.mag_x, self.mag_y, self.mag_z,
+			self.acc_x, self.acc_y, self.acc_z, self.rot_x, self.rot_y, self.rot_z,
+			self.timestamp.seconds, self.timestamp.ms))
 
 
 	@classmethod
@@ -1632,60 +1372,22 @@ class GetIMUDataResponse:
 
 	def decode_internal(self, istream):
 		self.reset()
-		self.decode_gyr_x(istream)
-		self.decode_gyr_y(istream)
-		self.decode_gyr_z(istream)
-		self.decode_mag_x(istream)
-		self.decode_mag_y(istream)
-		self.decode_mag_z(istream)
-		self.decode_acc_x(istream)
-		self.decode_acc_y(istream)
-		self.decode_acc_z(istream)
-		self.decode_rot_x(istream)
-		self.decode_rot_y(istream)
-		self.decode_rot_z(istream)
-		self.decode_timestamp(istream)
-		pass
-
-	def decode_gyr_x(self, istream):		
-		self.gyr_x= float((struct.unpack('<b', istream.buf[4])[0] << 8) + struct.unpack('<B', (istream.buf[3]))[0])/float(10000)
-
-	def decode_gyr_y(self, istream):
-		self.gyr_y= float((struct.unpack('<b', istream.buf[6])[0] << 8) + struct.unpack('<B', (istream.buf[5]))[0])/float(10000)
-
-	def decode_gyr_z(self, istream):
-		self.gyr_z= float((struct.unpack('<b', istream.buf[8])[0] << 8) + struct.unpack('<B', (istream.buf[7]))[0])/float(10000)
-
-	def decode_mag_x(self, istream):
-		self.mag_x= float((struct.unpack('<b', istream.buf[10])[0] << 8) + struct.unpack('<B', (istream.buf[9]))[0])/float(10000)
-
-	def decode_mag_y(self, istream):
-		self.mag_y= float((struct.unpack('<b', istream.buf[12])[0] << 8) + struct.unpack('<B', (istream.buf[11]))[0])/float(10000)
-
-	def decode_mag_z(self, istream):
-		self.mag_z= float((struct.unpack('<b', istream.buf[14])[0] << 8) + struct.unpack('<B', (istream.buf[13]))[0])/float(10000)
-
-	def decode_acc_x(self, istream):
-		self.acc_x= float((struct.unpack('<b', istream.buf[16])[0] << 8) + struct.unpack('<B', (istream.buf[15]))[0])/float(10000)
-
-	def decode_acc_y(self, istream):
-		self.acc_y= float((struct.unpack('<b', istream.buf[18])[0] << 8) + struct.unpack('<B', (istream.buf[17]))[0])/float(10000)
-
-	def decode_acc_z(self, istream):
-		self.acc_z= float((struct.unpack('<b', istream.buf[20])[0] << 8) + struct.unpack('<B', (istream.buf[19]))[0])/float(10000)
-
-	def decode_rot_x(self, istream):
-		self.rot_x= float((struct.unpack('<b', istream.buf[22])[0] << 8) + struct.unpack('<B', (istream.buf[21]))[0])/float(10000)
-
-	def decode_rot_y(self, istream):
-		self.rot_y= float((struct.unpack('<b', istream.buf[24])[0] << 8) + struct.unpack('<B', (istream.buf[23]))[0])/float(10000)
-
-	def decode_rot_z(self, istream):
-		self.rot_z= float((struct.unpack('<b', istream.buf[26])[0] << 8) + struct.unpack('<B', (istream.buf[25]))[0])/float(10000)
-
-	def decode_timestamp(self, istream):
+		(gyr_x, gyr_y, gyr_z, mag_x, mag_y, mag_z, acc_x, acc_y, acc_z,
+			rot_x, rot_y, rot_z) = istream.unpack_at(_GET_IMU_DATA_RESPONSE_VALUES, 0)
+		self.gyr_x = float(gyr_x)/float(10000)
+		self.gyr_y = float(gyr_y)/float(10000)
+		self.gyr_z = float(gyr_z)/float(10000)
+		self.mag_x = float(mag_x)/float(10000)
+		self.mag_y = float(mag_y)/float(10000)
+		self.mag_z = float(mag_z)/float(10000)
+		self.acc_x = float(acc_x)/float(10000)
+		self.acc_y = float(acc_y)/float(10000)
+		self.acc_z = float(acc_z)/float(10000)
+		self.rot_x = float(rot_x)/float(10000)
+		self.rot_y = float(rot_y)/float(10000)
+		self.rot_z = float(rot_z)/float(10000)
 		self.timestamp = Timestamp()
-		self.timestamp.decode_internal(istream)	
+		self.timestamp.decode_internal(istream)
 
 class GetFWVersionResponse:
 
@@ -1724,7 +1426,7 @@ class GetFWVersionResponse:
 		pass
 
 	def decode_fw_version(self, istream):
-		self.version = str(istream.buf[3:+32])
+		self.version = str(istream.buf[3:32])
 
 class FileInfo:
 	def __init__(self):
@@ -1732,6 +1434,12 @@ class FileInfo:
 		self.file_size = 0
 		self.timestamp = None
 
+# file_count, total_files, start_index, padding up to the 4-byte aligned FileInfo entries
+_LIST_FILES_RESPONSE_HEADER = struct.Struct('<BBBx')
+# filename, file_size, timestamp
+_FILE_INFO = struct.Struct('<%dsII' % MAX_FILENAME_LENGTH)
+_FILE_INFO_SIZE_AND_TIMESTAMP = struct.Struct('<II')
+
 class ListFilesResponse:
 	def __init__(self):
 		self.reset()
@@ -1757,18 +1465,14 @@ class ListFilesResponse:
 		self.encode_files(ostream)
 
 	def encode_header(self, ostream):
-		ostream.write(struct.pack('<B', self.header.file_count))
-		ostream.write(struct.pack('<B', self.header.total_files))
-		ostream.write(struct.pack('<B', self.header.start_index))
+		ostream.write(_LIST_FILES_RESPONSE_HEADER.pack(
+			self.header.file_count, self.header.total_files, self.header.start_index))
 
 	def encode_files(self, ostream):
 		for i in range(self.header.file_count):
 			file_info = self.files[i] if i < len(self.files) else FileInfo()
-			filename_bytes = file_info.filename.encode('utf-8')[:MAX_FILENAME_LENGTH-1]
-			filename_bytes += b'\x00' * (MAX_FILENAME_LENGTH - len(filename_bytes))
-			ostream.write(filename_bytes)
-			ostream.write(struct.pack('<I', file_info.file_size))
-			ostream.write(struct.pack('<I', file_info.timestamp))
+			ostream.write(_FILE_INFO.pack(file_info.filename.encode('utf-8')[:MAX_FILENAME_LENGTH-1],
+				file_info.file_size, file_info.timestamp))
 
 	@classmethod
 	def decode(cls, buf):
@@ -1784,12 +1488,14 @@ class ListFilesResponse:
 	def decode_header(self, istream):
 		# Skip the padding bytes
 		istream.read(3) 
-		self.header.file_count = struct.unpack('<B', istream.read(1))[0]
-		self.header.total_files = struct.unpack('<B', istream.read(1))[0]
-		self.header.start_index = struct.unpack('<B', istream.read(1))[0]
+		self.header.file_count, self.header.total_files, self.header.start_index = \
+			istream.unpack(_LIST_FILES_RESPONSE_HEADER)
 
+	# The badge cuts every response off at 64 bytes, which leaves out the end of a 3rd file. Only
+	# the files that arrived completely are decoded, and file_count is set to their number.
 	def decode_files(self, istream):
-		for i in range(self.header.file_count):
+		file_count = min(self.header.file_count, (len(istream.view) - istream.pos) // _FILE_INFO.size)
+		for i in range(file_count):
 			try:
 				file_info = FileInfo()
 				
@@ -1797,16 +1503,15 @@ class ListFilesResponse:
 				filename_bytes = istream.read(MAX_FILENAME_LENGTH)
 				file_info.filename = filename_bytes.rstrip(b'\x00').decode('utf-8').strip()
 
-				# Extract file size (4 bytes)
-				size_bytes = istream.read(4)
-				file_info.file_size = struct.unpack('<I', size_bytes)[0]
-
-				# Extract timestamp (4 bytes)
-				timestamp_bytes = istream.read(4)
-				file_info.timestamp = struct.unpack('<I', timestamp_bytes)[0]			
+				# Extract file size and timestamp (4 bytes each)
+				file_info.file_size, file_info.timestamp = istream.unpack(_FILE_INFO_SIZE_AND_TIMESTAMP)
 				self.files.append(file_info)
 			except Exception as e:
 				print("ERROR decoding file at index {}: {}".format(i, e))
+		self.header.file_count = len(self.files)
+
+# file_size, total_chunks, success
+_START_DOWNLOAD_RESPONSE = struct.Struct('<3xIIB')
 
 class StartDownloadResponse:
 	def __init__(self):
@@ -1828,9 +1533,11 @@ class StartDownloadResponse:
 	
 	def decode_internal(self, istream):
 		self.reset()
-		self.file_size = struct.unpack('<I', istream.buf[3:7])[0]
-		self.total_chunks = struct.unpack('<I', istream.buf[7:11])[0]  
-		self.success = struct.unpack('<B', istream.buf[11:12])[0]
+		self.file_size, self.total_chunks, self.success = istream.unpack_at(_START_DOWNLOAD_RESPONSE, 0)
+
+# chunk_index, chunk_size; followed by chunk_size bytes of data and is_last_chunk
+_DOWNLOAD_CHUNK_RESPONSE_HEADER = struct.Struct('<3xIH')
+_DOWNLOAD_CHUNK_RESPONSE_LAST = struct.Struct('<B')
 
 class DownloadChunkResponse:
 	def __init__(self):
@@ -1842,7 +1549,8 @@ class DownloadChunkResponse:
 	def reset(self):
 		self.chunk_index = 0
 		self.chunk_size = 0
-		self.data = []
+		# memoryview of the chunk bytes in the received message, they are not copied
+		self.data = memoryview(b'')
 		self.is_last_chunk = 0
 
 	@classmethod
@@ -1854,13 +1562,12 @@ class DownloadChunkResponse:
 	def decode_internal(self, istream):
 		self.reset()
 
-		self.chunk_index = struct.unpack('<I', istream.buf[3:7])[0]
-		self.chunk_size = struct.unpack('<H', istream.buf[7:9])[0]
-		# Extract data bytes
-		for i in range(self.chunk_size):
-			self.data.append(struct.unpack('<B', istream.buf[9+i:10+i])[0])
-		
-		self.is_last_chunk = struct.unpack('<B', istream.buf[9+self.chunk_size:10+self.chunk_size])[0]
+		self.chunk_index, self.chunk_size = istream.unpack_at(_DOWNLOAD_CHUNK_RESPONSE_HEADER, 0)
+		self.data = istream.view_at(_DOWNLOAD_CHUNK_RESPONSE_HEADER.size, self.chunk_size)
+		self.is_last_chunk, = istream.unpack_at(_DOWNLOAD_CHUNK_RESPONSE_LAST, _DOWNLOAD_CHUNK_RESPONSE_HEADER.size + self.chunk_size)
+
+# checksum, success
+_GET_FILE_CHECKSUM_RESPONSE = struct.Struct('<3xIB')
 
 class GetFileChecksumResponse:
 	def __init__(self):
@@ -1881,8 +1588,7 @@ class GetFileChecksumResponse:
 	
 	def decode_internal(self, istream):
 		self.reset()
-		self.checksum = struct.unpack('<I', istream.buf[3:7])[0]
-		self.success = struct.unpack('<B', istream.buf[7:8])[0]
+		self.checksum, self.success = istream.unpack_at(_GET_FILE_CHECKSUM_RESPONSE, 0)
 
 class Response:
 
@@ -1998,23 +1704,8 @@ class Response:
 
 		def decode_internal(self, istream):
 			self.reset()
-			self.which= struct.unpack('<B', istream.read(1))[0]
-			options = {
-				1: self.decode_status_response,
-				2: self.decode_start_microphone_response,
-				3: self.decode_start_scan_response,
-				4: self.decode_start_imu_response,
-				5: self.decode_free_sdc_space_response,
-				32: self.decode_sdc_errase_all_response,
-				34: self.decode_get_imu_data_response,
-				36: self.decode_get_fw_version_response,
-				38: self.decode_list_files_response,
-				42: self.decode_start_download_response,
-				43: self.decode_download_chunk_response,
-				44: self.decode_get_file_checksum_response,
-			}
-			options[self.which](istream)
-			pass
+			self.which, = istream.unpack(_WHICH)
+			self._decoders[self.which](self, istream)
 
 		def decode_status_response(self, istream):
 			self.status_response = StatusResponse()
@@ -2062,4 +1753,20 @@ class Response:
 
 		def decode_get_file_checksum_response(self, istream):
 			self.get_file_checksum_response = GetFileChecksumResponse()
-			self.get_file_checksum_response.decode_internal(istream)
\ No newline at end of file
+			self.get_file_checksum_response.decode_internal(istream)
+
+		# Decoder of every response type, by tag
+		_decoders = {
+			1: decode_status_response,
+			2: decode_start_microphone_response,
+			3: decode_start_scan_response,
+			4: decode_start_imu_response,
+			5: decode_free_sdc_space_response,
+			32: decode_sdc_errase_all_response,
+			34: decode_get_imu_data_response,
+			36: decode_get_fw_version_response,
+			38: decode_list_files_response,
+			42: decode_start_download_response,
+			43: decode_download_chunk_response,
+			44: decode_get_file_checksum_response,
+		}
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# Serves emulated midges over TCP, one process per midge, so the hub can be run against many
+#   badges at once. Each midge listens on its own port and is reached by the hub through a
+#   tcp://host:port address in the mapping CSV (see tcp_badge_connection.py).
+
+from __future__ import division, absolute_import, print_function
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import time
+
+from emulated_badge_connection import (EmulatedBadge, ATT_HEADER_LENGTH, DEFAULT_MTU,
+                                       DEFAULT_NOTIFICATION_LATENCY, may_be_lost)
+from tcp_badge_connection import TCP_ADDRESS_PREFIX
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 9000
+
+_LENGTH_HEADER = struct.Struct('<H')
+
+
+# Reads exactly `length` bytes from sock, or returns None if the connection is closed first.
+def _recv_exactly(sock, length):
+    data = b''
+    while len(data) < length:
+        received = sock.recv(length - len(data))
+        if not received:
+            return None
+        data += received
+    return data
+
+
+# Answers the requests of one hub connection until it disconnects. Responses are sent in
+#   notification sized pieces, `latency` seconds apart, and download chunks are lost with
+#   probability packet_loss, like EmulatedBadgeConnection does in-process.
+def _serve_connection(badge, conn, latency, mtu, packet_loss, rnd):
+    notification_size = mtu - ATT_HEADER_LENGTH
+    while True:
+        header = _recv_exactly(conn, _LENGTH_HEADER.size)
+        if header is None:
+            return
+        request = _recv_exactly(conn, _LENGTH_HEADER.unpack(header)[0])
+        if request is None:
+            return
+
+        response = badge.handle_request(header + request)
+        if response is None:
+            continue
+        if packet_loss > 0 and may_be_lost(response) and rnd.random() < packet_loss:
+            logger.debug("Dropping response of {} bytes".format(len(response)))
+            continue
+
+        for start in range(0, len(response), notification_size):
+            if latency > 0:
+                time.sleep(latency)
+            conn.sendall(response[start:start + notification_size])
+
+
+# Serves `badge` on host:port, one connection at a time like a midge, until killed.
+def serve_badge(badge, host, port, latency=DEFAULT_NOTIFICATION_LATENCY, mtu=DEFAULT_MTU, packet_loss=0.0):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(1)
+    rnd = random.Random(port)
+
+    while True:
+        conn, _ = server.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            _serve_connection(badge, conn, latency, mtu, packet_loss, rnd)
+        except socket.error as error:
+            logger.debug("Connection to port {} failed: {}".format(port, error))
+        finally:
+            conn.close()
+
+
+def _run_badge(num_files, file_size, host, port, latency, mtu, packet_loss):
+    badge = EmulatedBadge()
+    for i in range(num_files):
+        badge.add_file("DATA{}.BIN".format(i), os.urandom(file_size))
+    try:
+        serve_badge(badge, host, port, latency, mtu, packet_loss)
+    except KeyboardInterrupt:
+        pass
+
+
+# Starts `count` simulated midges on consecutive ports from first_port, each in its own process.
+# Returns the processes and the tcp:// addresses of the midges.
+def start_simulators(count, num_files, file_size, host="127.0.0.1", first_port=DEFAULT_PORT,
+                     latency=DEFAULT_NOTIFICATION_LATENCY, mtu=DEFAULT_MTU, packet_loss=0.0):
+    processes = []
+    addresses = []
+    for port in range(first_port, first_port + count):
+        process = multiprocessing.Process(target=_run_badge,
+                                          args=(num_files, file_size, host, port, latency, mtu, packet_loss))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+        addresses.append("{}{}:{}".format(TCP_ADDRESS_PREFIX, host, port))
+    return processes, addresses
+
+
+if __name__ == "__main__":
+    import argparse
+    import pandas as pd
+    parser = argparse.ArgumentParser(description='Simulate midges over TCP for the hub')
+    parser.add_argument('--count', type=int, default=10, help='Number of simulated midges')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port of the first midge')
+    parser.add_argument('--files', type=int, default=3, help='Number of files on every midge')
+    parser.add_argument('--file-size', type=int, default=20000, help='Size of every file in bytes')
+    parser.add_argument('--latency', type=float, default=DEFAULT_NOTIFICATION_LATENCY,
+                        help='Seconds per BLE notification')
+    parser.add_argument('--mtu', type=int, default=DEFAULT_MTU, help='ATT MTU of the simulated BLE link')
+    parser.add_argument('--packet-loss', type=float, default=0.0, help='Probability that a download chunk response is lost')
+    parser.add_argument('--csv', help='Write a mapping file with the addresses of the midges, for hub.py')
+    args = parser.parse_args()
+
+    processes, addresses = start_simulators(args.count, args.files, args.file_size, args.host, args.port,
+                                            args.latency, args.mtu, args.packet_loss)
+    if args.csv:
+        pd.DataFrame({'Participant Id': range(1, args.count + 1), 'Mac Address': addresses}).to_csv(
+            args.csv, index=False)
+        print("Wrote the addresses of the midges to {}".format(args.csv))
+    print("Simulating {} midges on {}:{}-{}, press Ctrl-C to stop".format(
+        args.count, args.host, args.port, args.port + args.count - 1))
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
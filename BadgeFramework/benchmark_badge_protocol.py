@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+# Times encoding and decoding of the badge_protocol messages the hub handles most often.
+#   Pass --baseline with another version of badge_protocol.py (e.g. one checked out from git)
+#   to compare against it.
+
+from __future__ import division, absolute_import, print_function
+import struct
+import timeit
+
+import badge_protocol
+
+# Arbitrary response bytes after the tag
+_PATTERN = bytes(bytearray((i * 37 + 11) & 0xFF for i in range(1, 64)))
+
+
+def _encode_chunk_request(protocol):
+    request = protocol.Request()
+    request.type.which = protocol.Request_download_chunk_request_tag
+    request.type.download_chunk_request = protocol.DownloadChunkRequest()
+    request.type.download_chunk_request.chunk_index = 1234
+    return request.encode()
+
+
+# Returns (name, function) pairs of the operations to time with `protocol`.
+def make_operations(protocol):
+    status = struct.pack('<B', protocol.Response_status_response_tag) + _PATTERN
+    imu_data = struct.pack('<B', protocol.Response_get_imu_data_response_tag) + _PATTERN
+    chunk = struct.pack('<B3xIH%dsB' % protocol.DOWNLOAD_CHUNK_SIZE, protocol.Response_download_chunk_response_tag,
+                        1234, protocol.DOWNLOAD_CHUNK_SIZE, _PATTERN[:protocol.DOWNLOAD_CHUNK_SIZE], 0)
+    checksum = struct.pack('<B3xIB', protocol.Response_get_file_checksum_response_tag, 0xDEADBEEF, 1).ljust(64, b'\x00')
+    return [
+        ('status response decode', lambda: protocol.Response.decode(status)),
+        ('IMU data response decode', lambda: protocol.Response.decode(imu_data)),
+        ('download chunk decode', lambda: protocol.Response.decode(chunk)),
+        ('checksum response decode', lambda: protocol.Response.decode(checksum)),
+        ('download chunk req. encode', lambda: _encode_chunk_request(protocol)),
+    ]
+
+
+# Loads the badge_protocol.py at `path` as a separate module.
+def load_protocol(path):
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source('baseline_badge_protocol', path)
+    spec = importlib.util.spec_from_file_location('baseline_badge_protocol', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Returns the best time per call of `function` in microseconds.
+def time_operation(function, number, repeat):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark encoding and decoding of badge messages')
+    parser.add_argument('--baseline', help='Path of another badge_protocol.py to compare against')
+    parser.add_argument('--number', type=int, default=10000, help='Calls per measurement')
+    parser.add_argument('--repeat', type=int, default=30, help='Measurements per operation, the best is reported')
+    args = parser.parse_args()
+
+    operations = make_operations(badge_protocol)
+    baseline_operations = None
+    if args.baseline:
+        baseline_operations = make_operations(load_protocol(args.baseline))
+
+    for i, (name, function) in enumerate(operations):
+        elapsed = time_operation(function, args.number, args.repeat)
+        if baseline_operations is None:
+            print("{:28s} {:6.1f} us".format(name, elapsed))
+        else:
+            baseline = time_operation(baseline_operations[i][1], args.number, args.repeat)
+            print("{:28s} {:6.1f} us -> {:6.1f} us  ({:.1f}x)".format(name, baseline, elapsed, baseline / elapsed))
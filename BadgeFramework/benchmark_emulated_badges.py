@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# Benchmarks OpenBadge and the hub against emulated midges (see emulated_badge_connection.py),
+#   so download performance can be measured without any hardware.
+
+from __future__ import division, absolute_import, print_function
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from badge import OpenBadge
+from emulated_badge_connection import (EmulatedBadge, EmulatedBadgeConnection, register_badge, unregister_badge,
+                                       EMULATED_ADDRESS_PREFIX, DEFAULT_MTU, DEFAULT_NOTIFICATION_LATENCY)
+from hub_utilities import download_all_devices, DEFAULT_DOWNLOAD_WORKERS
+
+
+def make_badge(num_files, file_size):
+    badge = EmulatedBadge()
+    for i in range(num_files):
+        badge.add_file("DATA{}.BIN".format(i), os.urandom(file_size))
+    return badge
+
+
+def benchmark_single_badge(num_files, file_size, output_dir, **connection_options):
+    connection = EmulatedBadgeConnection(make_badge(num_files, file_size), **connection_options)
+    connection.connect()
+    badge = OpenBadge(connection)
+
+    start = time.time()
+    files = badge.list_files()
+    print("list_files: {} files in {:.3f} s".format(len(files), time.time() - start))
+
+    filename = files[0]['filename']
+    start = time.time()
+    badge.download_file(filename, os.path.join(output_dir, filename), show_progress=False)
+    elapsed = time.time() - start
+    print("download_file: {} bytes in {:.3f} s, {:.1f} kB/s".format(file_size, elapsed, file_size / elapsed / 1000))
+    connection.disconnect()
+
+
+def benchmark_fleet(num_badges, num_files, file_size, output_dir, num_workers, **connection_options):
+    addresses = [EMULATED_ADDRESS_PREFIX + str(i) for i in range(1, num_badges + 1)]
+    for address in addresses:
+        register_badge(address, make_badge(num_files, file_size), **connection_options)
+    df = pd.DataFrame({'Participant Id': range(1, num_badges + 1), 'Mac Address': addresses})
+
+    try:
+        start = time.time()
+        download_all_devices(df, output_dir, num_workers=num_workers)
+        elapsed = time.time() - start
+    finally:
+        for address in addresses:
+            unregister_badge(address)
+
+    total_size = num_badges * num_files * file_size
+    print("download_all: {} midges, {} bytes in {:.3f} s, {:.1f} kB/s".format(
+        num_badges, total_size, elapsed, total_size / elapsed / 1000))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark downloads from emulated midges')
+    parser.add_argument('--badges', type=int, default=10, help='Number of emulated midges for the hub benchmark')
+    parser.add_argument('--files', type=int, default=3, help='Number of files on every midge')
+    parser.add_argument('--file-size', type=int, default=20000, help='Size of every file in bytes')
+    parser.add_argument('--latency', type=float, default=DEFAULT_NOTIFICATION_LATENCY,
+                        help='Seconds per BLE notification')
+    parser.add_argument('--mtu', type=int, default=DEFAULT_MTU, help='ATT MTU of the emulated BLE link')
+    parser.add_argument('--packet-loss', type=float, default=0.0, help='Probability that a download chunk response is lost')
+    parser.add_argument('--workers', type=int, default=DEFAULT_DOWNLOAD_WORKERS,
+                        help='Number of midges the hub downloads at the same time')
+    args = parser.parse_args()
+
+    connection_options = dict(latency=args.latency, mtu=args.mtu, packet_loss=args.packet_loss)
+    output_dir = tempfile.mkdtemp(prefix='midge_benchmark_')
+    try:
+        benchmark_single_badge(args.files, args.file_size, output_dir, **connection_options)
+        benchmark_fleet(args.badges, args.files, args.file_size, output_dir, args.workers, **connection_options)
+    finally:
+        shutil.rmtree(output_dir)
@@ -11,7 +11,6 @@ from bluepy import btle
 from bluepy.btle import UUID, Peripheral, DefaultDelegate, AssignedNumbers ,Scanner
 from bluepy.btle import BTLEException
 import struct
-import Queue
 
 logger = logging.getLogger(__name__)
 
@@ -74,7 +73,7 @@ class BLEBadgeConnection(BadgeConnection):
 
 
 		# Contains the bytes recieved from the device. Held here until an entire message is recieved.
-		self.rx_queue = Queue.Queue()
+		self.rx_buffer = ReceiveBuffer()
 
 
 		BadgeConnection.__init__(self)
@@ -93,10 +92,10 @@ class BLEBadgeConnection(BadgeConnection):
 	# primitives to send data to other threads.
 
 	def received(self,data):
-		logger.debug("Recieved {}".format(data.encode("hex")))
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug("Recieved {}".format(data.encode("hex")))
 
-		for b in data:
-			self.rx_queue.put(b)
+		self.rx_buffer.put(data)
 
 
 	# Implements BadgeConnection's connect() spec.
@@ -125,8 +124,7 @@ class BLEBadgeConnection(BadgeConnection):
 		self.tx = None
 		self.rx = None
 
-		with self.rx_queue.mutex:
-			self.rx_queue.queue.clear()
+		self.rx_buffer.clear()
 
 		#self.ble_device.disconnect()
 		self.conn.disconnect()
@@ -143,21 +141,11 @@ class BLEBadgeConnection(BadgeConnection):
 
 
 	# Implements BadgeConnection's await_data() spec.
-	def await_data(self, data_len):
+	def await_data(self, data_len, timeout=None):
 		if not self.is_connected():
 			raise RuntimeError("BLEBadgeConnection not connected before await_data()!")
 
-		rx_message = ""
-		rx_bytes_expected = data_len
-
-		if rx_bytes_expected > 0:
-			while True:
-				while(not self.rx_queue.empty()):
-					rx_message += self.rx_queue.get()
-					if(len(rx_message) == rx_bytes_expected):
-						return rx_message
-
-				self.conn.waitForNotifications(5.0)
+		return self._receive(data_len, timeout)
 
 
 
@@ -166,19 +154,30 @@ class BLEBadgeConnection(BadgeConnection):
 		if not self.is_connected():
 			raise RuntimeError("BLEBadgeConnection not connected before send()!")
 
-		rx_message = ""
-		rx_bytes_expected = response_len
-
 		self.tx.write(message,withResponse=True)
 
-
-		if rx_bytes_expected > 0:
-			while True:
-				while(not self.rx_queue.empty()):
-					rx_message += self.rx_queue.get()
-					if(len(rx_message) == rx_bytes_expected):
-						return rx_message
-
-				self.conn.waitForNotifications(5.0)
+		return self._receive(response_len)
+
+	# Blocks until rx_bytes_expected bytes are in the receive buffer and returns them,
+	#   or returns None if a timeout is given and it expires first.
+	#   Notifications are only delivered while bluepy is waiting for them, so keep
+	#   pumping the connection until enough data has been recieved.
+	def _receive(self, rx_bytes_expected, timeout=None):
+		if rx_bytes_expected <= 0:
+			return None
+
+		deadline = None if timeout is None else time.time() + timeout
+		while True:
+			rx_message = self.rx_buffer.take(rx_bytes_expected)
+			if rx_message is not None:
+				return rx_message
+
+			wait_time = 5.0
+			if deadline is not None:
+				wait_time = min(wait_time, deadline - time.time())
+				if wait_time <= 0:
+					return None
+
+			self.conn.waitForNotifications(wait_time)
 
 
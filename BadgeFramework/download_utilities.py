@@ -0,0 +1,286 @@
+from __future__ import division, absolute_import, print_function
+import json
+import os
+import time
+import zlib
+
+PART_SUFFIX = ".part"
+# Sidecar file next to the `.part` file recording which chunks it already holds
+STATE_SUFFIX = ".state"
+# Seconds between saving the sidecar file while chunks are being written
+STATE_SAVE_INTERVAL = 5.0
+# Bytes read at a time when checksumming a file
+CRC_BLOCK_SIZE = 1 << 20
+
+
+# Manifest of the files downloaded from one badge, stored in its output directory
+MANIFEST_FILENAME = ".download_manifest.json"
+
+
+# zlib.crc32() only accepts memoryviews, like the chunks ChunkFileWriter is given, from
+#   Python 3 on. Python 2 needs them copied to a string first.
+try:
+    zlib.crc32(memoryview(b""))
+    _crc32 = zlib.crc32
+except TypeError:
+    def _crc32(data, crc):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return zlib.crc32(data, crc)
+
+
+# Writes `data` as JSON to `path`, replacing the previous file in one step.
+def _write_json(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.rename(temp_path, path)
+
+
+# Returns the CRC32 of the file at `path`, reading it in blocks of block_size bytes.
+#   zlib implements the same CRC-32 as the firmware (reflected polynomial 0xEDB88320,
+#   initial value and final XOR 0xFFFFFFFF), but in C.
+def crc32_file(path, block_size=CRC_BLOCK_SIZE):
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+    return crc & 0xFFFFFFFF
+
+
+# ChunkFileWriter streams the chunks of a file downloaded from a badge straight to disk.
+#   Chunks are written at their offset in a `.part` file next to local_path as they arrive, in
+#   any order, so memory use does not depend on the file size. The CRC32 of the file is
+#   computed along the way over the leading run of chunks that have arrived. commit()
+#   renames the `.part` file to local_path.
+# Which chunks have been written is saved in a sidecar `.part.state` file, so when resume is
+#   set an interrupted download picks up where it left off, even from another process.
+class ChunkFileWriter(object):
+    def __init__(self, local_path, file_size, total_chunks, chunk_size, resume=True):
+        self.local_path = local_path
+        self.part_path = local_path + PART_SUFFIX
+        self.state_path = self.part_path + STATE_SUFFIX
+        self.file_size = file_size
+        self.total_chunks = total_chunks
+        self.chunk_size = chunk_size
+
+        if total_chunks != (file_size + chunk_size - 1) // chunk_size:
+            raise Exception("{} chunks of {} bytes cannot hold a file of {} bytes".format(
+                total_chunks, chunk_size, file_size))
+
+        # One flag per chunk, set once the chunk is in the `.part` file
+        self.received = bytearray(total_chunks)
+        # Number of leading chunks that are included in the checksum
+        self.crc_chunks = 0
+        self._crc = 0
+
+        self.resumed = resume and self._load_state()
+        if self.resumed:
+            self.file = open(self.part_path, "r+b")
+            self._update_crc()
+        else:
+            self.file = open(self.part_path, "w+b")
+        self._last_save = time.time()
+
+    # Expected length of chunk `chunk_index`; only the last chunk may be shorter.
+    def chunk_length(self, chunk_index):
+        return min(self.chunk_size, self.file_size - chunk_index * self.chunk_size)
+
+    # Number of chunks written so far.
+    def received_chunks(self):
+        return self.received.count(b"\x01")
+
+    def bytes_written(self):
+        received_chunks = self.received_chunks()
+        if received_chunks == 0:
+            return 0
+        if self.received[-1]:
+            return (received_chunks - 1) * self.chunk_size + self.chunk_length(self.total_chunks - 1)
+        return received_chunks * self.chunk_size
+
+    def write_chunk(self, chunk_index, chunk_data):
+        if len(chunk_data) != self.chunk_length(chunk_index):
+            raise Exception("Chunk {} has {} bytes, expected {}".format(
+                chunk_index, len(chunk_data), self.chunk_length(chunk_index)))
+        if self.received[chunk_index]:
+            return
+
+        self.file.seek(chunk_index * self.chunk_size)
+        self.file.write(chunk_data)
+        self.received[chunk_index] = 1
+
+        if chunk_index == self.crc_chunks:
+            self._crc = _crc32(chunk_data, self._crc)
+            self.crc_chunks += 1
+            self._update_crc()
+
+        if time.time() - self._last_save >= STATE_SAVE_INTERVAL:
+            self.save_state()
+
+    # Extends the checksum over chunks that arrived ahead of order, reading them back from the
+    #   `.part` file (normally still in the OS cache).
+    def _update_crc(self):
+        while self.crc_chunks < self.total_chunks and self.received[self.crc_chunks]:
+            run_end = self.received.find(b"\x00", self.crc_chunks)
+            if run_end == -1:
+                run_end = self.total_chunks
+
+            self.file.seek(self.crc_chunks * self.chunk_size)
+            remaining = min(run_end * self.chunk_size, self.file_size) - self.crc_chunks * self.chunk_size
+            while remaining > 0:
+                data = self.file.read(min(remaining, 1 << 20))
+                if not data:
+                    raise Exception("{} is shorter than the chunks recorded for it".format(self.part_path))
+                self._crc = zlib.crc32(data, self._crc)
+                remaining -= len(data)
+            self.crc_chunks = run_end
+
+    # Returns True once every chunk has been written.
+    def is_complete(self):
+        return self.crc_chunks == self.total_chunks
+
+    # CRC32 of the whole file, same polynomial as the firmware. Only valid once complete.
+    def crc32(self):
+        return self._crc & 0xFFFFFFFF
+
+    # Returns the [start, end) index ranges of the chunks that have been written.
+    def _received_ranges(self):
+        ranges = []
+        start = self.received.find(b"\x01")
+        while start != -1:
+            end = self.received.find(b"\x00", start)
+            if end == -1:
+                end = self.total_chunks
+            ranges.append([start, end])
+            start = self.received.find(b"\x01", end)
+        return ranges
+
+    # Makes the chunks written so far durable and records them in the sidecar file.
+    def save_state(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        state = {
+            'file_size': self.file_size,
+            'total_chunks': self.total_chunks,
+            'chunk_size': self.chunk_size,
+            'chunks': self._received_ranges(),
+            'crc_chunks': self.crc_chunks,
+            'crc': self.crc32(),
+        }
+        _write_json(self.state_path, state)
+        self._last_save = time.time()
+
+    # Restores the chunk flags and checksum from the sidecar file.
+    # Returns False if there is nothing to resume from for this file.
+    def _load_state(self):
+        if not os.path.exists(self.part_path):
+            return False
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+
+        if (state.get('file_size'), state.get('total_chunks'), state.get('chunk_size')) != \
+                (self.file_size, self.total_chunks, self.chunk_size):
+            return False
+
+        received = bytearray(self.total_chunks)
+        for start, end in state['chunks']:
+            received[start:end] = b"\x01" * (end - start)
+
+        crc_chunks = state['crc_chunks']
+        first_missing = received.find(b"\x00")
+        if first_missing != -1 and first_missing < crc_chunks:
+            return False
+        self.received = received
+        self.crc_chunks = crc_chunks
+        self._crc = state['crc']
+        return True
+
+    # Saves the progress and closes the `.part` file, leaving both in place.
+    def close(self):
+        if not self.file.closed:
+            self.save_state()
+            self.file.close()
+
+    # Atomically moves the finished `.part` file to local_path.
+    def commit(self):
+        if not self.is_complete():
+            raise Exception("Cannot finish {}, only {} of {} chunks were recieved".format(
+                self.local_path, self.crc_chunks, self.total_chunks))
+
+        if not self.file.closed:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        os.rename(self.part_path, self.local_path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    # Closes and deletes the `.part` file and its sidecar file.
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        for path in (self.part_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# Turns the copy at local_path of a file that has since grown on the badge into a resumable
+#   `.part` file for ChunkFileWriter. Files on the badge are only appended to, so every whole
+#   chunk of the old copy is kept and only the chunks after it are downloaded again.
+def resume_from_prefix(local_path, file_size, chunk_size):
+    part_path = local_path + PART_SUFFIX
+    kept_chunks = min(os.path.getsize(local_path), file_size) // chunk_size
+    os.rename(local_path, part_path)
+
+    # The checksum over the kept chunks is recomputed from the file when it is resumed
+    _write_json(part_path + STATE_SUFFIX, {
+        'file_size': file_size,
+        'total_chunks': (file_size + chunk_size - 1) // chunk_size,
+        'chunk_size': chunk_size,
+        'chunks': [[0, kept_chunks]] if kept_chunks else [],
+        'crc_chunks': 0,
+        'crc': 0,
+    })
+
+
+# DownloadManifest remembers the files that were downloaded from a badge into output_dir, with
+#   the size and timestamp the badge listed for them and their verified checksum. It is used
+#   to tell which files need to be fetched again on the next sync.
+class DownloadManifest(object):
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.files = {}
+        try:
+            with open(self.path) as f:
+                self.files = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+
+    # Returns True if `filename` was downloaded before with the same size and timestamp, and
+    #   the local copy is still there.
+    def is_unchanged(self, filename, file_size, timestamp, local_path):
+        entry = self.files.get(filename)
+        return (entry is not None and entry['size'] == file_size and entry['timestamp'] == timestamp
+                and os.path.exists(local_path) and os.path.getsize(local_path) == file_size)
+
+    # Returns True if the local copy of `filename` is a complete earlier download of a file
+    #   that is now bigger on the badge.
+    def has_grown(self, filename, file_size, local_path):
+        entry = self.files.get(filename)
+        return (entry is not None and entry['size'] < file_size
+                and os.path.exists(local_path) and os.path.getsize(local_path) == entry['size'])
+
+    def record(self, filename, file_size, timestamp, checksum):
+        self.files[filename] = {
+            'size': file_size,
+            'timestamp': timestamp,
+            'crc': checksum,
+        }
+        _write_json(self.path, self.files)
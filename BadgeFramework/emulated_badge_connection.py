@@ -0,0 +1,415 @@
+from __future__ import division, absolute_import, print_function
+import collections
+import datetime
+import logging
+import random
+import struct
+import threading
+import time
+import zlib
+
+from badge_connection import *
+from badge_protocol import *
+
+logger = logging.getLogger(__name__)
+
+# Addresses starting with this prefix refer to emulated badges, registered with register_badge()
+EMULATED_ADDRESS_PREFIX = "emulated://"
+
+# The firmware always sends sizeof(Response.type) bytes, counted from the start of Response,
+#   whichever response it is, so longer responses are cut off
+RESPONSE_LENGTH = 64
+# Default ATT MTU of a BLE connection; every notification carries MTU - 3 bytes of a message
+DEFAULT_MTU = 23
+ATT_HEADER_LENGTH = 3
+# Seconds it takes to deliver one notification, one BLE connection interval
+DEFAULT_NOTIFICATION_LATENCY = 0.0075
+# The firmware puts at most this many files in a list_files response
+LIST_FILES_MAX_FILES = 3
+# Size of the emulated SD card in MB, the unit free_sdc_space is reported in
+DEFAULT_TOTAL_SPACE = 30436
+DEFAULT_FW_VERSION = "emulated"
+
+_LENGTH_HEADER = struct.Struct('<H')
+
+# Responses are packed as the firmware sends them: `which`, 3 bytes of padding that align the
+#   union, then the C struct of the response (see rythmbadge/protocol_messages.h).
+# clock_status, microphone_status, scan_status, imu_status, battery_level, pdm_data, scan_data,
+#   time_delta, timestamp
+_STATUS_RESPONSE = struct.Struct('<B3xBBBBb3xIH2xiIH')
+# timestamp, mode, gain_l, gain_r, switch_pos, pdm_freq
+_START_MICROPHONE_RESPONSE = struct.Struct('<B3xIHBbbbH')
+# timestamp, window, interval
+_START_SCAN_RESPONSE = struct.Struct('<B3xIHHH')
+# timestamp, self_test_done, gyr_fsr, acc_fsr, datarate
+_START_IMU_RESPONSE = struct.Struct('<B3xIHBxIIB')
+# total_space, free_space, timestamp
+_FREE_SDC_SPACE_RESPONSE = struct.Struct('<B3xIIIH')
+# done_errase, timestamp
+_ERRASE_ALL_RESPONSE = struct.Struct('<B3xBIH')
+# gyr, mag, acc and rot x, y, z, timestamp
+_GET_IMU_DATA_RESPONSE = struct.Struct('<B3x12hIH')
+_GET_FW_VERSION_RESPONSE = struct.Struct('<B3x32s')
+# file_count, total_files, start_index, followed by file_count times filename, file_size,
+#   timestamp. The files are aligned to 4 bytes, as in the C struct.
+_LIST_FILES_RESPONSE_HEADER = struct.Struct('<B3xBBBx')
+_FILE_INFO = struct.Struct('<%dsII' % MAX_FILENAME_LENGTH)
+# file_size, total_chunks, success
+_START_DOWNLOAD_RESPONSE = struct.Struct('<B3xIIB')
+# chunk_index, chunk_size, data, is_last_chunk
+_DOWNLOAD_CHUNK_RESPONSE = struct.Struct('<B3xIH%dsB' % DOWNLOAD_CHUNK_SIZE)
+# checksum, success
+_GET_FILE_CHECKSUM_RESPONSE = struct.Struct('<B3xIB')
+
+
+# Returns whether `response`, as returned by EmulatedBadge.handle_request(), may be lost on an
+#   emulated link. Only download chunks are, since OpenBadge requests those again when they do not
+#   arrive in time, but waits for any other response without a timeout.
+def may_be_lost(response):
+    return struct.unpack_from('<B', response, _LENGTH_HEADER.size)[0] == Response_download_chunk_response_tag
+
+
+# Returns `t` as a FAT date, which the firmware reports as the timestamp of a file.
+def fat_date(t):
+    date = datetime.date.fromtimestamp(t)
+    return ((date.year - 1980) << 9) | (date.month << 5) | date.day
+
+
+# EmulatedBadge behaves like the firmware of a midge: it answers serialized requests with
+#   serialized responses, keeps track of which sensors are recording and serves the files on
+#   its emulated SD card. It holds no connection state, see EmulatedBadgeConnection for that.
+class EmulatedBadge(object):
+    def __init__(self, files=None, total_space=DEFAULT_TOTAL_SPACE, battery_level=100,
+                 fw_version=DEFAULT_FW_VERSION):
+        # filename -> (data, timestamp), in the order the badge lists them
+        self.files = collections.OrderedDict()
+        for filename, data in (files or {}).items():
+            self.add_file(filename, data)
+        self.total_space = total_space
+        self.battery_level = battery_level
+        self.fw_version = fw_version
+
+        self.clock_offset = None
+        self.badge_id = None
+        self.group = None
+        self.microphone_mode = None
+        self.scan_settings = None
+        self.imu_settings = None
+
+        self.download_file = None
+        self.download_position = 0
+
+        # The firmware handles one request at a time
+        self.lock = threading.Lock()
+
+        self.handlers = {
+            Request_status_request_tag: self.status,
+            Request_start_microphone_request_tag: self.start_microphone,
+            Request_stop_microphone_request_tag: self.stop_microphone,
+            Request_start_scan_request_tag: self.start_scan,
+            Request_stop_scan_request_tag: self.stop_scan,
+            Request_start_imu_request_tag: self.start_imu,
+            Request_stop_imu_request_tag: self.stop_imu,
+            Request_identify_request_tag: self.identify,
+            Request_restart_request_tag: self.restart,
+            Request_free_sdc_space_request_tag: self.free_sdc_space,
+            Request_sdc_errase_all_request_tag: self.errase_all,
+            Request_get_imu_data_request_tag: self.get_imu_data,
+            Request_get_fw_version_request_tag: self.get_fw_version,
+            Request_list_files_request_tag: self.list_files,
+            Request_start_download_request_tag: self.start_download,
+            Request_download_chunk_request_tag: self.download_chunk,
+            Request_get_file_checksum_request_tag: self.get_file_checksum,
+        }
+
+    # Puts a file with contents `data` on the SD card, replacing any file with that name.
+    def add_file(self, filename, data, timestamp=None):
+        if len(filename) >= MAX_FILENAME_LENGTH:
+            raise ValueError("Filename {} is longer than {} characters".format(filename, MAX_FILENAME_LENGTH - 1))
+        self.files[filename] = (bytes(data), fat_date(time.time()) if timestamp is None else timestamp)
+
+    def is_recording(self):
+        return self.microphone_mode is not None or self.scan_settings is not None or self.imu_settings is not None
+
+    # Handles a request with its length header, as OpenBadge sends it.
+    # Returns the response with its length header, or None for requests without a response.
+    def handle_request(self, serialized_request):
+        request_len, = _LENGTH_HEADER.unpack_from(serialized_request)
+        request = Request.decode(serialized_request[_LENGTH_HEADER.size:_LENGTH_HEADER.size + request_len])
+
+        handler = self.handlers.get(request.type.which)
+        if handler is None:
+            logger.debug("Ignoring request with unknown tag {}".format(request.type.which))
+            return None
+
+        with self.lock:
+            response = handler(request.type)
+        if response is None:
+            return None
+        response = response[:RESPONSE_LENGTH].ljust(RESPONSE_LENGTH, b'\x00')
+        return _LENGTH_HEADER.pack(len(response)) + response
+
+    # Returns the time of the badge's clock as two parts - seconds and milliseconds
+    def timestamp(self):
+        t = time.time() + (self.clock_offset or 0.0)
+        return int(t), int(1000 * (t - int(t)))
+
+    def _set_clock(self, timestamp):
+        self.clock_offset = timestamp.seconds + timestamp.ms / 1000.0 - time.time()
+
+    def status(self, request):
+        status_request = request.status_request
+        self._set_clock(status_request.timestamp)
+        if status_request.has_badge_assignement:
+            self.badge_id = status_request.badge_assignement.ID
+            self.group = status_request.badge_assignement.group
+
+        seconds, ms = self.timestamp()
+        return _STATUS_RESPONSE.pack(
+            Response_status_response_tag, int(self.clock_offset is not None),
+            int(self.microphone_mode is not None), int(self.scan_settings is not None),
+            int(self.imu_settings is not None), self.battery_level, 0, 0, 0, seconds, ms)
+
+    def start_microphone(self, request):
+        self._set_clock(request.start_microphone_request.timestamp)
+        self.microphone_mode = request.start_microphone_request.mode
+        seconds, ms = self.timestamp()
+        # The switch is on HIGH, sampling at 1.28 MHz
+        return _START_MICROPHONE_RESPONSE.pack(
+            Response_start_microphone_response_tag, seconds, ms, self.microphone_mode, 32, 32, 2, 1280)
+
+    def stop_microphone(self, request):
+        self.microphone_mode = None
+
+    def start_scan(self, request):
+        start_scan_request = request.start_scan_request
+        self._set_clock(start_scan_request.timestamp)
+        self.scan_settings = (start_scan_request.window, start_scan_request.interval)
+        seconds, ms = self.timestamp()
+        return _START_SCAN_RESPONSE.pack(
+            Response_start_scan_response_tag, seconds, ms, start_scan_request.window, start_scan_request.interval)
+
+    def stop_scan(self, request):
+        self.scan_settings = None
+
+    def start_imu(self, request):
+        start_imu_request = request.start_imu_request
+        self._set_clock(start_imu_request.timestamp)
+        self.imu_settings = (start_imu_request.acc_fsr, start_imu_request.gyr_fsr, start_imu_request.datarate)
+        seconds, ms = self.timestamp()
+        return _START_IMU_RESPONSE.pack(
+            Response_start_imu_response_tag, seconds, ms, 1, start_imu_request.gyr_fsr,
+            start_imu_request.acc_fsr, start_imu_request.datarate & 0xFF)
+
+    def stop_imu(self, request):
+        self.imu_settings = None
+
+    def identify(self, request):
+        pass
+
+    def restart(self, request):
+        self.clock_offset = None
+        self.microphone_mode = None
+        self.scan_settings = None
+        self.imu_settings = None
+        self.download_file = None
+
+    def free_sdc_space(self, request):
+        used_space = sum(len(data) for data, _ in self.files.values())
+        free_space = max(0, self.total_space - (used_space + (1 << 20) - 1) // (1 << 20))
+        seconds, ms = self.timestamp()
+        return _FREE_SDC_SPACE_RESPONSE.pack(
+            Response_free_sdc_space_response_tag, self.total_space, free_space, seconds, ms)
+
+    def errase_all(self, request):
+        # Like the firmware, the card is not erased while it is being written to
+        done_errase = int(not self.is_recording())
+        if done_errase:
+            self.files.clear()
+            self.download_file = None
+        seconds, ms = self.timestamp()
+        return _ERRASE_ALL_RESPONSE.pack(Response_sdc_errase_all_response_tag, done_errase, seconds, ms)
+
+    def get_imu_data(self, request):
+        # Lying flat and still: only gravity on the z axis of the accelerometer, in 1/10000 g
+        values = [0] * 12
+        if self.imu_settings is not None:
+            values[8] = 10000
+        seconds, ms = self.timestamp()
+        return _GET_IMU_DATA_RESPONSE.pack(Response_get_imu_data_response_tag, *(values + [seconds, ms]))
+
+    def get_fw_version(self, request):
+        return _GET_FW_VERSION_RESPONSE.pack(Response_get_fw_version_response_tag, self.fw_version.encode('utf-8'))
+
+    def list_files(self, request):
+        start_index = request.list_files_request.start_index
+        max_files = min(request.list_files_request.max_files, LIST_FILES_MAX_FILES)
+        page = list(self.files.items())[start_index:start_index + max_files]
+
+        parts = [_LIST_FILES_RESPONSE_HEADER.pack(
+            Response_list_files_response_tag, len(page), len(self.files) & 0xFF, start_index)]
+        for filename, (data, timestamp) in page:
+            parts.append(_FILE_INFO.pack(filename.encode('utf-8'), len(data), timestamp))
+        return b''.join(parts)
+
+    def start_download(self, request):
+        filename = request.start_download_request.filename
+        self.download_file = None
+        if filename not in self.files:
+            return _START_DOWNLOAD_RESPONSE.pack(Response_start_download_response_tag, 0, 0, 0)
+
+        self.download_file = filename
+        self.download_position = 0
+        file_size = len(self.files[filename][0])
+        return _START_DOWNLOAD_RESPONSE.pack(
+            Response_start_download_response_tag, file_size,
+            (file_size + DOWNLOAD_CHUNK_SIZE - 1) // DOWNLOAD_CHUNK_SIZE, 1)
+
+    def download_chunk(self, request):
+        chunk_index = request.download_chunk_request.chunk_index
+        if self.download_file is None:
+            return _DOWNLOAD_CHUNK_RESPONSE.pack(Response_download_chunk_response_tag, 0, 0, b'', 0)
+
+        data = self.files[self.download_file][0]
+        position = chunk_index * DOWNLOAD_CHUNK_SIZE
+        chunk = data[position:position + DOWNLOAD_CHUNK_SIZE]
+        self.download_position = position + len(chunk)
+        # The firmware closes the file once it has sent the end of it
+        is_last_chunk = int(self.download_position >= len(data))
+        if is_last_chunk:
+            self.download_file = None
+        return _DOWNLOAD_CHUNK_RESPONSE.pack(
+            Response_download_chunk_response_tag, chunk_index, len(chunk), chunk, is_last_chunk)
+
+    def get_file_checksum(self, request):
+        filename = request.get_file_checksum_request.filename
+        if filename not in self.files:
+            return _GET_FILE_CHECKSUM_RESPONSE.pack(Response_get_file_checksum_response_tag, 0, 0)
+        checksum = zlib.crc32(self.files[filename][0]) & 0xFFFFFFFF
+        return _GET_FILE_CHECKSUM_RESPONSE.pack(Response_get_file_checksum_response_tag, checksum, 1)
+
+
+# Emulated badges by address, with the options of the connections made to them
+_registered_badges = {}
+
+
+# Makes `badge` reachable under `address` (which should start with EMULATED_ADDRESS_PREFIX)
+#   through EmulatedBadgeConnection.get_connection_to_badge(), so that code which only knows
+#   the address of a midge, like the hub, can talk to it. connection_options are passed on to
+#   every EmulatedBadgeConnection made to it.
+def register_badge(address, badge, **connection_options):
+    _registered_badges[address] = (badge, connection_options)
+
+
+def unregister_badge(address):
+    _registered_badges.pop(address, None)
+
+
+# EmulatedBadgeConnection implements the BadgeConnection interface for an EmulatedBadge, so
+#   OpenBadge and the hub can be run and benchmarked without any midges.
+# The BLE link is emulated: every message is split into notifications of mtu - 3 bytes, every
+#   notification takes `latency` seconds to arrive, and requests are written with response, so
+#   send() blocks while the request is being written. Each download chunk response is lost with
+#   probability packet_loss (see may_be_lost()). Since messages cannot be resynchronised after
+#   losing part of one, losses are of whole responses, like a request that never reached the badge.
+class EmulatedBadgeConnection(BadgeConnection):
+    def __init__(self, badge=None, latency=DEFAULT_NOTIFICATION_LATENCY, mtu=DEFAULT_MTU, packet_loss=0.0,
+                 seed=None):
+        self.badge = badge if badge is not None else EmulatedBadge()
+        self.latency = latency
+        self.notification_size = mtu - ATT_HEADER_LENGTH
+        self.packet_loss = packet_loss
+        self.random = random.Random(seed)
+        self.connected = False
+
+        # Contains the bytes recieved from the badge. Held here until an entire message is recieved.
+        self.rx_buffer = ReceiveBuffer()
+        # Notifications the badge has sent that have not arrived yet, as (arrival time, data)
+        self.in_flight = collections.deque()
+        # Time at which the last notification sent so far arrives
+        self.link_busy_until = 0.0
+
+        BadgeConnection.__init__(self)
+
+    # Returns an EmulatedBadgeConnection to the badge registered with register_badge() under
+    #   device_addr.
+    @classmethod
+    def get_connection_to_badge(cls, device_addr, timeout_seconds=10.0):
+        if device_addr not in _registered_badges:
+            raise RuntimeError("No emulated badge registered at {}".format(device_addr))
+        badge, connection_options = _registered_badges[device_addr]
+        return cls(badge, **connection_options)
+
+    # Implements BadgeConnection's connect() spec.
+    def connect(self):
+        self.connected = True
+
+    # Implements BadgeConnections's disconnect() spec.
+    def disconnect(self):
+        self.connected = False
+        self.rx_buffer.clear()
+        self.in_flight.clear()
+
+    # Implements BadgeConnection's is_connected() spec.
+    def is_connected(self):
+        return self.connected
+
+    # Implements BadgeConnection's send() spec.
+    def send(self, message, response_len=0):
+        if not self.is_connected():
+            raise RuntimeError("EmulatedBadgeConnection not connected before send()!")
+
+        self._sleep(self._notification_count(message) * self.latency)
+
+        response = self.badge.handle_request(message)
+        if response is not None:
+            if self.packet_loss > 0 and may_be_lost(response) and self.random.random() < self.packet_loss:
+                logger.debug("Dropping response of {} bytes".format(len(response)))
+            else:
+                self._transmit(response)
+
+        return self.await_data(response_len)
+
+    # Implements BadgeConnection's await_data() spec.
+    def await_data(self, data_len, timeout=None):
+        if not self.is_connected():
+            raise RuntimeError("EmulatedBadgeConnection not connected before await_data()!")
+        if data_len <= 0:
+            return None
+
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self._deliver_notifications()
+            rx_message = self.rx_buffer.take(data_len)
+            if rx_message is not None:
+                return rx_message
+
+            now = time.time()
+            wake_up = now + 5.0
+            if self.in_flight:
+                wake_up = min(wake_up, self.in_flight[0][0])
+            if deadline is not None:
+                if now >= deadline:
+                    return None
+                wake_up = min(wake_up, deadline)
+            self._sleep(wake_up - now)
+
+    def _notification_count(self, message):
+        return (len(message) + self.notification_size - 1) // self.notification_size
+
+    # Schedules the notifications of `message` after the ones already on their way.
+    def _transmit(self, message):
+        sent = max(time.time(), self.link_busy_until)
+        for i, start in enumerate(range(0, len(message), self.notification_size)):
+            self.in_flight.append((sent + (i + 1) * self.latency, message[start:start + self.notification_size]))
+        self.link_busy_until = sent + self._notification_count(message) * self.latency
+
+    # Moves the notifications that have arrived by now into the receive buffer.
+    def _deliver_notifications(self):
+        now = time.time()
+        while self.in_flight and self.in_flight[0][0] <= now:
+            self.rx_buffer.put(self.in_flight.popleft()[1])
+
+    def _sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
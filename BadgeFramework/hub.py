@@ -9,6 +9,7 @@ from hub_utilities import (
     synchronise_and_check_all_devices,
     erase_sdcard_all_devices,
     print_fw_version_all_devices,
+    download_all_devices,
     choose_function,
     Connection,
     clear_input_line,
@@ -19,6 +20,7 @@ def print_hub_commands(sync_frequency):
     print(" stop_all: stops the recording on all midges")
     print(" erase_all: erase the recorded data on all midges")
     print(" fw_all: show the firmware version of all of the midges")
+    print(" download_all [dir]: download the sdcard of all midges over bluetooth, into dir/midge_<id> (default downloaded_data)")
     print(" start_sync: trigger sync every %d seconds" % sync_frequency)
     print(" stop_sync: show the firmware version of all of the midges")
     print(" midge: connect to a single midge for individual management")
@@ -53,7 +55,9 @@ if __name__ == "__main__":
     
     show_status_on_sync = False # Show the status of the midge after synchronisation
 
-    df = pd.read_csv('ingroup_exp.csv')
+    # The mapping file can be given as argument; its addresses may also be tcp://host:port
+    #   addresses of midges simulated with badge_simulator.py
+    df = pd.read_csv(sys.argv[1] if len(sys.argv) > 1 else 'ingroup_exp.csv')
     df['Recording'] = None  # We do not know if the midges are recording or not before connecting to them
     df['Id_Set'] = None  # We do not know if the midges are recording or not before connecting to them
 
@@ -77,6 +81,9 @@ if __name__ == "__main__":
             erase_sdcard_all_devices(df)
         elif command == "fw_all":
             print_fw_version_all_devices(df)
+        elif command.split(" ")[0] == "download_all":
+            command_args = command.split()
+            download_all_devices(df, command_args[1] if len(command_args) > 1 else "downloaded_data")
         elif command == "help":
             print_hub_commands(sync_frequency)
         elif command == "midge":
@@ -1,13 +1,25 @@
 from badge import OpenBadge
 from ble_badge_connection import BLEBadgeConnection
+from emulated_badge_connection import EmulatedBadgeConnection, EMULATED_ADDRESS_PREFIX
+from tcp_badge_connection import TCPBadgeConnection, TCP_ADDRESS_PREFIX
 import sys
 constant_group_number = 1
 
+# Returns a BadgeConnection to the midge at `address`: a BLE MAC address, a tcp://host:port
+#   address of a simulated midge (see badge_simulator.py), or the address an emulated badge was
+#   registered under (see emulated_badge_connection.register_badge).
+def get_connection_to_badge(address):
+    if str(address).startswith(TCP_ADDRESS_PREFIX):
+        return TCPBadgeConnection.get_connection_to_badge(address)
+    if str(address).startswith(EMULATED_ADDRESS_PREFIX):
+        return EmulatedBadgeConnection.get_connection_to_badge(address)
+    return BLEBadgeConnection.get_connection_to_badge(address)
+
 class Connection():
     def __init__(self,pid,address, num_tries=3):
         for i in range(num_tries):
             try:
-                self.connection = BLEBadgeConnection.get_connection_to_badge(address)
+                self.connection = get_connection_to_badge(address)
                 self.connection.connect()
                 self.badge = OpenBadge(self.connection)
                 self.badge_id = int(pid)
@@ -119,6 +131,12 @@ class Connection():
         except:
             raise Exception("Could not get the fw version for participant " + str(self.badge_id))
 
+    def handle_download_all_files(self, output_dir, show_progress=True):
+        try:
+            return self.badge.download_all_files(output_dir, show_progress=show_progress)
+        except Exception as err:
+            raise Exception("Could not download the files for participant " + str(self.badge_id) + ", error: " + str(err))
+
     def status_and_start_recording_all_sensors(self):
         self.set_id_at_start()
         self.start_recording_all_sensors()
@@ -4,7 +4,17 @@ from tqdm import tqdm
 import select
 from termios import TCIFLUSH, tcflush
 import threading
+import os
 import numpy as np
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Number of midges that are offloaded at the same time by download_all_devices
+DEFAULT_DOWNLOAD_WORKERS = 4
+# Number of times download_all_devices reconnects to a midge before giving up on it
+DEFAULT_DEVICE_DOWNLOAD_ATTEMPTS = 3
 
 def choose_function(connection,input):
     chooser = {
@@ -244,6 +254,93 @@ def print_fw_version_all_devices(df):
     for (_, row), fw_version in zip(df.iterrows(), _get_fw_version_all(df).values()):
         print('\tParticipant: ' + str(row['Participant Id']) + ', fw: ' + fw_version)
 
+# Downloads the sdcard of every midge in df, each into its own midge_<id> folder in output_dir.
+#   A pool of num_workers threads takes the midges from a shared queue, so a slow midge does not
+#   hold up the ones after it. A midge is reconnected and retried up to `attempts` times until
+#   all its files are downloaded; files that were already downloaded are not fetched again.
+# Returns a dict from participant id to the outcome for that midge, which is also printed.
+def download_all_devices(df, output_dir="downloaded_data", num_workers=DEFAULT_DOWNLOAD_WORKERS,
+                         attempts=DEFAULT_DEVICE_DOWNLOAD_ATTEMPTS):
+    pending = queue.Queue()
+    for _, row in df.iterrows():
+        pending.put((row['Participant Id'], row['Mac Address']))
+
+    report = {}
+    report_lock = threading.Lock()
+
+    with tqdm(total=len(df), desc="Downloading midges") as pbar:
+        def download_device(participant, mac):
+            device_dir = os.path.join(output_dir, "midge_" + str(participant))
+            outcome = {'status': 'failed', 'success': 0, 'failed': 0, 'skipped': 0, 'total': 0,
+                       'attempts': 0, 'error': None}
+            for attempt in range(attempts):
+                outcome['attempts'] = attempt + 1
+                try:
+                    cur_connection = Connection(participant, mac)
+                except Exception as error:
+                    outcome['error'] = str(error)
+                    pbar.write('Midge {}: {} (attempt {}/{})'.format(participant, error, attempt + 1, attempts))
+                    continue
+                try:
+                    result = cur_connection.handle_download_all_files(device_dir, show_progress=False)
+                    outcome.update(result)
+                    if result['failed'] == 0:
+                        outcome['status'] = 'ok'
+                        outcome['error'] = None
+                        break
+                    outcome['error'] = '{} files failed'.format(result['failed'])
+                    pbar.write('Midge {}: {}/{} files downloaded (attempt {}/{})'.format(
+                        participant, result['success'], result['total'], attempt + 1, attempts))
+                except Exception as error:
+                    outcome['error'] = str(error)
+                    pbar.write('Midge {}: {} (attempt {}/{})'.format(participant, error, attempt + 1, attempts))
+                finally:
+                    cur_connection.disconnect()
+
+            if outcome['status'] == 'ok':
+                pbar.write('Midge {}: {}/{} files downloaded, {} already up to date'.format(
+                    participant, outcome['success'], outcome['total'], outcome['skipped']))
+            with report_lock:
+                report[participant] = outcome
+                pbar.update(1)
+
+        def worker():
+            while True:
+                try:
+                    participant, mac = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    download_device(participant, mac)
+                except Exception as error:
+                    with report_lock:
+                        report[participant] = {'status': 'failed', 'success': 0, 'failed': 0, 'skipped': 0,
+                                               'total': 0, 'attempts': 0, 'error': str(error)}
+                        pbar.update(1)
+
+        thread_list = []
+        for i in range(min(num_workers, len(df))):
+            t = threading.Thread(target=worker, name=str(i))
+            t.start()
+            thread_list.append(t)
+
+        for t in thread_list:
+            t.join()
+
+    print("Download report:")
+    for participant in sorted(report):
+        outcome = report[participant]
+        line = '\t Midge: {} -- {}, {}/{} files'.format(participant, outcome['status'], outcome['success'], outcome['total'])
+        if outcome['attempts'] > 1:
+            line += ', {} attempts'.format(outcome['attempts'])
+        if outcome['error'] is not None:
+            line += ', last error: ' + outcome['error']
+        print(line)
+    failed = [participant for participant, outcome in report.items() if outcome['status'] != 'ok']
+    print('{}/{} midges downloaded completely.'.format(len(report) - len(failed), len(report)))
+    sys.stdout.flush()
+    return report
+
 def timeout_input(timeout, prompt = ''):
     sys.stdout.write(prompt)
     sys.stdout.flush()
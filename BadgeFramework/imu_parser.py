@@ -1,15 +1,20 @@
 #!/usr/bin/env python
 
 import matplotlib.pyplot as plt
-import struct
 import numpy as np
 import pandas as pd
-from parser_utilities import parse_timestamps
+from parser_utilities import parse_timestamps, process_files_in_parallel
 import os
 import fnmatch
+from datetime import timezone
+from functools import partial
 from tqdm import tqdm
 
 SENSOR_PREFIXES = ['ACC_', 'GYR_', 'MAG_', 'ROT_', 'SCAN_']
+# Formats the parsed data can be saved in, named by their file extension. Parquet and feather
+#   need pyarrow.
+OUTPUT_FORMATS = ['parquet', 'feather', 'csv', 'pkl']
+DEFAULT_OUTPUT_FORMATS = ['parquet']
 
 def is_sensor_file(filename):
     for prefix in SENSOR_PREFIXES:
@@ -17,10 +22,254 @@ def is_sensor_file(filename):
             return True
     return False
 
+def find_sensor_files(base_dir):
+    """
+    Find the sensor files in a folder and its subfolders.
+
+    Args:
+        base_dir: Folder to search
+
+    Returns:
+        Sorted list of the absolute paths of the sensor files
+    """
+    return sorted(os.path.join(os.path.abspath(root), filename)
+                  for root, _, files in os.walk(base_dir) for filename in files if is_sensor_file(filename))
+
+# Samples of the ACC, GYR and MAG files: 8 bytes timestamp, 12 bytes data and 4 bytes padding.
+#   The padding is left out of the dtype, so the last sample of a file may lack it.
+IMU_SAMPLE_SIZE = 24
+IMU_SAMPLE_DTYPE = np.dtype({'names': ['timestamp', 'x', 'y', 'z'],
+                             'formats': ['<u8', '<f4', '<f4', '<f4'],
+                             'offsets': [0, 8, 12, 16]})
+# Samples of the ROT files: 8 bytes timestamp and a 16 bytes quaternion, in scalar-last format
+ROT_SAMPLE_DTYPE = np.dtype({'names': ['timestamp', 'x', 'y', 'z', 'w'],
+                             'formats': ['<u8', '<f4', '<f4', '<f4', '<f4'],
+                             'offsets': [0, 8, 12, 16, 20]})
+# Samples of the SCAN files: 8 bytes timestamp, 2 bytes ID of the midge that was seen, 1 byte
+#   group, 1 byte RSSI and 4 bytes padding
+SCAN_SAMPLE_SIZE = 16
+SCAN_SAMPLE_DTYPE = np.dtype({'names': ['timestamp', 'id', 'group', 'rssi'],
+                              'formats': ['<u8', '<u2', 'i1', 'i1'],
+                              'offsets': [0, 8, 10, 11],
+                              'itemsize': SCAN_SAMPLE_SIZE})
+
+# Dtype and sample size of the files of every sensor, by file name prefix
+SENSOR_DTYPES = {'ACC_': (IMU_SAMPLE_DTYPE, IMU_SAMPLE_SIZE),
+                 'GYR_': (IMU_SAMPLE_DTYPE, IMU_SAMPLE_SIZE),
+                 'MAG_': (IMU_SAMPLE_DTYPE, IMU_SAMPLE_SIZE),
+                 'ROT_': (ROT_SAMPLE_DTYPE, IMU_SAMPLE_SIZE),
+                 'SCAN_': (SCAN_SAMPLE_DTYPE, SCAN_SAMPLE_SIZE)}
+
+def sensor_prefix(filename):
+    """
+    Find the sensor of a file from its name.
+
+    Args:
+        filename: Name of the file
+
+    Returns:
+        The prefix of SENSOR_PREFIXES the name starts with, or None
+    """
+    for prefix in SENSOR_PREFIXES:
+        if filename.startswith(prefix):
+            return prefix
+    return None
+
+def _records_view(data, dtype, record_size):
+    count = (len(data) - dtype.itemsize) // record_size + 1 if len(data) >= dtype.itemsize else 0
+    return np.ndarray(shape=(count,), dtype=dtype, buffer=data, strides=(record_size,))
+
+def read_records(path, dtype, record_size):
+    """
+    Read the fixed size samples of a sensor file as a structured array.
+
+    The array is a strided view of the file contents, one sample every record_size bytes,
+    so no per-sample work is done in Python. A trailing partial sample is ignored, unless
+    it holds all of the fields of dtype.
+
+    Args:
+        path: Path of the sensor file
+        dtype: Structured dtype of the fields of one sample
+        record_size: Distance in bytes between the starts of two samples
+
+    Returns:
+        Structured numpy array with one element per sample
+    """
+    return _records_view(np.fromfile(path, dtype=np.uint8), dtype, record_size)
+
+def map_records(path, dtype, record_size):
+    """
+    Map the fixed size samples of a sensor file into memory as a structured array, like
+    read_records but without reading the file. Samples are only loaded from disk when they
+    are accessed.
+
+    Args:
+        path: Path of the sensor file
+        dtype: Structured dtype of the fields of one sample
+        record_size: Distance in bytes between the starts of two samples
+
+    Returns:
+        Structured numpy array backed by a read-only np.memmap of the file
+    """
+    if os.path.getsize(path) == 0:
+        # An empty file cannot be mapped
+        return _records_view(np.zeros(0, dtype=np.uint8), dtype, record_size)
+    return _records_view(np.memmap(path, dtype=np.uint8, mode='r'), dtype, record_size)
+
+def records_to_dataframe(records, source_file, local_time=True):
+    """
+    Convert the samples of a sensor file to a DataFrame with a time column and one column per
+    field. The columns are copies, so the DataFrame does not keep the file mapped.
+
+    Args:
+        records: Structured array of samples, from read_records or map_records
+        source_file: Path of the sensor file, for error reporting and df.attrs
+        local_time: Convert the timestamps to local time instead of UTC
+
+    Returns:
+        DataFrame of the samples
+    """
+    timestamps_dt = parse_timestamps(records['timestamp'], source_file, local_time)
+    df = pd.DataFrame(timestamps_dt, columns=['time'])
+    if records.dtype == SCAN_SAMPLE_DTYPE:
+        if len(records) > 0:
+            df['SensorID'] = np.array(records['id'])
+            df['RSSI'] = np.array(records['rssi'])
+            df['Group'] = np.array(records['group'])
+    else:
+        for name in records.dtype.names[1:]:
+            df[name.upper()] = records[name].astype(np.float64)
+    df.attrs['source_file'] = source_file
+    return df
+
+def _timestamp_ms(value, local_time):
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    # Through datetime, as pd.Timestamp.timestamp() takes naive times as UTC where datetime takes
+    #   them as local time
+    value = pd.Timestamp(value).to_pydatetime()
+    if value.tzinfo is None and not local_time:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(round(value.timestamp() * 1000))
+
+class SensorFile(object):
+    """
+    A raw sensor file mapped into memory, see open_sensor_file.
+
+    Attributes:
+        path: Path of the file
+        sensor: Prefix of the sensor of the file, one of SENSOR_PREFIXES
+        records: Structured array of all samples, backed by the mapped file
+        local_time: Whether naive datetimes and DataFrame times are in local time or in UTC
+    """
+    def __init__(self, path, local_time=True):
+        self.path = path
+        self.sensor = sensor_prefix(os.path.basename(path))
+        if self.sensor is None:
+            raise ValueError("{} is not a sensor file, its name does not start with one of {}".format(
+                path, SENSOR_PREFIXES))
+        self.records = map_records(path, *SENSOR_DTYPES[self.sensor])
+        self.local_time = local_time
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        """Raw timestamps of the samples, in ms since the epoch."""
+        return self.records['timestamp']
+
+    def index_range(self, start=None, end=None):
+        """
+        Find the samples in a time range by binary search on the timestamps, which the midge
+        writes in increasing order. Only the few samples the search visits are read from disk.
+
+        Args:
+            start: First time to include, or None to start at the first sample
+            end: Time to stop at (not included), or None to continue to the last sample.
+                Times are ms since the epoch, datetimes, np.datetime64s or strings like
+                '2024-05-01 13:00'.
+
+        Returns:
+            Tuple of the index of the first sample in the range and the index after the last
+        """
+        timestamps = self.timestamps
+        first = 0 if start is None else np.searchsorted(
+            timestamps, np.uint64(max(_timestamp_ms(start, self.local_time), 0)))
+        last = len(timestamps) if end is None else np.searchsorted(
+            timestamps, np.uint64(max(_timestamp_ms(end, self.local_time), 0)))
+        return int(first), int(max(first, last))
+
+    def time_slice(self, start=None, end=None):
+        """
+        Select the samples in a time range, see index_range.
+
+        Returns:
+            Structured array of the samples, still backed by the mapped file
+        """
+        first, last = self.index_range(start, end)
+        return self.records[first:last]
+
+    def to_dataframe(self, start=None, end=None):
+        """
+        Load the samples in a time range (see index_range) into a DataFrame, in the same
+        format as IMUParser produces.
+
+        Returns:
+            DataFrame of the samples
+        """
+        return records_to_dataframe(self.time_slice(start, end), self.path, self.local_time)
+
+def open_sensor_file(path, local_time=True):
+    """
+    Open a raw ACC_, GYR_, MAG_, ROT_ or SCAN_ file without reading it. The file is mapped into
+    memory, so slices of long recordings can be loaded in an instant:
+
+        acc = open_sensor_file('midge_1/ACC_0')
+        df = acc.to_dataframe('2024-05-01 13:00', '2024-05-01 13:05')
+
+    Args:
+        path: Path of the sensor file
+        local_time: Whether naive datetimes and DataFrame times are in local time or in UTC
+
+    Returns:
+        SensorFile of the file
+    """
+    return SensorFile(path, local_time)
+
+def save_dataframe(df, fname_base, output_format):
+    """
+    Write a DataFrame of parsed sensor data to a file.
+
+    Parquet and feather keep the column types, including the datetime64[ms] time column, and
+    are compressed with zstd. CSV is written with the index, like before.
+
+    Args:
+        df: DataFrame to write
+        fname_base: Path of the file without extension
+        output_format: One of OUTPUT_FORMATS, also used as the extension
+    """
+    path = fname_base + '.' + output_format
+    if output_format == 'parquet':
+        df.to_parquet(path, compression='zstd', index=False)
+    elif output_format == 'feather':
+        df.to_feather(path, compression='zstd')
+    elif output_format == 'csv':
+        df.to_csv(path)
+    elif output_format == 'pkl':
+        df.to_pickle(path)
+    else:
+        raise ValueError("Unknown output format {}, expected one of {}".format(output_format, OUTPUT_FORMATS))
+
 class IMUParser(object):
-    def __init__(self, base_dir, output_dir=None):
+    def __init__(self, base_dir, output_dir=None, local_time=True, output_formats=DEFAULT_OUTPUT_FORMATS):
         self.base_dir = os.path.abspath(base_dir)
         self.output_dir = os.path.abspath(output_dir) if output_dir else None
+        self.local_time = local_time
+        for output_format in output_formats:
+            if output_format not in OUTPUT_FORMATS:
+                raise ValueError("Unknown output format {}, expected one of {}".format(output_format, OUTPUT_FORMATS))
+        self.output_formats = list(output_formats)
         self.accel_dfs = []
         self.gyro_dfs = []
         self.mag_dfs = []
@@ -36,8 +285,7 @@ class IMUParser(object):
         rel_folder = os.path.dirname(rel_path)
         basename = os.path.splitext(os.path.basename(input_path))[0]
         out_folder = os.path.join(self.output_dir, rel_folder)
-        if not os.path.exists(out_folder):
-            os.makedirs(out_folder)
+        os.makedirs(out_folder, exist_ok=True)
         return os.path.join(out_folder, basename + ext)
 
     def parse_and_store(self, file_path):
@@ -58,90 +306,43 @@ class IMUParser(object):
             df = self.parse_scan_file(file_path)
             self.scan_dfs.append({'df': df, 'source_file': file_path})
 
+    def process_file(self, file_path, enabled, plot):
+        """
+        Parse one sensor file and write its outputs, without keeping the DataFrame.
+
+        Args:
+            file_path: Path of the sensor file
+            enabled: Dict from sensor prefix (see SENSOR_PREFIXES) to whether that sensor is parsed
+            plot: Whether to plot the file, for all sensors but SCAN
+
+        Returns:
+            Number of samples in the file, or None if its sensor is not enabled
+        """
+        prefix = sensor_prefix(os.path.basename(file_path))
+        if not enabled[prefix]:
+            return None
+        if prefix == 'ROT_':
+            df = self.parse_rot_file(file_path)
+        elif prefix == 'SCAN_':
+            df = self.parse_scan_file(file_path)
+        else:
+            df = self.parse_generic(file_path)
+        dfs = [{'df': df, 'source_file': file_path}]
+        self.save_dataframes_generic(dfs, True)
+        self.plot_dataframes(dfs, plot and prefix != 'SCAN_')
+        return len(df)
+
     def parse_generic(self,sensorname):
-        data = []
-        timestamps = []
-        with open(sensorname, "rb") as f:
-            byte = f.read()
-            i=0
-            while True:
-                ts_bytes = byte[0+i:8+i]
-                data_bytes = byte[8+i:20+i]
-                if (len(data_bytes)) == 12 and (len(ts_bytes) == 8):
-                    ts = struct.unpack('<Q',ts_bytes)
-                    x,y,z = struct.unpack('<fff', data_bytes)
-                    data.append([x,y,z])
-                    timestamps.append(ts)
-                    i = i + 24 # 8 timestamp + 12 data + 4 padding
-                else:
-                    break
-        data_xyz = np.asarray(data)
-        timestamps = np.asarray(timestamps)
-        timestamps_dt = parse_timestamps(timestamps, sensorname)
-        df = pd.DataFrame(timestamps_dt, columns=['time'])
-        df['X'] = data_xyz[:,0]
-        df['Y'] = data_xyz[:,1]
-        df['Z'] = data_xyz[:,2]
-        df.attrs['source_file'] = sensorname
-        return df
+        records = read_records(sensorname, IMU_SAMPLE_DTYPE, IMU_SAMPLE_SIZE)
+        return records_to_dataframe(records, sensorname, self.local_time)
 
     def parse_rot_file(self, rot_file):
-        rotation = []
-        timestamps = []
-        with open(rot_file, "rb") as f:
-            byte = f.read()
-            i=0
-            while True:
-                ts_bytes = byte[0+i:8+i]
-                rot_bytes = byte[8+i:24+i]
-                if (len(rot_bytes)) == 16 and (len(ts_bytes) == 8):
-                    ts = struct.unpack('<Q',ts_bytes)
-                    q1,q2,q3,q4 = struct.unpack('<ffff', rot_bytes)
-                    rotation.append([q1,q2,q3,q4])
-                    timestamps.append(ts)
-                    i = i + 24
-                else:
-                    break
-        rotation_xyz = np.asarray(rotation)
-        timestamps = np.asarray(timestamps)
-        timestamps_dt = parse_timestamps(timestamps, rot_file)
-        df = pd.DataFrame(timestamps_dt, columns=['time'])
-        df['X'] = rotation_xyz[:,0]
-        df['Y'] = rotation_xyz[:,1]
-        df['Z'] = rotation_xyz[:,2]
-        df['W'] = rotation_xyz[:,3]
-        df.attrs['source_file'] = rot_file
-        return df
+        records = read_records(rot_file, ROT_SAMPLE_DTYPE, IMU_SAMPLE_SIZE)
+        return records_to_dataframe(records, rot_file, self.local_time)
 
     def parse_scan_file(self, scan_file):
-        data = []
-        timestamps = []
-        with open(scan_file, "rb") as f:
-            byte = f.read()
-            i = 0
-            while True:
-                ts_bytes = byte[i : i + 8]
-                data_bytes = byte[i + 8 : i + 16]
-                if len(data_bytes) == 8 and len(ts_bytes) == 8:
-                    ts = struct.unpack("<Q", ts_bytes)
-                    sensor_id = struct.unpack("<H", data_bytes[0:2])[0]
-                    group = struct.unpack("<b", data_bytes[2:3])[0]
-                    rssi = struct.unpack("<b", data_bytes[3:4])[0]
-                    data.append([sensor_id, rssi, group])
-                    timestamps.append(ts)
-                    i = i + 16
-                else:
-                    break
-        data_xyz = np.asarray(data)
-        timestamps = np.asarray(timestamps)
-        timestamps_dt = parse_timestamps(timestamps, scan_file)
-        df = pd.DataFrame(timestamps_dt, columns=['time'])
-        if data_xyz.size > 0:
-            df['SensorID'] = data_xyz[:, 0]
-            df['RSSI'] = data_xyz[:, 1]
-            df['Group'] = data_xyz[:, 2]
-        df.attrs['source_file'] = scan_file
-        return df
+        records = read_records(scan_file, SCAN_SAMPLE_DTYPE, SCAN_SAMPLE_SIZE)
+        return records_to_dataframe(records, scan_file, self.local_time)
 
     def plot_dataframes(self, dfs, enabled):
         if enabled and dfs:
@@ -162,8 +363,8 @@ class IMUParser(object):
         if enabled and dfs:
             for df_info in dfs:
                 fname_base = self._get_output_path(df_info['source_file'], '')
-                df_info['df'].to_pickle(fname_base + '.pkl')
-                df_info['df'].to_csv(fname_base + '.csv')
+                for output_format in self.output_formats:
+                    save_dataframe(df_info['df'], fname_base, output_format)
 
     def save_dataframes(self,a,g,m,r,s):
         self.save_dataframes_generic(self.accel_dfs, a)
@@ -182,18 +383,29 @@ def str2bool(v):
     else:
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
-def main(fn,acc,mag,gyr,rot,plot,scan,output_dir=None):
-    parser = IMUParser(fn, output_dir=output_dir)
-    # Recursively walk and process files
-    for root_str, _, files in tqdm(list(os.walk(fn)), desc="Files"):
-        root = os.path.abspath(root_str)
-        for filename in files:
-            if is_sensor_file(filename):
-                file_path = os.path.join(root, filename)
-                parser.parse_and_store(file_path)
-    parser.save_dataframes(acc,mag,gyr,rot,scan)
-    if plot:
-        parser.plot_and_save(acc, mag, gyr, rot)
+def _process_sensor_file(file_path, base_dir, output_dir, local_time, output_formats, enabled, plot):
+    parser = IMUParser(base_dir, output_dir=output_dir, local_time=local_time, output_formats=output_formats)
+    return parser.process_file(file_path, enabled, plot)
+
+def main(fn,acc,mag,gyr,rot,plot,scan,output_dir=None,local_time=True,jobs=1,output_formats=DEFAULT_OUTPUT_FORMATS):
+    parser = IMUParser(fn, output_dir=output_dir, local_time=local_time, output_formats=output_formats)
+    file_paths = find_sensor_files(fn)
+    enabled = {'ACC_': acc, 'GYR_': gyr, 'MAG_': mag, 'ROT_': rot, 'SCAN_': scan}
+    if jobs != 1:
+        # Every worker parses, saves and plots whole files on its own
+        function = partial(_process_sensor_file, base_dir=parser.base_dir, output_dir=parser.output_dir,
+                           local_time=local_time, output_formats=output_formats, enabled=enabled, plot=plot)
+        results = process_files_in_parallel(function, file_paths, jobs)
+    else:
+        # Each file is parsed, saved and plotted before the next one is read, so only one
+        #   DataFrame is in memory at a time
+        results = []
+        progress = tqdm(file_paths, desc="Files")
+        for file_path in progress:
+            progress.set_postfix_str(os.path.basename(file_path))
+            results.append((file_path, parser.process_file(file_path, enabled, plot)))
+    parsed = [samples for _, samples in results if samples is not None]
+    print("Parsed {} files with {} samples".format(len(parsed), sum(parsed)))
 
 if __name__ == '__main__':
     import argparse
@@ -207,9 +419,15 @@ if __name__ == '__main__':
     parser.add_argument('--rot', default=True,type=str2bool ,help='Check to parse and save rotation data')
     parser.add_argument('--plot', default=True,type=str2bool ,help='Check to plot the parsed data')
     parser.add_argument('--output_dir', required=False, help='Optional output directory (will mirror input structure)')
+    parser.add_argument('--local_time', default=True,type=str2bool ,help='Convert timestamps to local time instead of UTC')
+    parser.add_argument('--jobs', default=1, type=int, help='Number of files to parse in parallel processes, 0 for one per CPU')
+    parser.add_argument('--format', nargs='+', default=DEFAULT_OUTPUT_FORMATS, choices=OUTPUT_FORMATS,
+                        help='Formats to save the parsed data in, one or more of {}'.format(', '.join(OUTPUT_FORMATS)))
     args = parser.parse_args()
-    main(fn=args.fn, acc=args.acc, mag=args.mag, gyr=args.gyr, rot=args.rot, plot=args.plot, scan=args.scan, output_dir=args.output_dir)
+    main(fn=args.fn, acc=args.acc, mag=args.mag, gyr=args.gyr, rot=args.rot, plot=args.plot, scan=args.scan, output_dir=args.output_dir,
+         local_time=args.local_time, jobs=args.jobs, output_formats=args.format)
 
     # Example command
     # python ./imu_parser.py --fn ../midge_0_files/ --scan TRUE --acc TRUE --mag TRUE --rot TRUE --gyr TRUE --rot TRUE --plot True
+    # python ./imu_parser.py --fn ../midge_0_files/ --format parquet csv, to also write CSV files
     # on windows, use python imu_parser.py --fn 'C:\\user\\midge_0_files\\' --scan ..., use single quotes and double backslashes
@@ -1,32 +1,155 @@
 import os
 from pathlib import Path
 import re
+import struct
+import wave
 import numpy as np
-from scipy.io.wavfile import write
+from audio_parser import (SAMPLE_WIDTH, WAV_CHUNK_HEADER, WAV_HEADER_SIZE, copy_file_data, read_times_csv, wav_header,
+                          write_times_csv)
+from parser_utilities import process_files_in_parallel
 
-def merge_all_subfolders(parent_folder):
+# Start of a WAV file: the RIFF chunk header and the WAVE form type
+WAV_RIFF_HEADER = struct.Struct('<4sI4s')
+# Start of the fmt chunk: format tag, channels, sample rate, byte rate, block align, bits per sample
+WAV_FMT_FIELDS = struct.Struct('<HHIIHH')
+
+def find_folders(parent_folder, recursive=False):
+    """
+    List the folders to merge: the subfolders of parent_folder, or with recursive parent_folder
+    and every folder below it.
+    """
+    if recursive:
+        return [root for root, _, _ in os.walk(parent_folder)]
+    for root, dirs, _ in os.walk(parent_folder):
+        return [os.path.join(root, d) for d in sorted(dirs)]
+    return []
+
+def _folder_size(folder):
+    return sum(f.stat().st_size for f in Path(folder).iterdir() if f.is_file())
+
+def merge_all_subfolders(parent_folder, recursive=False, jobs=1):
+    """
+    For each subfolder in parent_folder, merge .wav and -ts.csv files, and report the result of
+    every folder. With jobs other than 1, the folders are merged in a pool of that many processes
+    (0 for one per CPU).
     """
-    For each subfolder in parent_folder, merge .wav and -ts.csv files.
+    folders = find_folders(parent_folder, recursive)
+    if jobs != 1:
+        results = process_files_in_parallel(merge_wav_and_ts_files, folders, jobs, desc="Folders", size=_folder_size)
+    else:
+        results = []
+        for folder in folders:
+            try:
+                results.append((folder, merge_wav_and_ts_files(folder)))
+            except Exception as e:
+                print("Error processing {}: {}".format(folder, e))
+    for folder, (merged, failed) in sorted(results):
+        if merged:
+            print("{}: merged into {}".format(folder, ", ".join(merged)))
+        for error in failed:
+            print("{}: {}".format(folder, error))
+
+def read_wav_layout(path):
+    """
+    Read the format of a PCM WAV file and find its data, skipping any other chunks.
+
+    Args:
+        path: Path of the WAV file
+
+    Returns:
+        Tuple of the sample rate, the number of channels, the bytes per sample, the offset of the
+        PCM data in the file and its size in whole frames
+    """
+    with open(path, "rb") as f:
+        riff, _, form = WAV_RIFF_HEADER.unpack(f.read(WAV_RIFF_HEADER.size))
+        if riff != b'RIFF' or form != b'WAVE':
+            raise ValueError("{} is not a WAV file".format(path))
+        fmt = None
+        while True:
+            header = f.read(WAV_CHUNK_HEADER.size)
+            if len(header) < WAV_CHUNK_HEADER.size:
+                raise ValueError("{} has no data chunk".format(path))
+            chunk_id, chunk_size = WAV_CHUNK_HEADER.unpack(header)
+            if chunk_id == b'data':
+                break
+            if chunk_id == b'fmt ':
+                fmt = WAV_FMT_FIELDS.unpack(f.read(WAV_FMT_FIELDS.size))
+                chunk_size -= WAV_FMT_FIELDS.size
+            # Chunks are padded to an even size
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+        if fmt is None:
+            raise ValueError("{} has no fmt chunk before its data".format(path))
+        format_tag, num_channels, sample_rate, _, block_align, bits_per_sample = fmt
+        if format_tag != 1:
+            raise ValueError("{} is not PCM audio".format(path))
+        return sample_rate, num_channels, bits_per_sample // 8, f.tell(), chunk_size // block_align * block_align
+
+def verify_wav(path, sample_rate, num_channels, data_size):
+    """
+    Check with the wave module that a WAV file has the given format and amount of data.
+
+    Args:
+        path: Path of the WAV file
+        sample_rate: Expected samples per second of every channel
+        num_channels: Expected number of channels
+        data_size: Expected size of the PCM data in bytes
     """
-    for root, dirs, files in os.walk(parent_folder):
-        # Only process subfolders, not the parent itself
-        if root == parent_folder:
-            for d in dirs:
-                subfolder = os.path.join(root, d)
-                merge_wav_and_ts_files(subfolder)
-            break
-        # If you want to process recursively, remove the break and process every root
-        # merge_wav_and_ts_files(root)
+    with wave.open(str(path), "rb") as w:
+        found = (w.getframerate(), w.getnchannels(), w.getsampwidth(), w.getnframes() * w.getnchannels() * w.getsampwidth())
+    expected = (sample_rate, num_channels, SAMPLE_WIDTH, data_size)
+    if found != expected or os.path.getsize(path) != WAV_HEADER_SIZE + data_size:
+        raise ValueError("{} does not have the expected format and size, (sample rate, channels, sample width, "
+                         "data size) is {} instead of {}".format(path, found, expected))
+
+def merge_wav_files(files, merged_name):
+    """
+    Concatenate WAV files into one. The header of the merged file is written once, from the sizes
+    of the parts, and the audio data of every part is then copied by copy_file_data, so the
+    files are never loaded into memory. The merged file is verified after writing.
+
+    Args:
+        files: Paths of the WAV files, in order
+        merged_name: Path of the merged WAV file
+
+    Raises:
+        ValueError if the files differ in sample rate, number of channels or sample width, or if
+        the merged file does not verify, in which case it is removed
+    """
+    layouts = [read_wav_layout(f) for f in files]
+    sample_rate, num_channels = layouts[0][:2]
+    for f, (rate, channels, sample_width, _, _) in zip(files, layouts):
+        if (rate, channels, sample_width) != (sample_rate, num_channels, SAMPLE_WIDTH):
+            raise ValueError("{} has {} Hz, {} channels and {} bytes per sample, expected {} Hz, {} channels and {} "
+                             "bytes per sample".format(f, rate, channels, sample_width, sample_rate, num_channels,
+                                                       SAMPLE_WIDTH))
+    data_size = sum(layout[4] for layout in layouts)
+
+    try:
+        with open(merged_name, "wb") as dst:
+            dst.write(wav_header(num_channels, sample_rate, data_size))
+            for f, (_, _, _, offset, size) in zip(files, layouts):
+                with open(f, "rb") as src:
+                    copy_file_data(src, dst, size, offset)
+        verify_wav(merged_name, sample_rate, num_channels, data_size)
+    except Exception:
+        if os.path.exists(merged_name):
+            os.remove(merged_name)
+        raise
 
 def merge_wav_and_ts_files(folder):
     """
-    Merge all .wav and -ts.csv files in the given folder, grouped by prefix and sorted by trailing number.
-    Output merged files to the same folder and delete originals.
+    Merge all .wav, -ts.npy and -ts.csv files in the given folder, grouped by prefix and sorted by trailing number.
+    Output merged files to the same folder and delete the originals once they are merged. Groups
+    of .wav files that cannot be merged, e.g. because their formats differ, are left as they are.
+
+    Returns:
+        Tuple of the names of the merged files and the errors of the groups that were not merged
     """
     folder = Path(folder)
-    # Find all .wav and -ts.csv files
+    # Find all .wav, -ts.npy and -ts.csv files
     wav_files = list(folder.glob("*MICHI*.wav")) + list(folder.glob("*MICLO*.wav"))
-    ts_files = list(folder.glob("*MICHI*-ts.csv")) + list(folder.glob("*MICLO*-ts.csv"))
+    ts_files = list(folder.glob("*MICHI*-ts.npy")) + list(folder.glob("*MICLO*-ts.npy"))
+    ts_csv_files = list(folder.glob("*MICHI*-ts.csv")) + list(folder.glob("*MICLO*-ts.csv"))
 
     def group_and_sort(files, pattern):
         groups = {}
@@ -41,66 +164,57 @@ def merge_wav_and_ts_files(folder):
             groups[prefix].sort()
         return groups
 
-    # Patterns: e.g., 0MICHI1.wav, 0MICHI99.wav, 0MICHI1-ts.csv
+    # Patterns: e.g., 0MICHI1.wav, 0MICHI99.wav, 0MICHI1-ts.npy, 0MICHI1-ts.csv
     wav_pattern = r"(\d+MICHI|\d+MICLO)(\d+)\.wav"
-    ts_pattern = r"(\d+MICHI|\d+MICLO)(\d+)-ts\.csv"
+    ts_pattern = r"(\d+MICHI|\d+MICLO)(\d+)-ts\.npy"
+    ts_csv_pattern = r"(\d+MICHI|\d+MICLO)(\d+)-ts\.csv"
 
     wav_groups = group_and_sort(wav_files, wav_pattern)
     ts_groups = group_and_sort(ts_files, ts_pattern)
+    ts_csv_groups = group_and_sort(ts_csv_files, ts_csv_pattern)
+
+    merged = []
+    failed = []
 
     # Merge .wav files
     for prefix, files in wav_groups.items():
-        merged_audio = []
-        sample_rate = None
-        num_channels = None
-        for _, f in files:
-            sr, data = None, None
-            try:
-                sr, data = read_wav(str(f))
-            except Exception:
-                from scipy.io.wavfile import read as read_wav
-                sr, data = read_wav(str(f))
-            if sample_rate is None:
-                sample_rate = sr
-            if num_channels is None:
-                num_channels = data.shape[1] if data.ndim > 1 else 1
-            merged_audio.append(data)
-        merged_audio = np.concatenate(merged_audio, axis=0)
         merged_name = folder / (prefix + "_merged.wav")
-        write(str(merged_name), sample_rate, merged_audio)
-        # Delete originals
+        try:
+            merge_wav_files([f for _, f in files], merged_name)
+        except (ValueError, OSError) as e:
+            failed.append("Not merging the {} files: {}".format(prefix, e))
+            continue
+        merged.append(merged_name.name)
+        # Delete originals, now that the merged file has been verified
         for _, f in files:
             f.unlink()
 
-    # Merge -ts.csv files
+    # Merge -ts.npy files, the raw int64 timestamps
     for prefix, files in ts_groups.items():
-        merged_rows = []
-        idx = 0
+        merged_name = folder / (prefix + "-ts_merged.npy")
+        np.save(merged_name, np.concatenate([np.load(f) for _, f in files]))
+        merged.append(merged_name.name)
+        # Delete originals
         for _, f in files:
-            with open(f, "r") as fin:
-                lines = fin.readlines()
-                if not merged_rows:
-                    merged_rows.append(lines[0])  # header
-                for line in lines[1:]:
-                    parts = line.strip().split(",", 1)
-                    if len(parts) == 2:
-                        merged_rows.append("{},{}\n".format(idx, parts[1]))
-                        idx += 1
+            f.unlink()
+
+    # Merge -ts.csv files, renumbering the index
+    for prefix, files in ts_csv_groups.items():
         merged_name = folder / (prefix + "-ts_merged.csv")
-        with open(merged_name, "w") as fout:
-            fout.writelines(merged_rows)
+        write_times_csv(np.concatenate([read_times_csv(f) for _, f in files]), merged_name)
+        merged.append(merged_name.name)
         # Delete originals
         for _, f in files:
             f.unlink()
 
-# Helper for reading wav files (for Python 2/3 compatibility)
-def read_wav(filename):
-    from scipy.io import wavfile
-    return wavfile.read(filename)
+    return merged, failed
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description='Merge audio and timestamp files in all subfolders')
     parser.add_argument('--fn', required=True, help='Please enter the path to the parent folder')
+    parser.add_argument('--recursive', action='store_true',
+                        help='Merge the files in the parent folder and all folders below it, not only its subfolders')
+    parser.add_argument('--jobs', default=1, type=int, help='Number of folders to merge in parallel processes, 0 for one per CPU')
     args = parser.parse_args()
-    merge_all_subfolders(args.fn)
\ No newline at end of file
+    merge_all_subfolders(args.fn, recursive=args.recursive, jobs=args.jobs)
\ No newline at end of file
@@ -1,28 +1,142 @@
 #!/usr/bin/env python
 
-from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime as dt, timedelta
+import os
 from pathlib import Path
 
-def parse_timestamps(timestamps, sensor_name):
+import numpy as np
+from tqdm import tqdm
+
+_EPOCH = dt(1970, 1, 1)
+_ONE_MS = timedelta(milliseconds=1)
+_SECONDS_PER_HOUR = 3600
+# Range of timestamps that datetime can represent, in ms since the epoch
+_MIN_MS = (dt.min - _EPOCH) // _ONE_MS
+_MAX_MS = (dt.max - _EPOCH) // _ONE_MS
+
+
+def _utc_offset_ms(seconds):
     """
-    Convert raw timestamps to datetime objects.
-    
+    Offset of local time from UTC at a moment, as applied by datetime.fromtimestamp.
+
     Args:
-        timestamps: List of raw timestamp values
-        sensor_name: Name of the sensor for error reporting
-    
+        seconds: Whole seconds since the epoch
+
+    Returns:
+        Offset in milliseconds
+    """
+    return (dt.fromtimestamp(seconds) - _EPOCH - timedelta(seconds=seconds)) // _ONE_MS
+
+
+def _local_offsets(timestamps_ms):
+    """
+    Look up the local UTC offset of every timestamp. The offset is computed once per hour that
+    occurs in the data, and a change of offset within an hour (e.g. daylight saving time) is
+    located to the second by bisection.
+
+    Args:
+        timestamps_ms: Array of int64 milliseconds since the epoch
+
     Returns:
-        List of datetime objects or "Date error" strings for failed conversions
+        Tuple of the int64 offsets in milliseconds and a boolean mask of the timestamps for which
+        the local time could be determined
     """
-    sensor_name = Path(sensor_name).stem
-    error_reported = False
-    timestamps_dt = []
-    for x in timestamps:
+    hours, inverse = np.unique(timestamps_ms // (_SECONDS_PER_HOUR * 1000), return_inverse=True)
+    offset_before = np.zeros(len(hours), dtype=np.int64)
+    offset_after = np.zeros(len(hours), dtype=np.int64)
+    change_ms = np.zeros(len(hours), dtype=np.int64)
+    hour_valid = np.ones(len(hours), dtype=bool)
+
+    for i, hour in enumerate(hours.tolist()):
+        start = hour * _SECONDS_PER_HOUR
+        end = start + _SECONDS_PER_HOUR - 1
         try:
-            timestamps_dt.append(dt.fromtimestamp(float(x[0])/1000))
-        except Exception as e:
-            if error_reported is False:
-                print('Error in timestamp conversion for sensor {}: {}'.format(sensor_name, str(e)))
-                error_reported = True
-            timestamps_dt.append("Date error")
-    return timestamps_dt 
\ No newline at end of file
+            before = _utc_offset_ms(start)
+            after = _utc_offset_ms(end)
+            if before == after:
+                end = start
+            # First second of the hour that has the offset of the end of the hour
+            while start < end:
+                middle = (start + end) // 2
+                if _utc_offset_ms(middle) == after:
+                    end = middle
+                else:
+                    start = middle + 1
+        except (OverflowError, OSError, ValueError):
+            hour_valid[i] = False
+            continue
+        offset_before[i] = before
+        offset_after[i] = after
+        change_ms[i] = end * 1000
+
+    offsets = np.where(timestamps_ms >= change_ms[inverse], offset_after[inverse], offset_before[inverse])
+    return offsets, hour_valid[inverse]
+
+
+def parse_timestamps(timestamps, sensor_name, local_time=True):
+    """
+    Convert raw timestamps to datetimes.
+
+    Args:
+        timestamps: Array or list of raw timestamp values, in milliseconds since the epoch. An
+            (N, 1) array is treated as N timestamps.
+        sensor_name: Name of the sensor for error reporting
+        local_time: Convert to the local time of this machine, like datetime.fromtimestamp, instead
+            of UTC
+
+    Returns:
+        datetime64[ms] array, with NaT for timestamps that cannot be converted
+    """
+    raw = np.asarray(timestamps).reshape(-1)
+    if raw.dtype.kind == 'u':
+        valid = raw <= _MAX_MS
+        timestamps_ms = np.where(valid, raw, 0).astype(np.int64)
+    else:
+        timestamps_ms = raw.astype(np.int64)
+        valid = (timestamps_ms >= _MIN_MS) & (timestamps_ms <= _MAX_MS)
+
+    if local_time and valid.any():
+        offsets, offset_valid = _local_offsets(timestamps_ms[valid])
+        local_ms = timestamps_ms[valid] + offsets
+        timestamps_ms[valid] = local_ms
+        valid[valid] = offset_valid & (local_ms >= _MIN_MS) & (local_ms <= _MAX_MS)
+
+    timestamps_dt = timestamps_ms.astype('datetime64[ms]')
+    num_errors = len(valid) - np.count_nonzero(valid)
+    if num_errors:
+        print('Error in timestamp conversion for sensor {}: {} of {} timestamps are out of range'.format(
+            Path(sensor_name).stem, num_errors, len(valid)))
+        timestamps_dt[~valid] = np.datetime64('NaT')
+    return timestamps_dt
+
+
+def process_files_in_parallel(function, file_paths, jobs, desc="Files", size=os.path.getsize):
+    """
+    Run a function on every file (or folder) in a pool of worker processes. Each worker writes
+    the outputs of its file itself and only sends a small summary back. The largest files are
+    handed out first, so a big file does not hold up the end of the run.
+
+    Args:
+        function: Picklable function (e.g. a module level function or a functools.partial of one)
+            that processes the file at the path it is called with
+        file_paths: Paths of the files to process
+        jobs: Number of worker processes, or 0 to use all CPUs
+        desc: Label of the progress bar
+        size: Function that gives the size of a path, used to hand out the largest first
+
+    Returns:
+        List of (file_path, summary) tuples of the files that were processed, in completion
+        order. Files that failed are reported and left out.
+    """
+    file_paths = sorted(file_paths, key=size, reverse=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        futures = {executor.submit(function, file_path): file_path for file_path in file_paths}
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            file_path = futures[future]
+            try:
+                results.append((file_path, future.result()))
+            except Exception as e:
+                print("Error processing {}: {}".format(file_path, e))
+    return results
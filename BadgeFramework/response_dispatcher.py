@@ -0,0 +1,124 @@
+from __future__ import division, absolute_import, print_function
+import collections
+import logging
+import struct
+import time
+
+from badge_protocol import *
+
+logger = logging.getLogger(__name__)
+
+# Attribute of Response.type holding the decoded response, for every response tag
+RESPONSE_ATTRIBUTES = {
+    Response_status_response_tag: 'status_response',
+    Response_start_microphone_response_tag: 'start_microphone_response',
+    Response_start_scan_response_tag: 'start_scan_response',
+    Response_start_imu_response_tag: 'start_imu_response',
+    Response_free_sdc_space_response_tag: 'free_sdc_space_response',
+    Response_sdc_errase_all_response_tag: 'sdc_errase_all_response',
+    Response_get_imu_data_response_tag: 'get_imu_data_response',
+    Response_get_fw_version_response_tag: 'get_fw_version_response',
+    Response_list_files_response_tag: 'list_files_response',
+    Response_start_download_response_tag: 'start_download_response',
+    Response_download_chunk_response_tag: 'download_chunk_response',
+    Response_get_file_checksum_response_tag: 'get_file_checksum_response',
+}
+
+
+# ResponseFuture is the response to a request that has been sent to the badge but may not
+#   have been answered yet. result() receives responses until this one has arrived.
+class ResponseFuture(object):
+    def __init__(self, dispatcher, response_tag):
+        self.dispatcher = dispatcher
+        self.response_tag = response_tag
+        self.response = None
+        self.error = None
+        self._done = False
+
+    def done(self):
+        return self._done
+
+    def set_result(self, response):
+        self.response = response
+        self._done = True
+
+    def set_error(self, error):
+        self.error = error
+        self._done = True
+
+    # Returns the response, waiting at most `timeout` seconds for it (None waits forever).
+    def result(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._done:
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+            if not self.dispatcher.receive(remaining) and deadline is not None and time.time() >= deadline:
+                raise Exception("No response with tag {} recieved within {} seconds".format(
+                    self.response_tag, timeout))
+
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+# ResponseDispatcher reads the responses from a BadgeConnection and hands each one to whoever
+#   is waiting for it.
+# The badge answers requests in the order it recieves them, so every response tag has a FIFO
+#   of futures, one per request in flight; several requests, of the same or different types,
+#   can be outstanding at once. A handler set for a tag takes all responses with that tag
+#   instead, for responses that are matched up by their content, like download chunks.
+# Like the connections, a dispatcher must only be used from one thread.
+class ResponseDispatcher(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.waiters = dict((tag, collections.deque()) for tag in RESPONSE_ATTRIBUTES)
+        self.handlers = {}
+
+    # Registers a request with response_tag as in flight. Call before sending the request.
+    def expect(self, response_tag):
+        future = ResponseFuture(self, response_tag)
+        self.waiters[response_tag].append(future)
+        return future
+
+    # Stops waiting for the response of a request that could not be sent.
+    def forget(self, future):
+        waiters = self.waiters[future.response_tag]
+        if future in waiters:
+            waiters.remove(future)
+
+    # Passes every following response with response_tag to handler(response), until the
+    #   handler is removed by setting it to None.
+    def set_handler(self, response_tag, handler):
+        if handler is None:
+            self.handlers.pop(response_tag, None)
+        else:
+            self.handlers[response_tag] = handler
+
+    # Fails all futures still waiting for a response, e.g. when the receive buffer was cleared
+    #   and their responses will never be matched up.
+    def cancel_all(self, reason="Request was cancelled"):
+        for waiters in self.waiters.values():
+            while waiters:
+                waiters.popleft().set_error(Exception(reason))
+
+    # Receives and dispatches one response.
+    # Returns False if none arrived within `timeout` seconds (None waits forever).
+    def receive(self, timeout=None):
+        serialized_response_len = self.connection.await_data(2, timeout=timeout)
+        if serialized_response_len is None:
+            return False
+
+        response_len = struct.unpack("<H", serialized_response_len)[0]
+        serialized_response = self.connection.await_data(response_len)
+        response_message = Response.decode(serialized_response)
+
+        response_tag = response_message.type.which
+        response = getattr(response_message.type, RESPONSE_ATTRIBUTES[response_tag])
+
+        handler = self.handlers.get(response_tag)
+        if handler is not None:
+            handler(response)
+        elif self.waiters[response_tag]:
+            self.waiters[response_tag].popleft().set_result(response)
+        else:
+            logger.debug("Dropping unexpected response with tag {}".format(response_tag))
+        return True
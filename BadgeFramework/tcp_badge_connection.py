@@ -0,0 +1,105 @@
+from __future__ import division, absolute_import, print_function
+import logging
+import socket
+import time
+
+from badge_connection import *
+
+logger = logging.getLogger(__name__)
+
+# Addresses of the form tcp://host:port refer to badges served over TCP, e.g. by badge_simulator.py
+TCP_ADDRESS_PREFIX = "tcp://"
+# Most bytes read from the socket at a time
+RECEIVE_SIZE = 4096
+
+
+# Returns the (host, port) of a tcp://host:port address.
+def parse_tcp_address(address):
+    if not address.startswith(TCP_ADDRESS_PREFIX):
+        raise ValueError("{} is not a {}host:port address".format(address, TCP_ADDRESS_PREFIX))
+    host, _, port = address[len(TCP_ADDRESS_PREFIX):].rpartition(":")
+    return host, int(port)
+
+
+# TCPBadgeConnection implements the BadgeConnection interface over a TCP socket, to a process
+#   that speaks the badge protocol, like badge_simulator.py. The messages are framed exactly
+#   like over BLE; the socket takes the place of the UART service.
+class TCPBadgeConnection(BadgeConnection):
+    def __init__(self, host, port, connect_timeout=10.0):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.sock = None
+
+        # Contains the bytes recieved from the device. Held here until an entire message is recieved.
+        self.rx_buffer = ReceiveBuffer()
+
+        BadgeConnection.__init__(self)
+
+    # Returns a TCPBadgeConnection to the badge at the tcp://host:port address device_addr.
+    @classmethod
+    def get_connection_to_badge(cls, device_addr, timeout_seconds=10.0):
+        host, port = parse_tcp_address(device_addr)
+        return cls(host, port, connect_timeout=timeout_seconds)
+
+    # Implements BadgeConnection's connect() spec.
+    def connect(self):
+        logger.debug("Connecting to {}:{}...".format(self.host, self.port))
+        self.sock = socket.create_connection((self.host, self.port), self.connect_timeout)
+        # Requests are small and answered one by one, so do not hold them back to fill packets
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.debug("Connected.")
+
+    # Implements BadgeConnections's disconnect() spec.
+    def disconnect(self):
+        self.rx_buffer.clear()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    # Implements BadgeConnection's is_connected() spec.
+    def is_connected(self):
+        return self.sock is not None
+
+    # Implements BadgeConnection's await_data() spec.
+    def await_data(self, data_len, timeout=None):
+        if not self.is_connected():
+            raise RuntimeError("TCPBadgeConnection not connected before await_data()!")
+
+        return self._receive(data_len, timeout)
+
+    # Implements BadgeConnection's send() spec.
+    def send(self, message, response_len=0):
+        if not self.is_connected():
+            raise RuntimeError("TCPBadgeConnection not connected before send()!")
+
+        self.sock.sendall(message)
+
+        return self._receive(response_len)
+
+    # Blocks until rx_bytes_expected bytes are in the receive buffer and returns them,
+    #   or returns None if a timeout is given and it expires first.
+    def _receive(self, rx_bytes_expected, timeout=None):
+        if rx_bytes_expected <= 0:
+            return None
+
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            rx_message = self.rx_buffer.take(rx_bytes_expected)
+            if rx_message is not None:
+                return rx_message
+
+            wait_time = None
+            if deadline is not None:
+                wait_time = deadline - time.time()
+                if wait_time <= 0:
+                    return None
+
+            self.sock.settimeout(wait_time)
+            try:
+                data = self.sock.recv(RECEIVE_SIZE)
+            except socket.timeout:
+                continue
+            if not data:
+                raise RuntimeError("Badge at {}:{} closed the connection".format(self.host, self.port))
+            self.rx_buffer.put(data)
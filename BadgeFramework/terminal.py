@@ -165,6 +165,8 @@ def main():
 			if result['success'] > 0:
 				print("\nDownload Summary:")
 				print(" - Successfully downloaded: {}/{} files".format(result['success'], result['total']))
+				if result['skipped'] > 0:
+					print(" - Already up to date: {} files".format(result['skipped']))
 				if result['failed'] > 0:
 					print(" - Failed files: {}".format(result['failed']))
 
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+import binascii
+import ctypes
+import struct
+import unittest
+
+from badge import OpenBadge
+from badge_protocol import *
+from emulated_badge_connection import EmulatedBadge, EmulatedBadgeConnection
+
+
+# The list files response as laid out by the firmware, mirroring the structs of
+#   rythmbadge/protocol_messages.h. None of them are packed, so the union in Response starts at
+#   offset 4 and the FileInfo entries are aligned to their uint32_t members.
+class _FileInfo(ctypes.LittleEndianStructure):
+    _fields_ = [('filename', ctypes.c_char * MAX_FILENAME_LENGTH),
+                ('file_size', ctypes.c_uint32),
+                ('timestamp', ctypes.c_uint32)]
+
+
+class _ListFilesResponseHeader(ctypes.LittleEndianStructure):
+    _fields_ = [('file_count', ctypes.c_uint8),
+                ('total_files', ctypes.c_uint8),
+                ('start_index', ctypes.c_uint8)]
+
+
+class _ListFilesResponse(ctypes.LittleEndianStructure):
+    _fields_ = [('header', _ListFilesResponseHeader),
+                ('files', _FileInfo * 3)]
+
+
+class _Response(ctypes.LittleEndianStructure):
+    _fields_ = [('which_type', ctypes.c_uint8),
+                ('list_files_response', _ListFilesResponse)]
+
+
+# The firmware sends sizeof(Response.type) bytes, counted from the start of Response
+#   (rythmbadge/request_handler_lib.c, send_response()). ListFilesResponse is the largest
+#   member of the union.
+TRANSMITTED_LENGTH = ctypes.sizeof(_ListFilesResponse)
+
+FILES = [(b'00001.txt', 123456, 0x5432), (b'00002.txt', 300, 0x5433), (b'MIC_L.dat', 0x01020304, 0)]
+
+
+# Returns the bytes the firmware transmits for a list files response with `files`.
+def firmware_list_files_response(files, total_files, start_index):
+    response = _Response()
+    response.which_type = Response_list_files_response_tag
+    response.list_files_response.header.file_count = len(files)
+    response.list_files_response.header.total_files = total_files
+    response.list_files_response.header.start_index = start_index
+    for i, (filename, file_size, timestamp) in enumerate(files):
+        response.list_files_response.files[i].filename = filename
+        response.list_files_response.files[i].file_size = file_size
+        response.list_files_response.files[i].timestamp = timestamp
+    return ctypes.string_at(ctypes.addressof(response), ctypes.sizeof(response))[:TRANSMITTED_LENGTH]
+
+
+def list_files_request(start_index, max_files):
+    request = Request()
+    request.type.which = Request_list_files_request_tag
+    request.type.list_files_request = ListFilesRequest()
+    request.type.list_files_request.start_index = start_index
+    request.type.list_files_request.max_files = max_files
+    serialized_request = request.encode()
+    return struct.pack('<H', len(serialized_request)) + serialized_request
+
+
+class ListFilesResponseTest(unittest.TestCase):
+    def test_decode_firmware_layout(self):
+        buf = firmware_list_files_response(FILES[:2], total_files=7, start_index=4)
+        list_files_response = Response.decode(buf).type.list_files_response
+
+        self.assertEqual(list_files_response.header.file_count, 2)
+        self.assertEqual(list_files_response.header.total_files, 7)
+        self.assertEqual(list_files_response.header.start_index, 4)
+        self.assertEqual([(f.filename.encode('utf-8'), f.file_size, f.timestamp)
+                          for f in list_files_response.files], FILES[:2])
+
+    def test_decode_page_with_a_file_cut_off(self):
+        buf = firmware_list_files_response(FILES, total_files=7, start_index=4)
+        list_files_response = Response.decode(buf).type.list_files_response
+
+        self.assertEqual(list_files_response.header.file_count, len(list_files_response.files))
+        self.assertEqual([(f.filename.encode('utf-8'), f.file_size, f.timestamp)
+                          for f in list_files_response.files], FILES[:2])
+
+    def test_emulated_badge_matches_firmware_layout(self):
+        badge = EmulatedBadge()
+        for filename, file_size, timestamp in FILES:
+            badge.add_file(filename.decode('utf-8'), b'\x00' * file_size, timestamp)
+
+        for max_files in (2, 3):
+            response = badge.handle_request(list_files_request(0, max_files))
+            self.assertEqual(response, struct.pack('<H', TRANSMITTED_LENGTH) + firmware_list_files_response(
+                FILES[:max_files], total_files=3, start_index=0))
+
+    def test_list_all_files_of_emulated_badge(self):
+        files = dict(('DATA{}.BIN'.format(i), b'\x00' * i) for i in range(8))
+        connection = EmulatedBadgeConnection(EmulatedBadge(files), latency=0)
+        connection.connect()
+
+        listed = OpenBadge(connection).list_files()
+        self.assertEqual(sorted((f['filename'], f['size']) for f in listed),
+                         sorted((filename, len(data)) for filename, data in files.items()))
+
+
+def make_timestamp(seconds, ms):
+    timestamp = Timestamp()
+    timestamp.seconds = seconds
+    timestamp.ms = ms
+    return timestamp
+
+
+def make_request(which, attribute, message, **fields):
+    request = Request()
+    request.type.which = which
+    setattr(request.type, attribute, message)
+    for name, value in fields.items():
+        setattr(message, name, value)
+    return request
+
+
+# Returns the fields of a decoded message, with nested messages and data as plain values.
+def message_fields(message):
+    fields = {}
+    for name, value in vars(message).items():
+        if hasattr(value, '__dict__'):
+            value = message_fields(value)
+        elif isinstance(value, memoryview):
+            value = value.tobytes()
+        fields[name] = value
+    return fields
+
+
+def status_request():
+    badge_assignement = BadgeAssignement()
+    badge_assignement.ID = 513
+    badge_assignement.group = 7
+    return make_request(Request_status_request_tag, 'status_request', StatusRequest(),
+                        timestamp=make_timestamp(1700000000, 123), has_badge_assignement=1,
+                        badge_assignement=badge_assignement)
+
+
+def get_imu_data_request():
+    return make_request(Request_get_imu_data_request_tag, 'get_imu_data_request', GetIMUDataRequest())
+
+
+def download_chunk_request():
+    return make_request(Request_download_chunk_request_tag, 'download_chunk_request', DownloadChunkRequest(),
+                        chunk_index=0x01020304)
+
+
+def get_file_checksum_request():
+    return make_request(Request_get_file_checksum_request_tag, 'get_file_checksum_request',
+                        GetFileChecksumRequest(), filename=u'00001.txt')
+
+
+# Arbitrary response bytes after the tag, so every field decodes to a different value
+PATTERN = bytes(bytearray((i * 37 + 11) & 0xFF for i in range(1, 64)))
+
+
+# The expected bytes and fields below are those of badge_protocol before its messages were
+#   encoded and decoded with precompiled structs, including the offsets its decoders read at.
+class MessageCodecTest(unittest.TestCase):
+    def test_encode_requests(self):
+        for request, expected in [(status_request(), '0100f153657b0001010207'),
+                                  (get_imu_data_request(), '21'),
+                                  (download_chunk_request(), '2804030201'),
+                                  (get_file_checksum_request(), '2930303030312e747874000000')]:
+            self.assertEqual(request.encode(), binascii.unhexlify(expected))
+
+    def test_requests_round_trip(self):
+        for request, attribute in [(status_request(), 'status_request'),
+                                   (get_imu_data_request(), 'get_imu_data_request'),
+                                   (download_chunk_request(), 'download_chunk_request'),
+                                   (get_file_checksum_request(), 'get_file_checksum_request')]:
+            decoded = Request.decode(request.encode())
+            self.assertEqual(decoded.type.which, request.type.which)
+            self.assertEqual(message_fields(getattr(decoded.type, attribute)),
+                             message_fields(getattr(request.type, attribute)))
+
+    def test_encode_status_response(self):
+        response = StatusResponse()
+        response.clock_status, response.microphone_status, response.scan_status, response.imu_status = 1, 0, 1, 1
+        response.battery_level, response.pdm_data, response.scan_data, response.time_delta = 87, -1234, -56, -789012
+        response.timestamp = make_timestamp(1700000000, 456)
+        self.assertEqual(response.encode(), binascii.unhexlify('0100010100f15365c801572efbc8ecf5f3ff'))
+
+    def test_encode_imu_data_response(self):
+        response = GetIMUDataResponse()
+        for i, name in enumerate(['gyr_x', 'gyr_y', 'gyr_z', 'mag_x', 'mag_y', 'mag_z',
+                                  'acc_x', 'acc_y', 'acc_z', 'rot_x', 'rot_y', 'rot_z']):
+            setattr(response, name, 10 * i + 3)
+        response.timestamp = make_timestamp(1700000000, 456)
+        self.assertEqual(response.encode(), binascii.unhexlify('030d17212b353f49535d677100f15365c801'))
+
+    def test_decode_status_response(self):
+        response = Response.decode(struct.pack('<B', Response_status_response_tag) + PATTERN).type.status_response
+        self.assertEqual(message_fields(response), {
+            'clock_status': 159, 'microphone_status': 196, 'scan_status': 233, 'imu_status': 14,
+            'battery_level': 51, 'pdm_data': 1174727, 'scan_data': 5359, 'time_delta': -1619372752,
+            'timestamp': {'seconds': 856615364, 'ms': 32088}})
+
+    def test_decode_imu_data_response(self):
+        buf = struct.pack('<B', Response_get_imu_data_response_tag) + PATTERN
+        response = Response.decode(buf).type.get_imu_data_response
+        self.assertEqual(message_fields(response), {
+            'gyr_x': -1.5201, 'gyr_y': 0.3817, 'gyr_z': 2.2579,
+            'mag_x': -2.3939, 'mag_y': -0.4921, 'mag_z': 1.3841,
+            'acc_x': -3.2677, 'acc_y': -1.3659, 'acc_z': 0.5359,
+            'rot_x': 2.4121, 'rot_y': -2.2397, 'rot_z': -0.3379,
+            'timestamp': {'seconds': 2675594544, 'ms': 59844}})
+
+    def test_decode_download_chunk_response(self):
+        data = PATTERN[:DOWNLOAD_CHUNK_SIZE]
+        buf = struct.pack('<B3xIH%dsB' % DOWNLOAD_CHUNK_SIZE, Response_download_chunk_response_tag, 0x00ABCDEF,
+                          DOWNLOAD_CHUNK_SIZE, data, 1).ljust(64, b'\x00')
+        response = Response.decode(buf).type.download_chunk_response
+        self.assertEqual(message_fields(response), {
+            'chunk_index': 0x00ABCDEF, 'chunk_size': DOWNLOAD_CHUNK_SIZE, 'data': data, 'is_last_chunk': 1})
+
+    def test_decode_file_checksum_response(self):
+        buf = struct.pack('<B3xIB', Response_get_file_checksum_response_tag, 0xDEADBEEF, 1).ljust(64, b'\x00')
+        response = Response.decode(buf).type.get_file_checksum_response
+        self.assertEqual(message_fields(response), {'checksum': 0xDEADBEEF, 'success': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from download_utilities import crc32_file
+
+BLOCK_SIZE = 64
+
+
+# The bitwise CRC32 of the firmware, which OpenBadge computed before crc32_file was used.
+def reference_crc32(data):
+    crc = 0xFFFFFFFF
+    for byte in bytearray(data):
+        crc ^= byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xEDB88320
+            else:
+                crc >>= 1
+    return (~crc) & 0xFFFFFFFF
+
+
+class Crc32FileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.random = random.Random(1234)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, data):
+        path = os.path.join(self.directory, "data.bin")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_matches_reference(self):
+        for length in [0, 1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 3 * BLOCK_SIZE + 17, 1000]:
+            data = bytes(bytearray(self.random.getrandbits(8) for _ in range(length)))
+            path = self.write_file(data)
+            self.assertEqual(crc32_file(path, block_size=BLOCK_SIZE), reference_crc32(data), length)
+            self.assertEqual(crc32_file(path), reference_crc32(data), length)
+
+    def test_known_value(self):
+        self.assertEqual(crc32_file(self.write_file(b"123456789"), block_size=4), 0xCBF43926)
+
+
+if __name__ == '__main__':
+    unittest.main()